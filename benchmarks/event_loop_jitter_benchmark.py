@@ -0,0 +1,157 @@
+"""
+Measure how much converting the requests (see `RoutedRequest`) holds up the
+event loop - i.e. the jitter every other stream served by the same worker sees
+in its token stream - under a mixed load of small requests and the occasional
+big one (a long conversation), with the big ones converted inline and in a
+worker thread (CONVERSION_OFFLOAD_MIN_BYTES). No upstream is involved, only the
+conversion is measured. See `docs/PERFORMANCE.md` for how to interpret the
+results.
+
+Usage:
+    uv run python benchmarks/event_loop_jitter_benchmark.py [--big-mb 5] [--duration 10]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# How often the simulated streams expect to emit a token
+_TOKEN_INTERVAL = 0.005
+
+
+def _conversation(total_bytes: int, message_bytes: int = 4_000) -> list[dict]:
+    messages: list[dict] = [{"role": "system", "content": "You are a coding agent."}]
+    for idx in range(max(total_bytes // (2 * message_bytes), 1)):
+        messages.append({"role": "user", "content": [{"type": "text", "text": f"{idx} " + "x" * message_bytes}]})
+        messages.append(
+            {
+                "role": "assistant",
+                "content": "y" * message_bytes,
+                "tool_calls": [
+                    {
+                        "id": f"call_{idx}",
+                        "type": "function",
+                        "function": {"name": "Read", "arguments": json.dumps({"file_path": f"/src/{idx}.py"})},
+                    }
+                ],
+            }
+        )
+        messages.append({"role": "tool", "tool_call_id": f"call_{idx}", "content": "z" * 200})
+    messages.append({"role": "user", "content": "Go on."})
+    return messages
+
+
+async def _stream(lateness: list[float], stop_at: float) -> None:
+    # A stream that is due to emit a token every _TOKEN_INTERVAL - how late it
+    # gets to do so is the jitter its client sees
+    loop = asyncio.get_running_loop()
+    while loop.time() < stop_at:
+        due_at = loop.time() + _TOKEN_INTERVAL
+        await asyncio.sleep(_TOKEN_INTERVAL)
+        lateness.append(loop.time() - due_at)
+
+
+async def _convert_requests(messages: list[dict], every: float, stop_at: float, model: str) -> int:
+    # pylint: disable=import-outside-toplevel
+    from claude_code_proxy.routed_request import RoutedRequest
+
+    loop = asyncio.get_running_loop()
+    conversions = 0
+    while loop.time() < stop_at:
+        routed_request = await RoutedRequest.acreate(
+            calling_method="astreaming",
+            model=model,
+            messages_original=messages,
+            params_original={"max_tokens": 32000, "tools": []},
+            stream=True,
+        )
+        # (What `ClaudeCodeRouter.astreaming()` does next)
+        await routed_request.aget_fingerprint()
+        conversions += 1
+        await asyncio.sleep(every)
+    return conversions
+
+
+async def _run(args: argparse.Namespace) -> dict:
+    # (Imported before the measurement starts)
+    import claude_code_proxy.claude_code_router  # pylint: disable=import-outside-toplevel,unused-import
+
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + args.duration
+    lateness: list[float] = []
+    small_messages = _conversation(4_000, message_bytes=1_000)
+    big_messages = _conversation(int(args.big_mb * 1024 * 1024))
+
+    results = await asyncio.gather(
+        *(_stream(lateness, stop_at) for _ in range(args.streams)),
+        *(_convert_requests(small_messages, 0.01, stop_at, args.model) for _ in range(4)),
+        _convert_requests(big_messages, args.big_every, stop_at, args.model),
+    )
+    lateness_ms = sorted(value * 1000 for value in lateness)
+    return {
+        "p50": statistics.median(lateness_ms),
+        "p99": lateness_ms[int(len(lateness_ms) * 0.99)],
+        "max": lateness_ms[-1],
+        "big": results[-1],
+        "small": sum(results[args.streams : -1]),
+    }
+
+
+def _run_in_subprocess(offload_min_bytes: int) -> dict:
+    env = {
+        **os.environ,
+        "CONVERSION_OFFLOAD_MIN_BYTES": str(offload_min_bytes),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-benchmark"),
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+        "WRITE_TRACES_TO_FILES": "false",
+        "PYTHONPATH": str(REPO_ROOT),
+    }
+    output = subprocess.run(
+        [sys.executable, __file__, "--child", *sys.argv[1:]],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--big-mb", type=float, default=5.0, help="Size of the big requests (MB)")
+    parser.add_argument("--big-every", type=float, default=0.5, help="Seconds between the big requests")
+    parser.add_argument("--streams", type=int, default=50, help="Number of concurrent streams to measure")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to keep the load up per mode")
+    parser.add_argument("--model", default="claude-sonnet-4-5")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_run(args))))
+        return
+
+    print(
+        f"{args.streams} streams, small requests + a {args.big_mb} MB request every {args.big_every}s, "
+        f"{args.duration}s per mode\n"
+    )
+    print(f"{'big requests':<14}  {'p50 (ms)':>8}  {'p99 (ms)':>8}  {'max (ms)':>8}  {'big':>5}  {'small':>6}")
+    for mode, offload_min_bytes in (("inline", 0), ("offloaded", 256 * 1024)):
+        started_at = time.perf_counter()
+        result = _run_in_subprocess(offload_min_bytes)
+        print(
+            f"{mode:<14}  {result['p50']:>8.2f}  {result['p99']:>8.2f}  {result['max']:>8.2f}  "
+            f"{result['big']:>5}  {result['small']:>6}  ({time.perf_counter() - started_at:.0f}s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
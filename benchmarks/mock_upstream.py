@@ -0,0 +1,252 @@
+"""
+A mock OpenAI-compatible upstream (ChatCompletions and Responses API, both
+streaming and non-streaming) for benchmarking the proxy without calling (and
+paying for) the actual models.
+
+Usage:
+    uv run uvicorn benchmarks.mock_upstream:app --port 8900 --workers 4
+
+Env vars:
+    MOCK_UPSTREAM_CHUNKS - number of text chunks per response (default: 50)
+    MOCK_UPSTREAM_CHUNK_DELAY - seconds between chunks (default: 0.01)
+    MOCK_UPSTREAM_FIRST_CHUNK_DELAY - seconds before the first chunk (default: 0.1)
+    MOCK_UPSTREAM_RESPAPI_ONLY_MODELS - comma-separated models to reject on the
+        ChatCompletions API, the way OpenAI does (default: none)
+    MOCK_UPSTREAM_UNSUPPORTED_PARAMS - comma-separated params to reject with
+        "Unsupported parameter", the way OpenAI does (default: none)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import Any, AsyncGenerator
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+MOCK_UPSTREAM_CHUNKS = int(os.getenv("MOCK_UPSTREAM_CHUNKS", "50"))
+MOCK_UPSTREAM_CHUNK_DELAY = float(os.getenv("MOCK_UPSTREAM_CHUNK_DELAY", "0.01"))
+MOCK_UPSTREAM_FIRST_CHUNK_DELAY = float(os.getenv("MOCK_UPSTREAM_FIRST_CHUNK_DELAY", "0.1"))
+MOCK_UPSTREAM_RESPAPI_ONLY_MODELS = os.getenv("MOCK_UPSTREAM_RESPAPI_ONLY_MODELS", "").replace(" ", "").split(",")
+MOCK_UPSTREAM_UNSUPPORTED_PARAMS = os.getenv("MOCK_UPSTREAM_UNSUPPORTED_PARAMS", "").replace(" ", "").split(",")
+
+app = FastAPI()
+
+
+def _sse(data: dict[str, Any], event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def _invalid_request(message: str, param: str | None = None) -> JSONResponse:
+    return JSONResponse(
+        {"error": {"message": message, "type": "invalid_request_error", "param": param, "code": None}},
+        status_code=400,
+    )
+
+
+def _reject_unsupported(body: dict[str, Any], responses_api: bool) -> JSONResponse | None:
+    if not responses_api and body.get("model") in MOCK_UPSTREAM_RESPAPI_ONLY_MODELS:
+        return _invalid_request(
+            "This model is only supported in v1/responses and not in v1/chat/completions.", param="model"
+        )
+    for param in MOCK_UPSTREAM_UNSUPPORTED_PARAMS:
+        if param and param in body:
+            return _invalid_request(f"Unsupported parameter: '{param}' is not supported with this model.", param)
+    return None
+
+
+def _usage_complapi() -> dict[str, Any]:
+    return {
+        "prompt_tokens": 100,
+        "completion_tokens": MOCK_UPSTREAM_CHUNKS,
+        "total_tokens": 100 + MOCK_UPSTREAM_CHUNKS,
+        "prompt_tokens_details": {"cached_tokens": 64},
+        "completion_tokens_details": {"reasoning_tokens": 0},
+    }
+
+
+def _usage_respapi() -> dict[str, Any]:
+    return {
+        "input_tokens": 100,
+        "output_tokens": MOCK_UPSTREAM_CHUNKS,
+        "total_tokens": 100 + MOCK_UPSTREAM_CHUNKS,
+        "input_tokens_details": {"cached_tokens": 64},
+        "output_tokens_details": {"reasoning_tokens": 8},
+    }
+
+
+def _response_respapi(model: str, text: str, status: str) -> dict[str, Any]:
+    return {
+        "id": "resp_mock",
+        "object": "response",
+        "created_at": int(time.time()),
+        "status": status,
+        "model": model,
+        "output": (
+            [
+                {
+                    "type": "message",
+                    "id": "msg_mock",
+                    "status": "completed",
+                    "role": "assistant",
+                    "content": [{"type": "output_text", "text": text, "annotations": []}],
+                }
+            ]
+            if status == "completed"
+            else []
+        ),
+        "usage": _usage_respapi() if status == "completed" else None,
+        "parallel_tool_calls": False,
+        "tool_choice": "auto",
+        "tools": [],
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request) -> Any:
+    body = await request.json()
+    model = body.get("model", "mock")
+    rejection = _reject_unsupported(body, responses_api=False)
+    if rejection is not None:
+        return rejection
+
+    if not body.get("stream"):
+        await asyncio.sleep(MOCK_UPSTREAM_FIRST_CHUNK_DELAY + MOCK_UPSTREAM_CHUNK_DELAY * MOCK_UPSTREAM_CHUNKS)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "tok " * MOCK_UPSTREAM_CHUNKS},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": _usage_complapi(),
+        }
+
+    async def generate() -> AsyncGenerator[str, None]:
+        await asyncio.sleep(MOCK_UPSTREAM_FIRST_CHUNK_DELAY)
+        for _ in range(MOCK_UPSTREAM_CHUNKS):
+            yield _sse(
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": "tok "}, "finish_reason": None}],
+                }
+            )
+            await asyncio.sleep(MOCK_UPSTREAM_CHUNK_DELAY)
+        yield _sse(
+            {
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+        )
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield _sse(
+                {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [],
+                    "usage": _usage_complapi(),
+                }
+            )
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.post("/v1/responses")
+async def responses(request: Request) -> Any:
+    body = await request.json()
+    model = body.get("model", "mock")
+    rejection = _reject_unsupported(body, responses_api=True)
+    if rejection is not None:
+        return rejection
+
+    if not body.get("stream"):
+        await asyncio.sleep(MOCK_UPSTREAM_FIRST_CHUNK_DELAY + MOCK_UPSTREAM_CHUNK_DELAY * MOCK_UPSTREAM_CHUNKS)
+        return _response_respapi(model, "tok " * MOCK_UPSTREAM_CHUNKS, "completed")
+
+    async def generate() -> AsyncGenerator[str, None]:
+        sequence_number = 0
+        yield _sse(
+            {
+                "type": "response.created",
+                "sequence_number": sequence_number,
+                "response": _response_respapi(model, "", "in_progress"),
+            },
+            event="response.created",
+        )
+        await asyncio.sleep(MOCK_UPSTREAM_FIRST_CHUNK_DELAY)
+        for _ in range(MOCK_UPSTREAM_CHUNKS):
+            sequence_number += 1
+            yield _sse(
+                {
+                    "type": "response.output_text.delta",
+                    "item_id": "msg_mock",
+                    "output_index": 0,
+                    "content_index": 0,
+                    "delta": "tok ",
+                    "sequence_number": sequence_number,
+                    "logprobs": [],
+                },
+                event="response.output_text.delta",
+            )
+            await asyncio.sleep(MOCK_UPSTREAM_CHUNK_DELAY)
+        sequence_number += 1
+        yield _sse(
+            {
+                "type": "response.completed",
+                "sequence_number": sequence_number,
+                "response": _response_respapi(model, "tok " * MOCK_UPSTREAM_CHUNKS, "completed"),
+            },
+            event="response.completed",
+        )
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.post("/v1/files")
+async def create_file(request: Request) -> Any:
+    # A stand-in for the Files API (the proxy uploads the images there, see
+    # `claude_code_proxy/blob_store.py`)
+    form = await request.form()
+    upload = form["file"]
+    data = await upload.read()
+    return {
+        "id": f"file-{hashlib.sha256(data).hexdigest()[:24]}",
+        "object": "file",
+        "bytes": len(data),
+        "created_at": int(time.time()),
+        "filename": upload.filename,
+        "purpose": form.get("purpose", "vision"),
+        "status": "processed",
+    }
+
+
+@app.post("/v1/traces")
+async def export_traces(request: Request) -> Response:
+    # A stand-in for an OpenTelemetry collector (point OTEL_EXPORTER_OTLP_ENDPOINT
+    # of the proxy at the mock's base URL, without `/v1`, to use it)
+    body = await request.body()
+    print(f"Received an OTLP export of {len(body)} bytes")
+    return Response(content=b"", media_type="application/x-protobuf")
+
+
+@app.head("/v1")
+async def head_base_url() -> None:
+    # Used by the proxy to pre-warm the connections
+    return None
@@ -0,0 +1,156 @@
+"""
+Measure how long it takes from starting the proxy process until it serves its
+first request (and until it reports that the upstream connections are warmed
+up). See `docs/PERFORMANCE.md` for the startup budget and how to use this
+script.
+
+Usage:
+    uv run python benchmarks/startup_benchmark.py [--runs 3] [--budget 15]
+    uv run python benchmarks/startup_benchmark.py --importtime
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent
+
+DEFAULT_STARTUP_BUDGET_SECONDS = 15.0
+
+# The modules the proxy imports on its own (i.e. on top of LiteLLM)
+_PROXY_MODULE_PREFIXES = ("claude_code_proxy", "common", "yoda_example")
+
+
+def _get_status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def measure_startup(config: str, port: int, timeout: float) -> tuple[float, float]:
+    """
+    Start the proxy and return the number of seconds until the first request
+    was served and until the proxy reported itself as ready.
+    """
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    started_at = time.perf_counter()
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "litellm.proxy.proxy_cli", "--config", config, "--port", str(port)],
+        cwd=REPO_ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    first_request_served_in = None
+    try:
+        while time.perf_counter() - started_at < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"The proxy exited with code {process.returncode} during startup")
+
+            if first_request_served_in is None:
+                if _get_status(f"http://127.0.0.1:{port}/health/liveliness") == 200:
+                    first_request_served_in = time.perf_counter() - started_at
+
+            if first_request_served_in is not None:
+                if _get_status(f"http://127.0.0.1:{port}/claude-code-proxy/ready") == 200:
+                    return first_request_served_in, time.perf_counter() - started_at
+
+            time.sleep(0.05)
+
+        raise TimeoutError(f"The proxy did not become ready within {timeout} seconds")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def profile_imports(module: str, top: int) -> None:
+    """
+    Print the slowest imports (by cumulative time) that importing `module`
+    causes, as reported by `python -X importtime`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    records = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append((int(cumulative_us), int(self_us), len(indent) // 2, name))
+
+    total_us = max((record[0] for record in records), default=0)
+    print(f"Importing `{module}` takes {total_us / 1e6:.3f}s in total\n")
+
+    print(f"Top {top} imports by cumulative time:")
+    for cumulative_us, self_us, _, name in sorted(records, reverse=True)[:top]:
+        print(f"  {cumulative_us / 1e6:8.3f}s cumulative  {self_us / 1e6:8.3f}s self  {name}")
+
+    print("\nThe proxy's own modules:")
+    for cumulative_us, self_us, _, name in sorted(records, reverse=True):
+        if name.startswith(_PROXY_MODULE_PREFIXES):
+            print(f"  {cumulative_us / 1e6:8.3f}s cumulative  {self_us / 1e6:8.3f}s self  {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--port", type=int, default=4099)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=float(os.getenv("STARTUP_BUDGET_SECONDS", str(DEFAULT_STARTUP_BUDGET_SECONDS))),
+        help="Fail (exit code 1) if the median time until the first request is served exceeds this many seconds",
+    )
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--importtime",
+        action="store_true",
+        help="Profile the import time of the proxy's modules instead of starting the proxy",
+    )
+    parser.add_argument("--module", default="claude_code_proxy.claude_code_router")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    if args.importtime:
+        profile_imports(args.module, args.top)
+        return
+
+    first_request_times = []
+    ready_times = []
+    for run_idx in range(args.runs):
+        first_request_served_in, ready_in = measure_startup(args.config, args.port, args.timeout)
+        first_request_times.append(first_request_served_in)
+        ready_times.append(ready_in)
+        print(f"Run #{run_idx + 1}: first request served in {first_request_served_in:.2f}s, ready in {ready_in:.2f}s")
+
+    median_first_request = statistics.median(first_request_times)
+    print(
+        f"\nMedian: first request served in {median_first_request:.2f}s, "
+        f"ready in {statistics.median(ready_times):.2f}s (budget: {args.budget:.2f}s)"
+    )
+    if median_first_request > args.budget:
+        print("\033[1;31mStartup budget exceeded!\033[0m")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Measure how many streaming requests per second (and how many concurrent
+streams) the proxy sustains with different numbers of workers. The proxy is
+pointed at a mock upstream (`benchmarks/mock_upstream.py`), so the results
+reflect the overhead of the proxy itself rather than the speed of the models.
+See `docs/PERFORMANCE.md` for how to interpret the results.
+
+Usage:
+    uv run python benchmarks/throughput_benchmark.py [--workers 1,2,4] [--concurrency 64] [--duration 20]
+
+To keep the mock upstream and the load generator from competing with the proxy
+for the CPU, pin them to cores of their own (Linux only), e.g.:
+    ... --proxy-cpus 0-3 --upstream-cpus 4-5 --client-cpus 6-7
+or run the mock upstream on another host and pass `--upstream-url`.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+from typing import Iterator, Optional
+
+import httpx
+
+REPO_ROOT = Path(__file__).parent.parent
+
+
+def _parse_cpu_list(cpu_list: str) -> set[int]:
+    """
+    Parse a list of CPUs in the format of `taskset -c` (e.g. "0-3,6").
+    """
+    cpus = set()
+    for cpu_range in cpu_list.split(","):
+        first, _, last = cpu_range.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _describe_cpus(cpus: Optional[set[int]]) -> str:
+    return ",".join(str(cpu) for cpu in sorted(cpus)) if cpus else "any"
+
+
+@contextlib.contextmanager
+def _cpu_affinity(cpus: Optional[set[int]]) -> Iterator[None]:
+    """
+    Run the block (and the processes it starts, which inherit the affinity,
+    along with all their workers) on the given CPUs only.
+    """
+    if not cpus:
+        yield
+        return
+    original_cpus = os.sched_getaffinity(0)
+    os.sched_setaffinity(0, cpus)
+    try:
+        yield
+    finally:
+        os.sched_setaffinity(0, original_cpus)
+
+
+def _wait_until_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"The process exited with code {process.returncode} during startup")
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.HTTPError, OSError):
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url} did not respond within {timeout} seconds")
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def start_mock_upstream(port: int, workers: int, cpus: Optional[set[int]] = None) -> subprocess.Popen:
+    with _cpu_affinity(cpus):
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                *(sys.executable, "-m", "uvicorn", "benchmarks.mock_upstream:app"),
+                *("--port", str(port), "--workers", str(workers), "--log-level", "warning"),
+            ],
+            cwd=REPO_ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    _wait_until_ready(f"http://127.0.0.1:{port}/docs", process, timeout=60)
+    return process
+
+
+def start_proxy(
+    config: str, port: int, workers: int, upstream_url: str, cpus: Optional[set[int]] = None
+) -> subprocess.Popen:
+    upstream_base_url = f"{upstream_url.rstrip('/')}/v1"
+    env = {
+        **os.environ,
+        "PROXY_NUM_WORKERS": str(workers),
+        "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-benchmark"),
+        "OPENAI_BASE_URL": upstream_base_url,
+        "OPENAI_API_BASE": upstream_base_url,
+        "LITELLM_LOCAL_MODEL_COST_MAP": "True",
+    }
+    # Don't send the traces of the benchmark requests anywhere
+    for env_var in ("LANGFUSE_PUBLIC_KEY", "LANGFUSE_SECRET_KEY", "LITELLM_MASTER_KEY"):
+        env.pop(env_var, None)
+
+    with _cpu_affinity(cpus):
+        process = subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                *(sys.executable, "-m", "litellm.proxy.proxy_cli", "--config", config),
+                *("--port", str(port), "--num_workers", str(workers)),
+            ],
+            cwd=REPO_ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    _wait_until_ready(f"http://127.0.0.1:{port}/claude-code-proxy/ready", process, timeout=120)
+    return process
+
+
+async def _stream_one(client: httpx.AsyncClient, url: str, model: str) -> float:
+    payload = {
+        "model": model,
+        "max_tokens": 1024,
+        "stream": True,
+        "messages": [{"role": "user", "content": "Hello!"}],
+    }
+    started_at = time.perf_counter()
+    async with client.stream("POST", url, json=payload) as response:
+        response.raise_for_status()
+        async for _ in response.aiter_bytes():
+            pass
+    return time.perf_counter() - started_at
+
+
+async def run_load(port: int, model: str, concurrency: int, duration: float) -> dict[str, float]:
+    """
+    Keep `concurrency` streaming requests in flight for `duration` seconds and
+    return the throughput and latency statistics.
+    """
+    url = f"http://127.0.0.1:{port}/v1/messages"
+    latencies: list[float] = []
+    errors = 0
+    in_flight = 0
+    max_in_flight = 0
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        deadline = time.perf_counter() + duration
+
+        async def worker() -> None:
+            nonlocal errors, in_flight, max_in_flight
+            while time.perf_counter() < deadline:
+                in_flight += 1
+                max_in_flight = max(max_in_flight, in_flight)
+                try:
+                    latencies.append(await _stream_one(client, url, model))
+                except httpx.HTTPError:
+                    errors += 1
+                finally:
+                    in_flight -= 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": len(latencies) / elapsed,
+        "max_concurrent_streams": max_in_flight,
+        "p50_latency": statistics.median(latencies) if latencies else float("nan"),
+        "p99_latency": latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan"),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--port", type=int, default=4098)
+    parser.add_argument("--upstream-port", type=int, default=8900)
+    parser.add_argument("--upstream-workers", type=int, help="Default: one per CPU the mock upstream may use")
+    parser.add_argument(
+        "--upstream-url",
+        help="Use the mock upstream running at this URL (e.g. on another host) instead of starting one",
+    )
+    parser.add_argument("--proxy-cpus", help='The CPUs to run the proxy on (e.g. "0-3")')
+    parser.add_argument("--upstream-cpus", help="The CPUs to run the mock upstream on")
+    parser.add_argument("--client-cpus", help="The CPUs to run the load generator (this script) on")
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+        help="Comma-separated list of the proxy worker counts to benchmark",
+    )
+    parser.add_argument("--concurrency", type=int, default=64, help="Number of streaming requests kept in flight")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds to keep the load up per worker count")
+    parser.add_argument("--model", default="claude-sonnet-4-5")
+    args = parser.parse_args()
+
+    proxy_cpus, upstream_cpus, client_cpus = (
+        _parse_cpu_list(cpu_list) if cpu_list else None
+        for cpu_list in (args.proxy_cpus, args.upstream_cpus, args.client_cpus)
+    )
+    upstream_workers = args.upstream_workers or len(upstream_cpus or os.sched_getaffinity(0))
+
+    print(f"CPU cores: {len(os.sched_getaffinity(0))}, concurrency: {args.concurrency}, duration: {args.duration}s")
+    print(
+        f"CPUs - proxy: {_describe_cpus(proxy_cpus)}, "
+        f"mock upstream: {args.upstream_url or _describe_cpus(upstream_cpus)}, "
+        f"load generator: {_describe_cpus(client_cpus)}\n"
+    )
+    print(f"{'workers':>7}  {'req/s':>8}  {'streams':>7}  {'p50':>7}  {'p99':>7}  {'errors':>6}")
+
+    upstream = None
+    if args.upstream_url is None:
+        upstream = start_mock_upstream(args.upstream_port, upstream_workers, upstream_cpus)
+    upstream_url = args.upstream_url or f"http://127.0.0.1:{args.upstream_port}"
+    try:
+        for workers in (int(n) for n in args.workers.split(",")):
+            proxy = start_proxy(args.config, args.port, workers, upstream_url, proxy_cpus)
+            try:
+                with _cpu_affinity(client_cpus):
+                    results = asyncio.run(run_load(args.port, args.model, args.concurrency, args.duration))
+            finally:
+                stop_process(proxy)
+            print(
+                f"{workers:>7}  {results['requests_per_second']:>8.1f}  {results['max_concurrent_streams']:>7}  "
+                f"{results['p50_latency']:>6.2f}s  {results['p99_latency']:>6.2f}s  {results['errors']:>6}"
+            )
+    finally:
+        if upstream is not None:
+            stop_process(upstream)
+
+
+if __name__ == "__main__":
+    main()
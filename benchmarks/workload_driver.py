@@ -0,0 +1,241 @@
+"""
+Replay a corpus of synthetic Claude Code sessions (see
+`benchmarks/workload_generator.py`) against the proxy: the sessions arrive at
+`--rate` sessions per second (Poisson arrivals) and run concurrently, each one
+turn after the other, with its sub-agents and its background (Haiku) requests
+in parallel - the way Claude Code sends them. Reports the latency percentiles
+(time to the first token and to the end of the stream) per kind of request, and
+how much CPU the proxy spent per turn.
+
+By default the proxy is started against the mock upstream
+(`benchmarks/mock_upstream.py`), so the results reflect the overhead of the
+proxy itself. With `--url`, an already running proxy is used instead (pass
+`--proxy-pid` to also measure its CPU). See `docs/PERFORMANCE.md` for how to
+interpret the results.
+
+Usage:
+    uv run python benchmarks/workload_driver.py [--corpus .benchmarks/corpus.jsonl] [--rate 0.5] [--workers 1]
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Optional
+
+import httpx
+
+from throughput_benchmark import start_mock_upstream, start_proxy, stop_process
+
+REPO_ROOT = Path(__file__).parent.parent
+
+_KINDS = ("main", "subagent", "background")
+_PERCENTILES = {"p50": 50, "p90": 90, "p99": 99, "p99.9": 99.9, "max": 100}
+
+
+class Histogram:
+    """
+    A latency histogram in the manner of HdrHistogram: the values are recorded
+    with 3 significant digits (at most 0.1% off), so the memory it takes
+    depends on the range of the values rather than on how many there are.
+    """
+
+    def __init__(self) -> None:
+        self.counts: Counter[float] = Counter()
+        self.total = 0
+
+    def record(self, value: float) -> None:
+        if value > 0:
+            value = round(value, 2 - math.floor(math.log10(value)))
+        self.counts[value] += 1
+        self.total += 1
+
+    def percentile(self, percent: float) -> float:
+        if not self.total:
+            return float("nan")
+        rank = max(math.ceil(self.total * percent / 100), 1)
+        seen = 0
+        for value in sorted(self.counts):
+            seen += self.counts[value]
+            if seen >= rank:
+                return value
+        return max(self.counts)
+
+
+def _process_tree_cpu_seconds(pid: int) -> Optional[float]:
+    """
+    The user + system CPU time of the process and all its descendants (the
+    proxy workers), or None where /proc is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    stats: dict[int, tuple[int, int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", encoding="ascii") as f:
+                # (After the command name, which may contain spaces)
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # ppid, utime + stime (see `man proc`)
+        stats[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]))
+
+    tree = {pid}
+    added = True
+    while added:
+        children = {child for child, (ppid, _) in stats.items() if ppid in tree} - tree
+        tree |= children
+        added = bool(children)
+    return sum(stats[member][1] for member in tree if member in stats) / os.sysconf("SC_CLK_TCK")
+
+
+class WorkloadDriver:
+    def __init__(self, args: argparse.Namespace, header: dict[str, Any]) -> None:
+        self.args = args
+        self.url = f"{args.url.rstrip('/')}/v1/messages"
+        self.headers = {"Authorization": f"Bearer {args.api_key}"} if args.api_key else {}
+        self.system = [{"type": "text", "text": header["system"]}]
+        self.tools = header["tools"]
+        self.ttft = {kind: Histogram() for kind in _KINDS}
+        self.latency = {kind: Histogram() for kind in _KINDS}
+        self.errors: Counter[str] = Counter()
+        self.turns = 0
+        self.client: Optional[httpx.AsyncClient] = None
+
+    async def _send(self, body: dict[str, Any], kind: str) -> None:
+        started_at = time.perf_counter()
+        first_token_at = None
+        try:
+            async with self.client.stream("POST", self.url, json=body, headers=self.headers) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if first_token_at is None and line.startswith("event: content_block_delta"):
+                        first_token_at = time.perf_counter()
+                    elif line.startswith("event: error"):
+                        self.errors[kind] += 1
+                        return
+        except httpx.HTTPError:
+            self.errors[kind] += 1
+            return
+        finished_at = time.perf_counter()
+        self.ttft[kind].record((first_token_at or finished_at) - started_at)
+        self.latency[kind].record(finished_at - started_at)
+
+    async def _background(self, requests: list[dict[str, Any]]) -> None:
+        await asyncio.gather(*(self._send({**body, "stream": True}, "background") for body in requests))
+
+    async def run_session(self, session: dict[str, Any], kind: str = "main") -> None:
+        messages: list[dict[str, Any]] = []
+        background_tasks = []
+        for turn in session["turns"]:
+            if turn["subagents"]:
+                await asyncio.gather(*(self.run_session(subagent, "subagent") for subagent in turn["subagents"]))
+            if turn["background"]:
+                background_tasks.append(asyncio.create_task(self._background(turn["background"])))
+
+            messages.extend(turn["messages"])
+            body = {
+                "model": session["model"],
+                "max_tokens": 32000,
+                "stream": True,
+                "system": self.system,
+                "tools": self.tools,
+                "messages": messages,
+            }
+            await self._send(body, kind)
+            self.turns += 1
+            # (The time the tool calls take on the client)
+            await asyncio.sleep(random.expovariate(1 / self.args.think_time) if self.args.think_time > 0 else 0)
+        await asyncio.gather(*background_tasks)
+
+    async def run(self, sessions: list[dict[str, Any]]) -> float:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+        async with httpx.AsyncClient(limits=limits, timeout=self.args.timeout) as client:
+            self.client = client
+            started_at = time.perf_counter()
+            tasks = []
+            for session in sessions:
+                tasks.append(asyncio.create_task(self.run_session(session)))
+                await asyncio.sleep(random.expovariate(self.args.rate))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - started_at
+
+    def report(self, elapsed: float, cpu_seconds: Optional[float]) -> None:
+        print(f"{'kind':<10}  {'requests':>8}  {'errors':>6}  {'':<7}  " + "  ".join(f"{p:>8}" for p in _PERCENTILES))
+        for kind in _KINDS:
+            for label, histograms in (("ttft", self.ttft), ("total", self.latency)):
+                histogram = histograms[kind]
+                percentiles = "  ".join(f"{histogram.percentile(p):>7.3f}s" for p in _PERCENTILES.values())
+                print(f"{kind:<10}  {histogram.total:>8}  {self.errors[kind]:>6}  {label:<7}  {percentiles}")
+
+        requests = sum(histogram.total for histogram in self.latency.values()) + sum(self.errors.values())
+        print(f"\n{requests} requests ({self.turns} turns) in {elapsed:.1f}s ({requests / elapsed:.1f} req/s)")
+        if cpu_seconds is None:
+            print("Proxy CPU: n/a")
+        else:
+            print(
+                f"Proxy CPU: {cpu_seconds:.1f}s ({cpu_seconds / elapsed * 100:.0f}% of a core), "
+                f"{cpu_seconds / max(self.turns, 1) * 1000:.1f}ms per turn "
+                f"(the background requests included)"
+            )
+
+
+def _load_corpus(path: Path) -> tuple[dict[str, Any], list[dict[str, Any]]]:
+    with path.open(encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        sessions = [json.loads(line) for line in f if line.strip()]
+    return header, sessions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", type=Path, default=REPO_ROOT / ".benchmarks" / "corpus.jsonl")
+    parser.add_argument("--rate", type=float, default=0.5, help="New sessions per second")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds between the turns")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Seconds before a request is given up on")
+    parser.add_argument("--url", help="Base URL of an already running proxy (default: start one)")
+    parser.add_argument("--proxy-pid", type=int, help="PID of the proxy at --url, to measure its CPU")
+    parser.add_argument("--api-key", default=os.getenv("LITELLM_MASTER_KEY"))
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--port", type=int, default=4098)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--upstream-port", type=int, default=8900)
+    parser.add_argument("--upstream-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    header, sessions = _load_corpus(args.corpus)
+    print(f"{len(sessions)} sessions from {args.corpus}, {args.rate} sessions/s\n")
+
+    upstream = proxy = None
+    if args.url is None:
+        upstream = start_mock_upstream(args.upstream_port, args.upstream_workers)
+        proxy = start_proxy(args.config, args.port, args.workers, args.upstream_port)
+        args.url = f"http://127.0.0.1:{args.port}"
+        args.proxy_pid = proxy.pid
+        # (The requests of the mock run go nowhere but the mock upstream)
+        args.api_key = None
+    try:
+        driver = WorkloadDriver(args, header)
+        cpu_before = _process_tree_cpu_seconds(args.proxy_pid) if args.proxy_pid else None
+        elapsed = asyncio.run(driver.run(sessions))
+        cpu_after = _process_tree_cpu_seconds(args.proxy_pid) if args.proxy_pid else None
+    finally:
+        for process in (proxy, upstream):
+            if process is not None:
+                stop_process(process)
+
+    cpu_seconds = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    driver.report(elapsed, cpu_seconds)
+
+
+if __name__ == "__main__":
+    main()
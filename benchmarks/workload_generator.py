@@ -0,0 +1,219 @@
+"""
+Generate a corpus of synthetic Claude Code sessions for the benchmarks (see
+`benchmarks/workload_driver.py`, which replays them against the proxy). The
+sessions have the shape of the real ones:
+
+- every request carries the same large tool set (and system prompt)
+- the history grows turn by turn, with a tool_use/tool_result pair per turn
+- some of the tool results are screenshots (base64 images)
+- the main agent spawns sub-agents (via the Task tool) that run in parallel
+- small background requests (titles, summaries) go to Haiku alongside the turns
+
+The corpus is a JSON lines file: a header (the tools and the system prompt,
+shared by all the requests) followed by one line per session. A session only
+stores the messages every turn adds to the history, so the corpus grows
+linearly with the number of turns (the driver rebuilds the requests).
+
+Usage:
+    uv run python benchmarks/workload_generator.py --sessions 20 --turns 30 --out .benchmarks/corpus.jsonl
+"""
+
+import argparse
+import base64
+import json
+import random
+from pathlib import Path
+from typing import Any
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# The tools Claude Code sends with every request of the main agent
+_TOOL_NAMES = (
+    "Task",
+    "Bash",
+    "Glob",
+    "Grep",
+    "ExitPlanMode",
+    "Read",
+    "Edit",
+    "MultiEdit",
+    "Write",
+    "NotebookEdit",
+    "WebFetch",
+    "TodoWrite",
+    "WebSearch",
+    "BashOutput",
+    "KillShell",
+    "SlashCommand",
+)
+# The tools the turns call (and how often, relatively)
+_CALLED_TOOLS = {"Read": 8, "Bash": 6, "Grep": 4, "Edit": 4, "Glob": 2, "Write": 1, "TodoWrite": 1}
+
+_WORDS = (
+    "the file function test error value request stream model token proxy config return import class "
+    "update check handle result output input message response tool call list string path line"
+).split()
+
+
+def _text(rng: random.Random, chars: int) -> str:
+    words: list[str] = []
+    length = 0
+    while length < chars:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:chars]
+
+
+def _tools(rng: random.Random, description_chars: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "name": name,
+            "description": _text(rng, description_chars),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    f"param_{idx}": {"type": "string", "description": _text(rng, description_chars // 10)}
+                    for idx in range(rng.randint(1, 5))
+                },
+                "required": ["param_0"],
+                "additionalProperties": False,
+                "$schema": "http://json-schema.org/draft-07/schema#",
+            },
+        }
+        for name in _TOOL_NAMES
+    ]
+
+
+def _tool_output_size(rng: random.Random, mean_bytes: int) -> int:
+    # Mostly small outputs, with the occasional big file or log (log-normal)
+    return max(int(rng.lognormvariate(0, 1.0) * mean_bytes / 1.65), 16)
+
+
+def _image_block(rng: random.Random, image_bytes: int) -> dict[str, Any]:
+    # (Random bytes - the proxy and the mock upstream don't decode the image)
+    data = base64.b64encode(rng.randbytes(image_bytes)).decode("ascii")
+    return {"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": data}}
+
+
+class _SessionGenerator:
+    def __init__(self, args: argparse.Namespace, rng: random.Random) -> None:
+        self.args = args
+        self.rng = rng
+        self.tool_use_ids = 0
+
+    def _tool_use_id(self) -> str:
+        self.tool_use_ids += 1
+        return f"toolu_{self.tool_use_ids:08d}"
+
+    def _tool_turn(self, tool_name: str, output: Any) -> list[dict[str, Any]]:
+        # What the model called last time and what the tool returned
+        tool_use_id = self._tool_use_id()
+        return [
+            {
+                "role": "assistant",
+                "content": [
+                    {"type": "text", "text": _text(self.rng, self.rng.randint(20, 300))},
+                    {
+                        "type": "tool_use",
+                        "id": tool_use_id,
+                        "name": tool_name,
+                        "input": {"param_0": _text(self.rng, self.rng.randint(10, 200))},
+                    },
+                ],
+            },
+            {"role": "user", "content": [{"type": "tool_result", "tool_use_id": tool_use_id, "content": output}]},
+        ]
+
+    def _background_requests(self) -> list[dict[str, Any]]:
+        if self.rng.random() >= self.args.background_probability:
+            return []
+        return [
+            {
+                "model": self.args.background_model,
+                "max_tokens": 512,
+                "messages": [
+                    {"role": "user", "content": f"Summarize this in a few words: {_text(self.rng, 400)}"},
+                ],
+            }
+            for _ in range(self.rng.randint(1, 2))
+        ]
+
+    def session(self, session_id: str, turns: int, fanout: int, model: str) -> dict[str, Any]:
+        session_turns = [
+            {
+                "messages": [{"role": "user", "content": _text(self.rng, self.rng.randint(50, 2000))}],
+                "background": self._background_requests(),
+                "subagents": [],
+            }
+        ]
+        for turn_idx in range(1, turns):
+            subagents = []
+            if fanout > 0 and self.args.subagent_every > 0 and turn_idx % self.args.subagent_every == 0:
+                # The previous turn called the Task tool - the sub-agents run
+                # (in parallel) before this turn carries their results
+                subagents = [
+                    self.session(f"{session_id}/sub-{turn_idx}-{idx}", self.args.subagent_turns, 0, model)
+                    for idx in range(fanout)
+                ]
+                messages = self._tool_turn("Task", _text(self.rng, 2000))
+            elif self.rng.random() < self.args.image_probability:
+                output = [
+                    {"type": "text", "text": "Screenshot:"},
+                    _image_block(self.rng, self.args.image_bytes),
+                ]
+                messages = self._tool_turn("Read", output)
+            else:
+                tool_name = self.rng.choices(list(_CALLED_TOOLS), weights=list(_CALLED_TOOLS.values()))[0]
+                output = _text(self.rng, _tool_output_size(self.rng, self.args.tool_output_bytes))
+                messages = self._tool_turn(tool_name, output)
+            session_turns.append(
+                {"messages": messages, "background": self._background_requests(), "subagents": subagents}
+            )
+        return {"kind": "session", "id": session_id, "model": model, "turns": session_turns}
+
+
+def generate(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    generator = _SessionGenerator(args, rng)
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    with args.out.open("w", encoding="utf-8") as f:
+        header = {
+            "kind": "header",
+            "system": _text(rng, args.system_prompt_chars),
+            "tools": _tools(rng, args.tool_description_chars),
+            "generator_args": {key: str(value) for key, value in vars(args).items()},
+        }
+        f.write(json.dumps(header) + "\n")
+        for idx in range(args.sessions):
+            turns = max(int(rng.gauss(args.turns, args.turns / 4)), 1)
+            f.write(json.dumps(generator.session(f"session-{idx}", turns, args.fanout, args.model)) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", type=Path, default=REPO_ROOT / ".benchmarks" / "corpus.jsonl")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=30, help="Mean number of turns per session")
+    parser.add_argument("--tool-output-bytes", type=int, default=4000, help="Mean size of the tool outputs")
+    parser.add_argument("--image-probability", type=float, default=0.03, help="Share of the turns with an image")
+    parser.add_argument("--image-bytes", type=int, default=200_000, help="Size of the images (before base64)")
+    parser.add_argument("--fanout", type=int, default=3, help="Number of sub-agents the Task tool spawns")
+    parser.add_argument("--subagent-every", type=int, default=10, help="Turns between the Task calls (0: never)")
+    parser.add_argument("--subagent-turns", type=int, default=8, help="Mean number of turns per sub-agent")
+    parser.add_argument(
+        "--background-probability", type=float, default=0.3, help="Share of the turns with Haiku calls"
+    )
+    parser.add_argument("--tool-description-chars", type=int, default=1500)
+    parser.add_argument("--system-prompt-chars", type=int, default=12000)
+    parser.add_argument("--model", default="claude-sonnet-4-5")
+    parser.add_argument("--background-model", default="claude-haiku-4-5")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args)
+    print(f"Wrote {args.sessions} sessions to {args.out} ({args.out.stat().st_size / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
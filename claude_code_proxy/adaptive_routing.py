@@ -0,0 +1,120 @@
+import random
+import threading
+from typing import Any, Optional, Sequence
+
+from claude_code_proxy.proxy_config import (
+    ADAPTIVE_ROUTING_EWMA_ALPHA,
+    ADAPTIVE_ROUTING_EXPLORATION,
+    ADAPTIVE_ROUTING_REFERENCE_TOKENS,
+)
+from common.metrics import PROXY_METRICS
+
+
+def _ewma(current: Optional[float], sample: float) -> float:
+    if current is None:
+        return sample
+    return ADAPTIVE_ROUTING_EWMA_ALPHA * sample + (1 - ADAPTIVE_ROUTING_EWMA_ALPHA) * current
+
+
+class TargetLatencyStats:
+    """
+    Exponentially weighted moving averages of the time to first token and of
+    the output speed of a single target (model + endpoint).
+    """
+
+    def __init__(self) -> None:
+        self.ttft: Optional[float] = None
+        self.tokens_per_second: Optional[float] = None
+        self.samples = 0
+
+    def record_ttft(self, ttft: float) -> None:
+        self.ttft = _ewma(self.ttft, ttft)
+        self.samples += 1
+
+    def record_output_speed(self, output_tokens: int, generation_seconds: float) -> None:
+        if output_tokens > 0 and generation_seconds > 0:
+            self.tokens_per_second = _ewma(self.tokens_per_second, output_tokens / generation_seconds)
+
+    def expected_seconds(self, default_tokens_per_second: Optional[float] = None) -> Optional[float]:
+        """
+        The expected time to produce a response of a typical length (TTFT +
+        `ADAPTIVE_ROUTING_REFERENCE_TOKENS` at the observed output speed, or
+        at `default_tokens_per_second` if the speed was not measured yet).
+        """
+        if self.ttft is None:
+            return None
+        tokens_per_second = self.tokens_per_second or default_tokens_per_second
+        if not tokens_per_second:
+            return self.ttft
+        return self.ttft + ADAPTIVE_ROUTING_REFERENCE_TOKENS / tokens_per_second
+
+
+class AdaptiveRouter:
+    """
+    Keeps the latency statistics of every target and ranks equivalent targets
+    by how fast they currently are. Most requests go to the fastest target,
+    but a fraction of them (`ADAPTIVE_ROUTING_EXPLORATION`) goes to a target
+    picked at random (weighted by speed), so the statistics of the slower
+    targets stay fresh. Targets that have not been measured yet are tried
+    first.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stats: dict[str, TargetLatencyStats] = {}
+
+    def _get_stats(self, target_key: str) -> TargetLatencyStats:
+        stats = self._stats.get(target_key)
+        if stats is None:
+            stats = self._stats[target_key] = TargetLatencyStats()
+        return stats
+
+    def record_ttft(self, target_key: str, ttft: float) -> None:
+        with self._lock:
+            self._get_stats(target_key).record_ttft(ttft)
+
+    def record_output_speed(self, target_key: str, output_tokens: int, generation_seconds: float) -> None:
+        with self._lock:
+            self._get_stats(target_key).record_output_speed(output_tokens, generation_seconds)
+
+    def rank(self, target_keys: Sequence[str]) -> list[int]:
+        """
+        Return the indices of `target_keys` in the order in which the targets
+        should be tried (the chosen target first, the rest in the configured
+        order, as failover targets).
+        """
+        with self._lock:
+            target_stats = [self._stats.get(key) for key in target_keys]
+            # Compare the targets whose output speed is not known yet as if
+            # they were as fast as the others on average
+            known_speeds = [stats.tokens_per_second for stats in target_stats if stats and stats.tokens_per_second]
+            average_speed = sum(known_speeds) / len(known_speeds) if known_speeds else None
+            expected = [stats.expected_seconds(average_speed) if stats else None for stats in target_stats]
+
+        unmeasured = [idx for idx, seconds in enumerate(expected) if seconds is None]
+        if unmeasured:
+            chosen = unmeasured[0]
+        elif random.random() < ADAPTIVE_ROUTING_EXPLORATION:
+            chosen = random.choices(range(len(target_keys)), weights=[1 / max(s, 1e-3) for s in expected])[0]
+            PROXY_METRICS.inc("adaptive_routing_explorations")
+        else:
+            chosen = min(range(len(target_keys)), key=lambda idx: expected[idx])
+
+        return [chosen] + [idx for idx in range(len(target_keys)) if idx != chosen]
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                key: {
+                    "ttft": stats.ttft,
+                    "tokens_per_second": stats.tokens_per_second,
+                    "expected_seconds": stats.expected_seconds(),
+                    "samples": stats.samples,
+                }
+                for key, stats in self._stats.items()
+            }
+
+
+adaptive_router = AdaptiveRouter()
+
+PROXY_METRICS.register_collector("target_latency", adaptive_router.stats)
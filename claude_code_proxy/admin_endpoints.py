@@ -0,0 +1,80 @@
+import asyncio
+import sys
+
+from common.metrics import PROXY_METRICS
+
+_ADMIN_ENDPOINTS_REGISTERED = False
+
+
+def register_admin_endpoints() -> None:
+    """
+    Register the proxy's own admin endpoints on the LiteLLM proxy server app.
+    Does nothing when we are not running inside the LiteLLM proxy server (we
+    don't want to import the whole proxy server just for this).
+    """
+    global _ADMIN_ENDPOINTS_REGISTERED  # pylint: disable=global-statement
+
+    if _ADMIN_ENDPOINTS_REGISTERED or "litellm.proxy.proxy_server" not in sys.modules:
+        return
+
+    # pylint: disable=import-outside-toplevel
+    from fastapi import Depends
+    from fastapi.responses import JSONResponse
+    from litellm.proxy.auth.user_api_key_auth import user_api_key_auth
+    from litellm.proxy.proxy_server import app
+
+    async def get_metrics() -> dict:
+        return PROXY_METRICS.snapshot()
+
+    app.add_api_route(
+        "/claude-code-proxy/metrics",
+        get_metrics,
+        methods=["GET"],
+        dependencies=[Depends(user_api_key_auth)],
+        tags=["claude-code-proxy"],
+    )
+
+    async def get_usage(days: int = 7) -> dict:
+        from claude_code_proxy.usage_ledger import usage_ledger
+
+        # (The ledger is a SQLite database - don't block the event loop)
+        return {"sessions": await asyncio.to_thread(usage_ledger.summarize_sessions, days)}
+
+    app.add_api_route(
+        "/claude-code-proxy/usage",
+        get_usage,
+        methods=["GET"],
+        dependencies=[Depends(user_api_key_auth)],
+        tags=["claude-code-proxy"],
+    )
+
+    async def get_flight_recordings() -> dict:
+        from common.flight_recorder import get_flight_recordings as get_recordings
+
+        return get_recordings()
+
+    app.add_api_route(
+        "/claude-code-proxy/flight-recorder",
+        get_flight_recordings,
+        methods=["GET"],
+        dependencies=[Depends(user_api_key_auth)],
+        tags=["claude-code-proxy"],
+    )
+
+    async def get_readiness() -> JSONResponse:
+        # Unlike LiteLLM's own /health endpoint, this one doesn't call any
+        # models (so it doesn't incur any costs) - it only reports whether the
+        # upstream connections are warmed up
+        from claude_code_proxy.upstream_prewarm import upstream_prewarmer
+
+        if upstream_prewarmer.ready:
+            return JSONResponse({"status": "ready"})
+        return JSONResponse({"status": "warming_up"}, status_code=503)
+
+    app.add_api_route(
+        "/claude-code-proxy/ready",
+        get_readiness,
+        methods=["GET"],
+        tags=["claude-code-proxy"],
+    )
+    _ADMIN_ENDPOINTS_REGISTERED = True
@@ -0,0 +1,205 @@
+import datetime
+import os
+import re
+import threading
+import time
+from typing import Any, Mapping, Optional
+
+from claude_code_proxy.proxy_config import API_KEY_COOLDOWN, PROVIDER_API_KEY_ENV_VARS
+from common.metrics import PROXY_METRICS
+
+# The rate limit headers of the providers we know: (limit, remaining, reset)
+# for requests and for tokens
+_RATE_LIMIT_HEADERS = {
+    "requests": (
+        ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        (
+            "anthropic-ratelimit-requests-limit",
+            "anthropic-ratelimit-requests-remaining",
+            "anthropic-ratelimit-requests-reset",
+        ),
+    ),
+    "tokens": (
+        ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+        (
+            "anthropic-ratelimit-tokens-limit",
+            "anthropic-ratelimit-tokens-remaining",
+            "anthropic-ratelimit-tokens-reset",
+        ),
+    ),
+}
+
+_DURATION_PART_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _parse_reset(value: str) -> Optional[float]:
+    """
+    The number of seconds until a rate limit resets. OpenAI sends durations
+    ("1s", "6m0s", "20ms"), Anthropic sends RFC 3339 timestamps.
+    """
+    value = value.strip()
+    parts = _DURATION_PART_PATTERN.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        reset_at = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return (reset_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+
+
+def _mask(api_key: str) -> str:
+    return f"...{api_key[-4:]}"
+
+
+class _RateLimit:
+    def __init__(self) -> None:
+        self.limit: Optional[float] = None
+        self.remaining: Optional[float] = None
+        self.resets_at: Optional[float] = None
+
+    def headroom(self, now: float) -> float:
+        """
+        The fraction of the limit that is still available (1.0 if unknown).
+        """
+        if self.limit is None or self.remaining is None or self.limit <= 0:
+            return 1.0
+        if self.resets_at is not None and now >= self.resets_at:
+            return 1.0
+        return max(0.0, self.remaining / self.limit)
+
+
+class ApiKeyState:
+    """
+    What we know about the rate limits of a single upstream API key (as last
+    reported by the upstream, minus the requests sent since then).
+    """
+
+    def __init__(self, api_key: str) -> None:
+        self.api_key = api_key
+        self.requests = _RateLimit()
+        self.tokens = _RateLimit()
+        self.cooldown_until = 0.0
+        self.requests_sent = 0
+
+    def headroom(self, now: float) -> float:
+        if now < self.cooldown_until:
+            return 0.0
+        return min(self.requests.headroom(now), self.tokens.headroom(now))
+
+    def update_from_headers(self, headers: Mapping[str, str], now: float) -> None:
+        for rate_limit, header_sets in (
+            (self.requests, _RATE_LIMIT_HEADERS["requests"]),
+            (self.tokens, _RATE_LIMIT_HEADERS["tokens"]),
+        ):
+            for limit_header, remaining_header, reset_header in header_sets:
+                if remaining_header not in headers:
+                    continue
+                try:
+                    rate_limit.remaining = float(headers[remaining_header])
+                    if limit_header in headers:
+                        rate_limit.limit = float(headers[limit_header])
+                except ValueError:
+                    continue
+                reset_seconds = _parse_reset(headers.get(reset_header, ""))
+                rate_limit.resets_at = now + reset_seconds if reset_seconds is not None else None
+                break
+
+    def stats(self, now: float) -> dict[str, Any]:
+        return {
+            "key": _mask(self.api_key),
+            "headroom": self.headroom(now),
+            "remaining_requests": self.requests.remaining,
+            "remaining_tokens": self.tokens.remaining,
+            "cooling_down_for": max(0.0, self.cooldown_until - now),
+            "requests_sent": self.requests_sent,
+        }
+
+
+class ApiKeyPool:
+    """
+    Spreads the requests to each provider over all the API keys configured for
+    it: every request goes out with the key that has the most headroom left
+    (according to the rate limit headers of the latest responses), and a key
+    that hit a rate limit is avoided until it cools down.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._keys_by_provider: dict[str, list[ApiKeyState]] = {}
+        self._keys: dict[str, ApiKeyState] = {}
+
+        for provider, env_var in PROVIDER_API_KEY_ENV_VARS.items():
+            api_keys = os.getenv(f"{env_var}S") or os.getenv(env_var) or ""
+            states = []
+            for api_key in api_keys.split(","):
+                api_key = api_key.strip()
+                if api_key and api_key not in self._keys:
+                    self._keys[api_key] = ApiKeyState(api_key)
+                    states.append(self._keys[api_key])
+            if states:
+                self._keys_by_provider[provider] = states
+
+    def choose(self, provider: str, estimated_tokens: int = 0) -> Optional[str]:
+        """
+        The key to send the next request to the provider with (None if no keys
+        are configured for it - LiteLLM then falls back to its usual env var).
+        """
+        states = self._keys_by_provider.get(provider)
+        if not states:
+            return None
+
+        with self._lock:
+            now = time.monotonic()
+            available = [state for state in states if now >= state.cooldown_until]
+            if available:
+                # (Ties go to the least used key)
+                chosen = max(available, key=lambda state: (state.headroom(now), -state.requests_sent))
+            else:
+                chosen = min(states, key=lambda state: state.cooldown_until)
+                PROXY_METRICS.inc("api_key_pool_exhausted", provider=provider)
+
+            # Account for this request until the upstream reports the actual
+            # numbers, so concurrent requests don't all pick the same key
+            chosen.requests_sent += 1
+            if chosen.requests.remaining is not None:
+                chosen.requests.remaining -= 1
+            if chosen.tokens.remaining is not None:
+                chosen.tokens.remaining -= estimated_tokens
+            return chosen.api_key
+
+    def has_available_key(self, provider: str) -> bool:
+        now = time.monotonic()
+        return any(now >= state.cooldown_until for state in self._keys_by_provider.get(provider, ()))
+
+    def record_response_headers(self, api_key: str, headers: Mapping[str, str]) -> None:
+        state = self._keys.get(api_key)
+        if state is None:
+            return
+        with self._lock:
+            state.update_from_headers(headers, time.monotonic())
+
+    def record_rate_limited(self, api_key: str, retry_after: Optional[float] = None) -> None:
+        state = self._keys.get(api_key)
+        if state is None:
+            return
+        with self._lock:
+            cooldown_until = time.monotonic() + (retry_after if retry_after is not None else API_KEY_COOLDOWN)
+            if cooldown_until > state.cooldown_until:
+                if time.monotonic() >= state.cooldown_until:
+                    PROXY_METRICS.inc("api_key_cooldowns")
+                    print(f"\033[1;33mAPI key {_mask(api_key)} hit a rate limit, cooling it down\033[0m")
+                state.cooldown_until = cooldown_until
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                provider: [state.stats(now) for state in states] for provider, states in self._keys_by_provider.items()
+            }
+
+
+api_key_pool = ApiKeyPool()
+
+PROXY_METRICS.register_collector("api_keys", api_key_pool.stats)
@@ -0,0 +1,213 @@
+import asyncio
+import base64
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, NamedTuple, Optional
+
+from claude_code_proxy.proxy_config import (
+    BLOB_STORE_ENABLED,
+    BLOB_STORE_FILE_TTL,
+    BLOB_STORE_MAX_ENTRIES,
+    BLOB_STORE_MIN_BYTES,
+    OPENAI,
+)
+from claude_code_proxy.upstream_clients import UpstreamKey, upstream_client_pool
+from common.metrics import PROXY_METRICS
+
+_DATA_URL_PATTERN = re.compile(r"data:(?P<media_type>image/(?P<subtype>[\w.+-]+));base64,")
+
+# Stop referencing an uploaded file a bit before it expires (a request may
+# spend a while in the scheduler queue)
+_EXPIRY_MARGIN = 300.0
+# How long to send an image inline before trying to upload it again after its
+# upload failed
+_UPLOAD_RETRY_AFTER = 300.0
+# How many characters of an image URL (evenly spread over it, on top of its
+# first and last ones) make up its key in `_image_digests`
+_DIGEST_KEY_SAMPLE_CHARS = 1024
+
+
+class _BlobKey(NamedTuple):
+    # (Files are only visible to the organization / project of the key they
+    # were uploaded with)
+    base_url: str
+    api_key: str
+    sha256: str
+
+
+class _StoredBlob(NamedTuple):
+    file_id: Optional[str]  # None if the upload failed
+    expires_at: float
+
+
+class InlineImage(NamedTuple):
+    part: dict[str, Any]  # An `input_image` part of a Responses API message
+    match: re.Match  # (Of `_DATA_URL_PATTERN`)
+    sha256: str
+
+
+class _ImageDigests:
+    """
+    The digests of the images seen lately. Every turn of a conversation
+    carries all of its images again (as new strings), so they are looked up
+    by a cheap key - the length of the URL and a sample of its characters -
+    instead of hashing megabytes of base64 on every request. (An edit to an
+    image changes its encoding from there on, and the checksums PNG ends
+    with, so two different images practically never share a key.)
+    """
+
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max_entries
+        self._digests: OrderedDict[tuple[int, str, str, str], str] = OrderedDict()
+        # (Looked up from the request conversion, which may run in worker
+        # threads)
+        self._lock = threading.Lock()
+
+    def get(self, image_url: str) -> str:
+        stride = max(len(image_url) // _DIGEST_KEY_SAMPLE_CHARS, 1)
+        key = (len(image_url), image_url[:64], image_url[-64:], image_url[::stride])
+        with self._lock:
+            digest = self._digests.get(key)
+            if digest is not None:
+                self._digests.move_to_end(key)
+                return digest
+        digest = hashlib.sha256(image_url.encode()).hexdigest()
+        with self._lock:
+            self._digests[key] = digest
+            while len(self._digests) > self._max_entries:
+                self._digests.popitem(last=False)
+        return digest
+
+
+_image_digests = _ImageDigests(BLOB_STORE_MAX_ENTRIES)
+
+
+def find_inline_images(upstream_key: UpstreamKey, messages_respapi: list[dict[str, Any]]) -> list[InlineImage]:
+    """
+    The inline images of the (Responses API) messages that the blob store may
+    replace with file IDs, along with their digests. Hashing megabytes of
+    base64 takes a while, so this is a part of the request conversion (which
+    runs in a worker thread for big requests), not of
+    `BlobStore.reference_stored_blobs()` - and only images that weren't seen
+    lately are hashed at all (see `_ImageDigests`).
+    """
+    if not BLOB_STORE_ENABLED or upstream_key.provider != OPENAI:
+        return []
+    images = []
+    for message in messages_respapi:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if not isinstance(part, dict) or part.get("type") != "input_image":
+                continue
+            image_url = part.get("image_url")
+            if not isinstance(image_url, str) or len(image_url) < BLOB_STORE_MIN_BYTES:
+                continue
+            match = _DATA_URL_PATTERN.match(image_url)
+            if match is None:
+                # Not inline
+                continue
+            images.append(InlineImage(part, match, _image_digests.get(image_url)))
+    return images
+
+
+class BlobStore:
+    """
+    A content-addressed store of the images sent to the upstreams. The first
+    time an image is seen it is sent inline as usual and uploaded to the
+    provider's Files API in the background. From then on the requests (which
+    carry the whole conversation, so the same screenshot is sent with every
+    subsequent turn) reference the uploaded file by its ID instead of carrying
+    megabytes of base64 each.
+    """
+
+    def __init__(self) -> None:
+        self._blobs: OrderedDict[_BlobKey, _StoredBlob] = OrderedDict()
+        self._uploads: dict[_BlobKey, asyncio.Task] = {}
+        self.uploads = 0
+        self.upload_failures = 0
+        self.references = 0
+        self.bytes_saved = 0
+
+    def reference_stored_blobs(
+        self, upstream_key: UpstreamKey, api_key: Optional[str], images: list[InlineImage]
+    ) -> None:
+        """
+        Replace the inline images (see `find_inline_images()`) with the IDs of
+        their uploaded copies, where there are any, and start uploading the
+        ones that weren't uploaded yet (must be called from the event loop).
+        """
+        api_key = api_key or os.getenv("OPENAI_API_KEY") or ""
+        for image in images:
+            self._reference_stored_blob(upstream_key, api_key, image)
+
+    def _reference_stored_blob(self, upstream_key: UpstreamKey, api_key: str, image: InlineImage) -> None:
+        image_url = image.part["image_url"]
+        key = _BlobKey(upstream_key.base_url, api_key, image.sha256)
+        blob = self._blobs.get(key)
+        if blob is not None and blob.expires_at <= time.time():
+            del self._blobs[key]
+            blob = None
+        if blob is None:
+            if key not in self._uploads:
+                task = asyncio.get_running_loop().create_task(self._upload(upstream_key, key, image_url, image.match))
+                self._uploads[key] = task
+            return
+
+        self._blobs.move_to_end(key)
+        if blob.file_id is None:
+            return
+        del image.part["image_url"]
+        image.part["file_id"] = blob.file_id
+        self.references += 1
+        self.bytes_saved += len(image_url)
+
+    async def _upload(self, upstream_key: UpstreamKey, key: _BlobKey, image_url: str, match: re.Match) -> None:
+        try:
+            data = await asyncio.to_thread(base64.b64decode, image_url[match.end() :])
+            client = upstream_client_pool.get_upstream(upstream_key).get_openai_client(key.api_key or None)
+            extra_params = {}
+            if BLOB_STORE_FILE_TTL > 0:
+                extra_params["expires_after"] = {"anchor": "created_at", "seconds": BLOB_STORE_FILE_TTL}
+            file_object = await client.files.create(
+                file=(f"{key.sha256}.{match.group('subtype')}", data, match.group("media_type")),
+                purpose="vision",
+                **extra_params,
+            )
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            self.upload_failures += 1
+            print(f"\033[1;31mFailed to upload an image to {upstream_key.base_url}: {e}\033[0m")
+            self._store(key, _StoredBlob(None, time.time() + _UPLOAD_RETRY_AFTER))
+        else:
+            self.uploads += 1
+            expires_at = time.time() + BLOB_STORE_FILE_TTL - _EXPIRY_MARGIN if BLOB_STORE_FILE_TTL > 0 else math.inf
+            self._store(key, _StoredBlob(file_object.id, expires_at))
+        finally:
+            self._uploads.pop(key, None)
+
+    def _store(self, key: _BlobKey, blob: _StoredBlob) -> None:
+        self._blobs[key] = blob
+        while len(self._blobs) > BLOB_STORE_MAX_ENTRIES:
+            self._blobs.popitem(last=False)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": BLOB_STORE_ENABLED,
+            "stored_blobs": len(self._blobs),
+            "uploads_in_progress": len(self._uploads),
+            "uploads": self.uploads,
+            "upload_failures": self.upload_failures,
+            "references": self.references,
+            "bytes_saved": self.bytes_saved,
+        }
+
+
+blob_store = BlobStore()
+
+PROXY_METRICS.register_collector("blob_store", blob_store.stats)
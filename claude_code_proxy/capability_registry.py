@@ -0,0 +1,121 @@
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from claude_code_proxy.proxy_config import CAPABILITY_LEARNING_ENABLED, CAPABILITY_REGISTRY_PATH
+from common.metrics import PROXY_METRICS
+
+# E.g. "This model is only supported in v1/responses and not in
+# v1/chat/completions."
+_RESPONSES_API_ONLY_PATTERN = re.compile(r"only supported in v1/responses", re.IGNORECASE)
+# E.g. "Unsupported parameter: 'temperature' is not supported with this model."
+# or "Unsupported value: 'temperature' does not support 0.2 with this model."
+_UNSUPPORTED_PARAM_PATTERN = re.compile(r"Unsupported (?:parameter|value): '(?P<param>[\w.]+)'", re.IGNORECASE)
+
+# The Responses API names of the params that are named differently in the
+# ChatCompletions API (the params are dropped before the conversion)
+_COMPLAPI_PARAM_NAMES = {
+    "max_output_tokens": "max_tokens",
+    "reasoning": "reasoning_effort",
+    "reasoning.effort": "reasoning_effort",
+    "text.verbosity": "verbosity",
+}
+
+
+class CapabilityRegistry:
+    """
+    What the targets (see `ModelRoute.target_key`) are known not to support,
+    learned from the errors they responded with and persisted to a JSON file
+    (shared by the worker processes - every worker merges its findings into
+    the file).
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._capabilities: dict[str, dict[str, Any]] = self._load() if CAPABILITY_LEARNING_ENABLED else {}
+
+    def _load(self) -> dict[str, dict[str, Any]]:
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"\033[1;31mFailed to read the capability registry ({self.path}): {e}\033[0m")
+            return {}
+
+    def requires_responses_api(self, target: str) -> bool:
+        return bool(self._capabilities.get(target, {}).get("responses_api_only"))
+
+    def unsupported_params(self, target: str) -> list[str]:
+        return self._capabilities.get(target, {}).get("unsupported_params", [])
+
+    def learn(self, target: str, error: BaseException) -> bool:
+        """
+        Record what the error says the target does not support. Returns True
+        if it is something new (i.e. the request is worth retrying).
+        """
+        if not CAPABILITY_LEARNING_ENABLED or getattr(error, "status_code", None) != 400:
+            return False
+
+        message = str(error)
+        learned: Optional[str] = None
+        with self._lock:
+            capabilities = self._capabilities.setdefault(target, {})
+            if _RESPONSES_API_ONLY_PATTERN.search(message):
+                if not capabilities.get("responses_api_only"):
+                    capabilities["responses_api_only"] = True
+                    learned = "responses_api_only"
+            else:
+                match = _UNSUPPORTED_PARAM_PATTERN.search(message)
+                if match:
+                    param = _COMPLAPI_PARAM_NAMES.get(match.group("param"), match.group("param"))
+                    unsupported_params = capabilities.setdefault("unsupported_params", [])
+                    if param not in unsupported_params:
+                        unsupported_params.append(param)
+                        learned = f"unsupported_param:{param}"
+            if learned is None:
+                return False
+            capabilities["updated_at"] = datetime.now(UTC).isoformat()
+
+        PROXY_METRICS.inc("capabilities_learned", target=target, capability=learned)
+        print(f"\033[1;33mLearned about {target}: {learned} (retrying the request accordingly)\033[0m")
+        self._save()
+        return True
+
+    def _save(self) -> None:
+        with self._lock:
+            # Merge what the other workers have learned in the meantime
+            capabilities = self._load()
+            for target, learned in self._capabilities.items():
+                merged = capabilities.setdefault(target, {})
+                merged["responses_api_only"] = bool(
+                    merged.get("responses_api_only") or learned.get("responses_api_only")
+                )
+                merged["unsupported_params"] = list(
+                    dict.fromkeys(merged.get("unsupported_params", []) + learned.get("unsupported_params", []))
+                )
+                merged["updated_at"] = max(merged.get("updated_at", ""), learned.get("updated_at", ""))
+            self._capabilities = capabilities
+
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(capabilities, f, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"\033[1;31mFailed to write the capability registry ({self.path}): {e}\033[0m")
+
+    def stats(self) -> dict[str, Any]:
+        return {"enabled": CAPABILITY_LEARNING_ENABLED, "targets": dict(self._capabilities)}
+
+
+capability_registry = CapabilityRegistry(CAPABILITY_REGISTRY_PATH)
+
+PROXY_METRICS.register_collector("capabilities", capability_registry.stats)
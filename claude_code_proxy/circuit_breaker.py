@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Optional
+
+import httpx
+import openai
+
+from claude_code_proxy.proxy_config import (
+    CIRCUIT_BREAKER_COOLDOWN,
+    CIRCUIT_BREAKER_FAILURE_RATE,
+    CIRCUIT_BREAKER_MIN_REQUESTS,
+    CIRCUIT_BREAKER_PROBE_TIMEOUT,
+    CIRCUIT_BREAKER_WINDOW,
+)
+from common.metrics import PROXY_METRICS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def is_upstream_failure(error: BaseException) -> bool:
+    """
+    Whether the error says something about the health of the upstream (as
+    opposed to a problem with the particular request, e.g. a context window
+    overflow, which should not trip the circuit breaker).
+    """
+    if isinstance(error, (httpx.TimeoutException, httpx.NetworkError, TimeoutError)):
+        return True
+    if not isinstance(error, openai.APIError):
+        # LiteLLM's exceptions derive from OpenAI's - anything else is not an
+        # error reported by (or about) the upstream
+        return False
+    status_code = getattr(error, "status_code", None)
+    if not isinstance(status_code, int):
+        # Connection errors, etc.
+        return True
+    return status_code in (408, 429) or status_code >= 500
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """
+    How long the upstream asked us to wait before retrying (the Retry-After
+    header of the error response), if it said so.
+    """
+    headers = getattr(error, "litellm_response_headers", None) or getattr(
+        getattr(error, "response", None), "headers", None
+    )
+    try:
+        return float(headers["retry-after"]) if headers and "retry-after" in headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    A per-target circuit breaker. It opens when the failure rate within the
+    last `CIRCUIT_BREAKER_WINDOW` seconds reaches `CIRCUIT_BREAKER_FAILURE_RATE`
+    (given at least `CIRCUIT_BREAKER_MIN_REQUESTS` requests), stays open for
+    `CIRCUIT_BREAKER_COOLDOWN` seconds and then lets a single probe request
+    through (half-open): the breaker closes if the probe succeeds and opens
+    again if it fails.
+    """
+
+    def __init__(self, target: str) -> None:
+        self.target = target
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._outcomes: deque[tuple[float, bool]] = deque()
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+
+    def _trim_outcomes(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - CIRCUIT_BREAKER_WINDOW:
+            self._outcomes.popleft()
+
+    def _transition(self, state: str, now: float) -> None:
+        self.state = state
+        if state == OPEN:
+            self._opened_at = now
+        self._probe_started_at = None
+        self._outcomes.clear()
+        PROXY_METRICS.inc("circuit_breaker_transitions", target=self.target, state=state)
+
+        color = "\033[1;31m" if state == OPEN else "\033[1;33m" if state == HALF_OPEN else "\033[1;32m"
+        print(f"{color}Circuit breaker for {self.target}: {state}\033[0m")
+
+    def allow_request(self) -> bool:
+        """
+        Whether the target is healthy enough to send a request to it. (In the
+        half-open state, calling this reserves the probe.)
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= CIRCUIT_BREAKER_COOLDOWN:
+                self._transition(HALF_OPEN, now)
+
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                return False
+
+            # Half-open: let one probe through at a time (a probe that never
+            # reported back - e.g. because the client disconnected - is
+            # replaced after a while)
+            if self._probe_started_at is None or now - self._probe_started_at >= CIRCUIT_BREAKER_PROBE_TIMEOUT:
+                self._probe_started_at = now
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN or (self.state == OPEN and now - self._opened_at >= CIRCUIT_BREAKER_COOLDOWN):
+                # Either the probe succeeded, or a request that was sent
+                # despite the breaker being open (because there was no healthy
+                # alternative) succeeded after the cooldown
+                self._transition(CLOSED, now)
+                return
+            if self.state == OPEN:
+                # Most likely a request that was already in flight when the
+                # breaker opened
+                return
+            self._outcomes.append((now, True))
+            self._trim_outcomes(now)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._transition(OPEN, now)
+                return
+            if self.state == OPEN:
+                return
+
+            self._outcomes.append((now, False))
+            self._trim_outcomes(now)
+            failures = sum(1 for _, succeeded in self._outcomes if not succeeded)
+            if (
+                len(self._outcomes) >= CIRCUIT_BREAKER_MIN_REQUESTS
+                and failures / len(self._outcomes) >= CIRCUIT_BREAKER_FAILURE_RATE
+            ):
+                self._transition(OPEN, now)
+
+    def stats(self) -> dict[str, Any]:
+        with self._lock:
+            self._trim_outcomes(time.monotonic())
+            return {
+                "state": self.state,
+                "requests_in_window": len(self._outcomes),
+                "failures_in_window": sum(1 for _, succeeded in self._outcomes if not succeeded),
+            }
+
+
+class CircuitBreakerRegistry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, target: str) -> CircuitBreaker:
+        breaker = self._breakers.get(target)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(target, CircuitBreaker(target))
+        return breaker
+
+    def stats(self) -> dict[str, Any]:
+        return {target: breaker.stats() for target, breaker in list(self._breakers.items())}
+
+
+circuit_breakers = CircuitBreakerRegistry()
+
+PROXY_METRICS.register_collector("circuit_breakers", circuit_breakers.stats)
@@ -1,4 +1,6 @@
-from copy import deepcopy
+import asyncio
+import functools
+import sys
 from typing import AsyncGenerator, Callable, Generator, Optional, Union
 
 import httpx
@@ -16,143 +18,110 @@ from litellm import (
     ResponsesAPIStreamingResponse,
 )
 
-from claude_code_proxy.proxy_config import ENFORCE_ONE_TOOL_CALL_PER_RESPONSE
-from claude_code_proxy.route_model import ModelRoute
+from claude_code_proxy.api_key_pool import api_key_pool
+from claude_code_proxy.capability_registry import capability_registry
+from claude_code_proxy.circuit_breaker import is_upstream_failure, retry_after_seconds
+from claude_code_proxy.client_disconnect import get_client_connection
+from claude_code_proxy.priority_scheduler import RequestShedError, priority_scheduler
+from claude_code_proxy.proxy_config import (
+    SERVE_NON_STREAMING_VIA_STREAM,
+    SINGLE_FLIGHT_ENABLED,
+    STREAM_BUFFER_FULL_POLICY,
+    STREAM_BUFFER_SIZE,
+    STREAM_COALESCE_MAX_CHARS,
+    STREAM_COALESCE_WINDOW_MS,
+    UPSTREAM_INTER_CHUNK_TIMEOUT,
+    UPSTREAM_STALL_RETRIES,
+    UPSTREAM_STALL_RETRY_ALTERNATE_TARGET,
+    UPSTREAM_STALL_RETRY_BACKOFF,
+)
+from claude_code_proxy.routed_request import RoutedRequest
+from claude_code_proxy.single_flight import in_flight_streams
+from claude_code_proxy.upstream_clients import close_upstream_stream
+from common.bounded_stream import BoundedStream
 from common.config import WRITE_TRACES_TO_FILES
+from common.delta_coalescing import coalesce_text_deltas
+from common.flight_recorder import dump_flight_recording
+from common.metrics import PROXY_METRICS
+from common.otel_tracing import traced_stage
+from common.stream_deadlines import (
+    UpstreamStallError,
+    iterate_with_deadlines,
+    prepend_items,
+    read_until,
+    retry_stalls,
+    seconds_left,
+)
 from common.tracing_in_markdown import (
-    write_request_trace,
     write_response_trace,
     write_streaming_chunk_trace,
 )
 from common.utils import (
     ProxyError,
-    convert_chat_messages_to_respapi,
-    convert_chat_params_to_respapi,
+    assemble_model_response,
     convert_respapi_to_model_response,
-    generate_timestamp_utc,
+    start_responses_stream,
     to_generic_streaming_chunk,
     responses_eof_finalize_chunk,
 )
 
 
-class RoutedRequest:
-    def __init__(
-        self,
-        *,
-        calling_method: str,
-        model: str,
-        messages_original: list,
-        params_original: dict,
-        stream: bool,
-    ) -> None:
-        self.timestamp = generate_timestamp_utc()
-        self.calling_method = calling_method
-        self.model_route = ModelRoute(model)
-
-        self.messages_original = messages_original
-        self.params_original = params_original
-
-        self.messages_complapi = deepcopy(self.messages_original)
-        self.params_complapi = deepcopy(self.params_original)
-
-        self.params_complapi.update(self.model_route.extra_params)
-        self.params_complapi["stream"] = stream
-
-        if self.model_route.use_responses_api:
-            # TODO What's a more reasonable way to decide when to unset
-            #  temperature ?
-            self.params_complapi.pop("temperature", None)
-
-        # For Langfuse
-        trace_name = f"{self.timestamp}-OUTBOUND-{self.calling_method}"
-        self.params_complapi.setdefault("metadata", {})["trace_name"] = trace_name
-
-        if not self.model_route.is_target_anthropic:
-            self._adapt_complapi_for_non_anthropic_models()
-
-        if self.model_route.use_responses_api:
-            self.messages_respapi = convert_chat_messages_to_respapi(self.messages_complapi)
-            self.params_respapi = convert_chat_params_to_respapi(self.params_complapi)
-        else:
-            self.messages_respapi = None
-            self.params_respapi = None
-
-        if WRITE_TRACES_TO_FILES:
-            write_request_trace(
-                timestamp=self.timestamp,
-                calling_method=self.calling_method,
-                messages_original=self.messages_original,
-                params_original=self.params_original,
-                messages_complapi=self.messages_complapi,
-                params_complapi=self.params_complapi,
-                messages_respapi=self.messages_respapi,
-                params_respapi=self.params_respapi,
-            )
-
-    def _adapt_complapi_for_non_anthropic_models(self) -> None:
-        """
-        Perform necessary prompt injections to adjust certain requests to work with
-        non-Anthropic models.
-        """
-        # Claude Code 2.x sends `context_management` on /v1/messages, but
-        # OpenAI's ChatCompletions and Responses APIs do not support it
-        # TODO How to reproduce the problem that the line below is fixing ?
-        #  (This fix was contributed)
-        self.params_complapi.pop("context_management", None)
-
-        if (
-            self.params_complapi.get("max_tokens") == 1
-            and len(self.messages_complapi) == 1
-            and self.messages_complapi[0].get("role") == "user"
-            and self.messages_complapi[0].get("content") in ["quota", "test"]
-        ):
-            # This is a "connectivity test" request by Claude Code => we need
-            # to make sure non-Anthropic models don't fail because of exceeding
-            # max_tokens
-            self.params_complapi["max_tokens"] = 100
-            self.messages_complapi[0]["role"] = "system"
-            self.messages_complapi[0][
-                "content"
-            ] = "The intention of this request is to test connectivity. Please respond with a single word: OK"
-            return
-
-        system_prompt_items = []
-
-        # Only add the instruction if at least two tools and/or functions are present in the request (in total)
-        num_tools = len(self.params_complapi.get("tools") or []) + len(self.params_complapi.get("functions") or [])
-        if ENFORCE_ONE_TOOL_CALL_PER_RESPONSE and num_tools > 1:
-            # Add the single tool call instruction as the last message
-            # TODO Get rid of this hack after the token conversion code in
-            #  `common/utils.py` is reimplemented. (Seems that it's not the
-            #  Claude Code CLI that doesn't support multiple tool calls in a
-            #  single response, it's our token conversion code that doesn't.)
-            system_prompt_items.append(
-                "* When using tools, call AT MOST one tool per response. Never attempt multiple tool calls in a "
-                "single response. The client does not support multiple tool calls in a single response. If multiple "
-                "tools are needed, choose the next best single tool, return exactly one tool call, and wait for the "
-                "next turn."
-            )
-
-        if self.model_route.use_responses_api:
-            # TODO A temporary measure until the token conversion code is
-            #  reimplemented. (Right now, whenever the model tries to
-            #  communicate that it needs to correct its course of action, it
-            #  just stops doing the task, which I suspect is a token conversion
-            #  issue.)
-            system_prompt_items.append(
-                "* Until you're COMPLETELY done with your task, DO NOT EXPLAIN TO THE USER ANYTHING AT ALL, even if "
-                "you need to correct your course of action (just use REASONING for that, which the user cannot see). "
-                "A summary of your work at the very end is enough."
-            )
-
-        if system_prompt_items:
-            # append the system prompt as the last message in the context
-            self.messages_complapi.append(
-                {
-                    "role": "system",
-                    "content": "IMPORTANT:\n" + "\n".join(system_prompt_items),
-                }
-            )
+def _dump_flight_recording(routed_request: Optional[RoutedRequest], error: BaseException) -> None:
+    if routed_request is not None:
+        routed_request = routed_request.latest_attempt()
+    dump_flight_recording(
+        "proxy_error", routed_request.flight_recorder if routed_request is not None else None, detail=str(error)
+    )
+
+
+async def _retry_with_learned_capabilities(routed_request: RoutedRequest, error: Exception) -> Optional[RoutedRequest]:
+    """
+    If the error says what the target does not support (and it wasn't known
+    yet), the request to send instead. It is rebuilt, rather than patched, so
+    that the conversion picks up what was learned.
+    """
+    if not capability_registry.learn(routed_request.model_route.target_key, error):
+        return None
+    routed_request.end_trace(error)
+    PROXY_METRICS.inc("capability_retries", target=routed_request.model_route.target_key)
+    return await routed_request.retry(avoid_current_target=False)
+
+
+async def _retry_stalled_request(
+    routed_request: RoutedRequest, error: UpstreamStallError, retry_number: int
+) -> RoutedRequest:
+    _record_upstream_failure(routed_request, error)
+    PROXY_METRICS.inc("upstream_stall_retries", target=routed_request.model_route.target_key)
+    print(
+        f"\033[1;33m{routed_request.model_route.target_key} stalled before the first chunk, retrying "
+        f"({retry_number}/{UPSTREAM_STALL_RETRIES})...\033[0m"
+    )
+    return await routed_request.retry(avoid_current_target=UPSTREAM_STALL_RETRY_ALTERNATE_TARGET)
+
+
+def _carries_content(generic_chunk: GenericStreamingChunk) -> bool:
+    # (The Responses API sends its first events right away, before the model
+    # has produced anything, so the first chunk deadline applies to the first
+    # chunk that actually carries something)
+    return bool(generic_chunk.get("text") or generic_chunk.get("tool_use") or generic_chunk.get("is_finished"))
+
+
+def _record_upstream_failure(routed_request: Optional[RoutedRequest], error: BaseException) -> None:
+    if routed_request is None:
+        return
+    # It's the last attempt that failed
+    routed_request = routed_request.latest_attempt()
+    routed_request.end_trace(error)
+    if isinstance(error, RequestShedError):
+        # (It never left the proxy)
+        return
+    if getattr(error, "status_code", None) == 429 and routed_request.api_key:
+        api_key_pool.record_rate_limited(routed_request.api_key, retry_after_seconds(error))
+    if is_upstream_failure(error):
+        routed_request.model_route.circuit_breaker.record_failure()
+        if not api_key_pool.has_available_key(routed_request.model_route.target_model.split("/", 1)[0]):
+            # Hold the upstream back only if there is no other key to use
+            priority_scheduler.on_upstream_error(routed_request.model_route, error)
 
 
 class ClaudeCodeRouter(CustomLLM):
@@ -177,6 +146,7 @@ class ClaudeCodeRouter(CustomLLM):
         timeout: Optional[Union[float, httpx.Timeout]] = None,
         client: Optional[HTTPHandler] = None,
     ) -> ModelResponse:
+        routed_request = None
         try:
             routed_request = RoutedRequest(
                 calling_method="completion",
@@ -185,33 +155,40 @@ class ClaudeCodeRouter(CustomLLM):
                 params_original=optional_params,
                 stream=False,
             )
-
-            if routed_request.model_route.use_responses_api:
-                response_respapi: ResponsesAPIResponse = litellm.responses(
-                    # TODO Make sure all params are supported
-                    model=routed_request.model_route.target_model,
-                    input=routed_request.messages_respapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    **routed_request.params_respapi,
-                )
-                response_complapi: ModelResponse = convert_respapi_to_model_response(response_respapi)
-
-            else:
-                response_respapi = None
-                response_complapi: ModelResponse = litellm.completion(
-                    model=routed_request.model_route.target_model,
-                    messages=routed_request.messages_complapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    # Drop any params that are not supported by the provider
-                    drop_params=True,
-                    **routed_request.params_complapi,
-                )
+            routed_request.choose_api_key()
+
+            with traced_stage("proxy.upstream_call", routed_request.span):
+                if routed_request.model_route.use_responses_api:
+                    response_respapi: ResponsesAPIResponse = litellm.responses(
+                        # TODO Make sure all params are supported
+                        model=routed_request.model_route.target_model,
+                        api_base=routed_request.model_route.api_base,
+                        api_key=routed_request.api_key,
+                        input=routed_request.messages_respapi,
+                        logger_fn=logger_fn,
+                        headers=headers or {},
+                        timeout=timeout,
+                        client=client,
+                        **routed_request.params_respapi,
+                    )
+                    response_complapi: ModelResponse = convert_respapi_to_model_response(response_respapi)
+
+                else:
+                    response_respapi = None
+                    response_complapi: ModelResponse = litellm.completion(
+                        model=routed_request.model_route.target_model,
+                        api_base=routed_request.model_route.api_base,
+                        api_key=routed_request.api_key,
+                        messages=routed_request.messages_complapi,
+                        logger_fn=logger_fn,
+                        headers=headers or {},
+                        timeout=timeout,
+                        client=client,
+                        # Drop any params that are not supported by the provider
+                        drop_params=True,
+                        **routed_request.params_complapi,
+                    )
+            routed_request.record_usage(getattr(response_complapi, "usage", None))
 
             if WRITE_TRACES_TO_FILES:
                 write_response_trace(
@@ -221,9 +198,13 @@ class ClaudeCodeRouter(CustomLLM):
                     response_complapi=response_complapi,
                 )
 
+            routed_request.model_route.circuit_breaker.record_success()
+            routed_request.end_trace()
             return response_complapi
 
         except Exception as e:
+            _record_upstream_failure(routed_request, e)
+            _dump_flight_recording(routed_request, e)
             raise ProxyError(e) from e
 
     async def acompletion(
@@ -245,41 +226,36 @@ class ClaudeCodeRouter(CustomLLM):
         timeout: Optional[Union[float, httpx.Timeout]] = None,
         client: Optional[AsyncHTTPHandler] = None,
     ) -> ModelResponse:
+        routed_request = None
         try:
-            routed_request = RoutedRequest(
+            routed_request = await RoutedRequest.acreate(
                 calling_method="acompletion",
                 model=model,
                 messages_original=messages,
                 params_original=optional_params,
-                stream=False,
+                stream=SERVE_NON_STREAMING_VIA_STREAM,
             )
 
-            if routed_request.model_route.use_responses_api:
-                response_respapi: ResponsesAPIResponse = await litellm.aresponses(
-                    # TODO Make sure all params are supported
-                    model=routed_request.model_route.target_model,
-                    input=routed_request.messages_respapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    **routed_request.params_respapi,
+            if SERVE_NON_STREAMING_VIA_STREAM:
+                # Stream the response from the upstream (so a stalled upstream
+                # is detected by the stream deadlines instead of the request
+                # hanging until the overall timeout) and assemble it here
+                routed_request, generic_stream = await self._aopen_generic_stream(
+                    routed_request, logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
                 )
-                response_complapi: ModelResponse = convert_respapi_to_model_response(response_respapi)
+                try:
+                    generic_chunks = [generic_chunk async for generic_chunk in generic_stream]
+                except BaseException:
+                    routed_request.close_upstream()
+                    raise
+                response_respapi = None
+                response_complapi = assemble_model_response(generic_chunks, routed_request.model_route.target_model)
 
             else:
-                response_respapi = None
-                response_complapi: ModelResponse = await litellm.acompletion(
-                    model=routed_request.model_route.target_model,
-                    messages=routed_request.messages_complapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    # Drop any params that are not supported by the provider
-                    drop_params=True,
-                    **routed_request.params_complapi,
+                routed_request, response_respapi, response_complapi = await self._acomplete_upstream(
+                    routed_request, logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
                 )
+                routed_request.record_usage(getattr(response_complapi, "usage", None))
 
             if WRITE_TRACES_TO_FILES:
                 write_response_trace(
@@ -289,9 +265,20 @@ class ClaudeCodeRouter(CustomLLM):
                     response_complapi=response_complapi,
                 )
 
+            if not routed_request.upstream_responded:
+                # (Already recorded when the first chunk arrived otherwise)
+                routed_request.model_route.circuit_breaker.record_success()
+            routed_request.end_trace()
             return response_complapi
 
+        except RequestShedError as e:
+            # (Not wrapped, so that the client gets a 503 rather than a 500)
+            _record_upstream_failure(routed_request, e)
+            raise
+
         except Exception as e:
+            _record_upstream_failure(routed_request, e)
+            _dump_flight_recording(routed_request, e)
             raise ProxyError(e) from e
 
     def streaming(
@@ -313,6 +300,7 @@ class ClaudeCodeRouter(CustomLLM):
         timeout: Optional[Union[float, httpx.Timeout]] = None,
         client: Optional[HTTPHandler] = None,
     ) -> Generator[GenericStreamingChunk, None, None]:
+        routed_request = None
         try:
             routed_request = RoutedRequest(
                 calling_method="streaming",
@@ -321,34 +309,42 @@ class ClaudeCodeRouter(CustomLLM):
                 params_original=optional_params,
                 stream=True,
             )
+            routed_request.choose_api_key()
+
+            with traced_stage("proxy.upstream_call", routed_request.span):
+                if routed_request.model_route.use_responses_api:
+                    resp_stream: BaseResponsesAPIStreamingIterator = litellm.responses(
+                        # TODO Make sure all params are supported
+                        model=routed_request.model_route.target_model,
+                        api_base=routed_request.model_route.api_base,
+                        api_key=routed_request.api_key,
+                        input=routed_request.messages_respapi,
+                        logger_fn=logger_fn,
+                        headers=headers or {},
+                        timeout=timeout,
+                        client=client,
+                        **routed_request.params_respapi,
+                    )
 
-            if routed_request.model_route.use_responses_api:
-                resp_stream: BaseResponsesAPIStreamingIterator = litellm.responses(
-                    # TODO Make sure all params are supported
-                    model=routed_request.model_route.target_model,
-                    input=routed_request.messages_respapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    **routed_request.params_respapi,
-                )
-
-            else:
-                resp_stream: CustomStreamWrapper = litellm.completion(
-                    model=routed_request.model_route.target_model,
-                    messages=routed_request.messages_complapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    # Drop any params that are not supported by the provider
-                    drop_params=True,
-                    **routed_request.params_complapi,
-                )
+                else:
+                    resp_stream: CustomStreamWrapper = litellm.completion(
+                        model=routed_request.model_route.target_model,
+                        api_base=routed_request.model_route.api_base,
+                        api_key=routed_request.api_key,
+                        messages=routed_request.messages_complapi,
+                        logger_fn=logger_fn,
+                        headers=headers or {},
+                        timeout=timeout,
+                        client=client,
+                        # Drop any params that are not supported by the provider
+                        drop_params=True,
+                        **routed_request.params_complapi,
+                    )
 
+            routed_request.flight_recorder = start_responses_stream().flight_recorder
             for chunk_idx, chunk in enumerate[ModelResponseStream | ResponsesAPIStreamingResponse](resp_stream):
                 generic_chunk = to_generic_streaming_chunk(chunk)
+                routed_request.on_stream_chunk(generic_chunk)
 
                 if WRITE_TRACES_TO_FILES:
                     if routed_request.model_route.use_responses_api:
@@ -367,6 +363,8 @@ class ClaudeCodeRouter(CustomLLM):
 
                 yield generic_chunk
 
+            routed_request.on_stream_completed()
+
             # EOF fallback: if provider ended stream without a terminal event and
             # we have a pending tool with buffered args, emit once.
             # TODO Refactor or get rid of the try/except block below after the
@@ -381,6 +379,8 @@ class ClaudeCodeRouter(CustomLLM):
                 pass
 
         except Exception as e:
+            _record_upstream_failure(routed_request, e)
+            _dump_flight_recording(routed_request, e)
             raise ProxyError(e) from e
 
     async def astreaming(
@@ -402,8 +402,9 @@ class ClaudeCodeRouter(CustomLLM):
         timeout: Optional[Union[float, httpx.Timeout]] = None,
         client: Optional[AsyncHTTPHandler] = None,
     ) -> AsyncGenerator[GenericStreamingChunk, None]:
+        routed_request = None
         try:
-            routed_request = RoutedRequest(
+            routed_request = await RoutedRequest.acreate(
                 calling_method="astreaming",
                 model=model,
                 messages_original=messages,
@@ -411,33 +412,253 @@ class ClaudeCodeRouter(CustomLLM):
                 stream=True,
             )
 
-            if routed_request.model_route.use_responses_api:
-                resp_stream: BaseResponsesAPIStreamingIterator = await litellm.aresponses(
-                    # TODO Make sure all params are supported
-                    model=routed_request.model_route.target_model,
-                    input=routed_request.messages_respapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    **routed_request.params_respapi,
+            upstream_chunks = functools.partial(
+                self._astream_upstream,
+                routed_request,
+                logger_fn=logger_fn,
+                headers=headers,
+                timeout=timeout,
+                client=client,
+            )
+            subscription = None
+            if SINGLE_FLIGHT_ENABLED:
+                subscription = in_flight_streams.subscribe(
+                    await routed_request.aget_fingerprint(),
+                    upstream_chunks,
+                    abort_upstream=routed_request.close_upstream,
                 )
-
+                generic_stream = subscription
             else:
-                resp_stream: CustomStreamWrapper = await litellm.acompletion(
-                    model=routed_request.model_route.target_model,
-                    messages=routed_request.messages_complapi,
-                    logger_fn=logger_fn,
-                    headers=headers or {},
-                    timeout=timeout,
-                    client=client,
-                    # Drop any params that are not supported by the provider
-                    drop_params=True,
-                    **routed_request.params_complapi,
+                generic_stream = upstream_chunks()
+            if STREAM_BUFFER_SIZE > 0:
+                # (Every client of a shared stream gets a buffer of its own, so
+                # the buffer full policy applies to each of them)
+                generic_stream = BoundedStream(generic_stream, STREAM_BUFFER_SIZE, STREAM_BUFFER_FULL_POLICY)
+
+            def abort_stream() -> None:
+                if isinstance(generic_stream, BoundedStream):
+                    generic_stream.cancel()
+                if subscription is not None:
+                    # (A shared stream is only aborted when the last of its
+                    # subscribers leaves)
+                    subscription.cancel()
+                else:
+                    # Don't let the upstream keep generating (and holding a
+                    # connection) for a response nobody is going to read
+                    routed_request.close_upstream()
+
+            def on_client_disconnected() -> None:
+                # E.g. the user hit Esc in Claude Code
+                PROXY_METRICS.inc(
+                    "streams_cancelled_by_client", target=routed_request.latest_attempt().model_route.target_key
                 )
+                abort_stream()
+
+            client_connection = get_client_connection()
+            if client_connection is not None:
+                client_connection.add_disconnect_callback(on_client_disconnected)
+
+            stream_completed = False
+            try:
+                async for generic_chunk in generic_stream:
+                    yield generic_chunk
+                stream_completed = True
+
+            finally:
+                if client_connection is not None:
+                    client_connection.remove_disconnect_callback(on_client_disconnected)
+                if not stream_completed:
+                    # The stream failed or was closed/cancelled by the server
+                    abort_stream()
+                # (The request that fed the stream has ended its trace already,
+                # unless this request attached to a shared stream or the client
+                # went away)
+                if stream_completed:
+                    routed_request.end_trace()
+                else:
+                    error = sys.exc_info()[1]
+                    if not isinstance(error, Exception):
+                        # (Closed or cancelled)
+                        error = "The stream was not read to the end"
+                    routed_request.end_trace(error)
+
+        except (ProxyError, RequestShedError):
+            # (Recorded by `_astream_upstream()`)
+            raise
 
+        except Exception as e:
+            _record_upstream_failure(routed_request, e)
+            _dump_flight_recording(routed_request, e)
+            raise ProxyError(e) from e
+
+    async def _astream_upstream(
+        self,
+        routed_request: RoutedRequest,
+        *,
+        logger_fn,
+        headers,
+        timeout: Optional[Union[float, httpx.Timeout]],
+        client: Optional[AsyncHTTPHandler],
+    ) -> AsyncGenerator[GenericStreamingChunk, None]:
+        """
+        Open the upstream stream and yield its generic chunks. This is what a
+        shared stream consumes in a task of its own, so an upstream failure is
+        recorded here - once, however many requests share the stream.
+        """
+        try:
+            routed_request, generic_stream = await self._aopen_generic_stream(
+                routed_request, logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
+            )
+            if STREAM_COALESCE_WINDOW_MS > 0:
+                generic_stream = coalesce_text_deltas(
+                    generic_stream, STREAM_COALESCE_WINDOW_MS / 1000, STREAM_COALESCE_MAX_CHARS
+                )
+            async for generic_chunk in generic_stream:
+                yield generic_chunk
+
+        except RequestShedError as e:
+            # (Not wrapped, so that the client gets a 503 rather than a 500)
+            _record_upstream_failure(routed_request, e)
+            raise
+
+        except Exception as e:
+            _record_upstream_failure(routed_request, e)
+            _dump_flight_recording(routed_request, e)
+            raise ProxyError(e) from e
+
+    async def _aopen_generic_stream(
+        self,
+        routed_request: RoutedRequest,
+        *,
+        logger_fn,
+        headers,
+        timeout: Optional[Union[float, httpx.Timeout]],
+        client: Optional[AsyncHTTPHandler],
+    ) -> tuple[RoutedRequest, AsyncGenerator[GenericStreamingChunk, None]]:
+        """
+        Open the upstream stream and read it up to the first chunk with
+        content. Nothing has been sent to the client until then, so an upstream
+        that stalls before that point is retried (after a jittered backoff,
+        and on another remap target if configured so) - and never after.
+
+        Returns the request that was eventually sent (a retry is a new
+        request) and the generic chunks (including the ones that were read
+        ahead).
+        """
+
+        async def open_attempt(attempt_request: RoutedRequest) -> AsyncGenerator[GenericStreamingChunk, None]:
+            resp_stream = await self._aopen_upstream_stream(
+                attempt_request, logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
+            )
+            generic_stream = self._agenerate_generic_chunks(attempt_request, resp_stream)
+
+            def on_stall() -> None:
+                PROXY_METRICS.inc("upstream_stalls", target=attempt_request.model_route.target_key)
+                close_upstream_stream(resp_stream)
+
+            leading_chunks = await read_until(
+                generic_stream, _carries_content, attempt_request.first_chunk_deadline, on_stall
+            )
+            return prepend_items(leading_chunks, generic_stream)
+
+        while True:
+            try:
+                return await retry_stalls(
+                    open_attempt,
+                    routed_request,
+                    retries=UPSTREAM_STALL_RETRIES,
+                    backoff=UPSTREAM_STALL_RETRY_BACKOFF,
+                    prepare_retry=_retry_stalled_request,
+                )
+
+            except litellm.BadRequestError as e:
+                # (What the target doesn't support is reported with a 400)
+                retried_request = await _retry_with_learned_capabilities(routed_request.latest_attempt(), e)
+                if retried_request is None:
+                    raise
+                routed_request = retried_request
+
+    async def _acomplete_upstream(
+        self,
+        routed_request: RoutedRequest,
+        *,
+        logger_fn,
+        headers,
+        timeout: Optional[Union[float, httpx.Timeout]],
+        client: Optional[AsyncHTTPHandler],
+    ) -> tuple[RoutedRequest, Optional[ResponsesAPIResponse], ModelResponse]:
+        """
+        Send a non-streaming request to the upstream (again, in the way the
+        target turned out to require, if its error says so).
+
+        Returns the request that was eventually sent and both forms of the
+        response.
+        """
+        while True:
+            try:
+                await routed_request.wait_for_upstream()
+                with traced_stage("proxy.upstream_call", routed_request.span):
+                    response = await routed_request.call_upstream(
+                        logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
+                    )
+                if routed_request.model_route.use_responses_api:
+                    response_respapi: Optional[ResponsesAPIResponse] = response
+                    response_complapi: ModelResponse = convert_respapi_to_model_response(response)
+                else:
+                    response_respapi, response_complapi = None, response
+                return routed_request, response_respapi, response_complapi
+
+            except litellm.BadRequestError as e:
+                # (What the target doesn't support is reported with a 400)
+                retried_request = await _retry_with_learned_capabilities(routed_request, e)
+                if retried_request is None:
+                    raise
+                routed_request = retried_request
+
+    async def _aopen_upstream_stream(
+        self,
+        routed_request: RoutedRequest,
+        *,
+        logger_fn,
+        headers,
+        timeout: Optional[Union[float, httpx.Timeout]],
+        client: Optional[AsyncHTTPHandler],
+    ) -> Union[BaseResponsesAPIStreamingIterator, CustomStreamWrapper]:
+        await routed_request.wait_for_upstream()
+        upstream_call = routed_request.call_upstream(
+            logger_fn=logger_fn, headers=headers, timeout=timeout, client=client
+        )
+
+        # The response headers count against the first chunk deadline too
+        deadline = asyncio.timeout(seconds_left(routed_request.first_chunk_deadline))
+        try:
+            with traced_stage("proxy.upstream_call", routed_request.span):
+                async with deadline:
+                    routed_request.upstream_stream = await upstream_call
+                    return routed_request.upstream_stream
+        except TimeoutError as e:
+            if not deadline.expired():
+                raise
+            PROXY_METRICS.inc("upstream_stalls", target=routed_request.model_route.target_key)
+            raise UpstreamStallError("The upstream did not respond in time") from e
+
+    async def _agenerate_generic_chunks(
+        self,
+        routed_request: RoutedRequest,
+        resp_stream: Union[BaseResponsesAPIStreamingIterator, CustomStreamWrapper],
+    ) -> AsyncGenerator[GenericStreamingChunk, None]:
+        # (This generator may run in a task of its own - a stream buffer's or
+        # a shared stream's producer - so the conversion state is set up here)
+        stream_state = start_responses_stream()
+        routed_request.flight_recorder = stream_state.flight_recorder
+        upstream_chunks = resp_stream
+        if routed_request.first_chunk_deadline is not None or UPSTREAM_INTER_CHUNK_TIMEOUT > 0:
+            upstream_chunks = iterate_with_deadlines(
+                resp_stream, routed_request.first_chunk_deadline, UPSTREAM_INTER_CHUNK_TIMEOUT or None
+            )
+        try:
             chunk_idx = 0
-            async for chunk in resp_stream:
+            async for chunk in upstream_chunks:
                 generic_chunk = to_generic_streaming_chunk(chunk)
 
                 if WRITE_TRACES_TO_FILES:
@@ -455,14 +676,15 @@ class ClaudeCodeRouter(CustomLLM):
                         generic_chunk=generic_chunk,
                     )
 
+                routed_request.on_stream_chunk(generic_chunk)
                 yield generic_chunk
                 chunk_idx += 1
 
-            # EOF fallback: if provider ended stream without a terminal event and
-            # we have a pending tool with buffered args, emit once.
+            # EOF fallback: if provider ended stream without a terminal event
+            # and we have a pending tool with buffered args, emit once.
             # TODO Refactor or get rid of the try/except block below after the
-            #  code in `common/utils.py` is owned (after the vibe-code there is
-            #  replaced with proper code)
+            #  code in `common/utils.py` is owned (after the vibe-code there
+            #  is replaced with proper code)
             try:
                 eof_chunk = responses_eof_finalize_chunk()
                 if eof_chunk is not None:
@@ -471,8 +693,16 @@ class ClaudeCodeRouter(CustomLLM):
                 # Ignore; best-effort fallback
                 pass
 
-        except Exception as e:
-            raise ProxyError(e) from e
+            routed_request.on_stream_completed()
+
+        except UpstreamStallError:
+            PROXY_METRICS.inc("upstream_stalls", target=routed_request.model_route.target_key)
+            # Don't wait for the rest of a response that may never come
+            close_upstream_stream(resp_stream)
+            raise
+
+        finally:
+            stream_state.clear()
 
 
 claude_code_router = ClaudeCodeRouter()
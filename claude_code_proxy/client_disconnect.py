@@ -0,0 +1,129 @@
+import asyncio
+import sys
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+
+class ClientConnection:
+    """
+    Tracks whether the client of the current HTTP request is still connected
+    and lets the code that serves the request react as soon as it goes away.
+    """
+
+    def __init__(self) -> None:
+        self.disconnected = False
+        self._disconnected_event = asyncio.Event()
+        self._callbacks: list[Callable[[], None]] = []
+
+    def add_disconnect_callback(self, callback: Callable[[], None]) -> None:
+        if self.disconnected:
+            callback()
+            return
+        self._callbacks.append(callback)
+
+    def remove_disconnect_callback(self, callback: Callable[[], None]) -> None:
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def mark_disconnected(self) -> None:
+        if self.disconnected:
+            return
+        self.disconnected = True
+        self._disconnected_event.set()
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                print(f"\033[1;31mClient disconnect callback failed: {e!r}\033[0m")
+
+    async def wait_disconnected(self) -> None:
+        await self._disconnected_event.wait()
+
+
+_CLIENT_CONNECTION: ContextVar[Optional[ClientConnection]] = ContextVar("_CLIENT_CONNECTION", default=None)
+
+
+def get_client_connection() -> Optional[ClientConnection]:
+    """
+    The connection of the client whose request is being served (None if we
+    are not serving an HTTP request via the proxy server).
+    """
+    return _CLIENT_CONNECTION.get()
+
+
+class ClientDisconnectMiddleware:
+    """
+    Pure ASGI middleware that keeps listening for `http.disconnect` once the
+    request body has been read. (Servers that implement ASGI spec 2.4, like
+    uvicorn, silently drop whatever is sent after the client disconnected, so
+    without this a streaming response would be generated to the end even if
+    nobody is reading it.)
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        connection = ClientConnection()
+        watcher: Optional[asyncio.Task] = None
+
+        async def watch_for_disconnect() -> None:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    connection.mark_disconnected()
+                    return
+
+        async def receive_wrapper() -> dict:
+            nonlocal watcher
+
+            if watcher is not None:
+                # The watcher owns `receive` now
+                await connection.wait_disconnected()
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                connection.mark_disconnected()
+            elif message["type"] == "http.request" and not message.get("more_body", False):
+                watcher = asyncio.create_task(watch_for_disconnect())
+            return message
+
+        token = _CLIENT_CONNECTION.set(connection)
+        try:
+            await self.app(scope, receive_wrapper, send)
+        finally:
+            _CLIENT_CONNECTION.reset(token)
+            if watcher is not None:
+                watcher.cancel()
+
+
+_CLIENT_DISCONNECT_MIDDLEWARE_REGISTERED = False
+
+
+def register_client_disconnect_middleware() -> None:
+    """
+    Install `ClientDisconnectMiddleware` on the LiteLLM proxy server app. Does
+    nothing when we are not running inside the LiteLLM proxy server.
+    """
+    global _CLIENT_DISCONNECT_MIDDLEWARE_REGISTERED  # pylint: disable=global-statement
+
+    if _CLIENT_DISCONNECT_MIDDLEWARE_REGISTERED or "litellm.proxy.proxy_server" not in sys.modules:
+        return
+
+    from litellm.proxy.proxy_server import app  # pylint: disable=import-outside-toplevel
+
+    if app.middleware_stack is None:
+        app.add_middleware(ClientDisconnectMiddleware)
+    else:
+        # The custom providers are loaded while the app is starting up, which
+        # is after Starlette has built the middleware stack (and won't accept
+        # any more middleware the usual way)
+        app.middleware_stack = ClientDisconnectMiddleware(app.middleware_stack)
+    _CLIENT_DISCONNECT_MIDDLEWARE_REGISTERED = True
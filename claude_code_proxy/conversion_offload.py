@@ -0,0 +1,65 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from claude_code_proxy.proxy_config import CONVERSION_OFFLOAD_MIN_BYTES, CONVERSION_OFFLOAD_WORKERS
+from common.metrics import PROXY_METRICS
+
+T = TypeVar("T")
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def approximate_size(value: Any) -> int:
+    """
+    Roughly how many bytes a JSON-like value takes - the length of the strings
+    in it, which is what a conversation with pasted files, tool results and
+    images consists of (much cheaper than serializing it).
+    """
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(key) + approximate_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(approximate_size(item) for item in value)
+    return 8
+
+
+def should_offload(request_size: int) -> bool:
+    return 0 < CONVERSION_OFFLOAD_MIN_BYTES <= request_size
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor  # pylint: disable=global-statement
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # (A pool of its own - the default executor of the event loop
+                # is shared with LiteLLM and the rest of the proxy)
+                _executor = ThreadPoolExecutor(
+                    max_workers=CONVERSION_OFFLOAD_WORKERS, thread_name_prefix="request-conversion"
+                )
+    return _executor
+
+
+async def run_offloaded(func: Callable[..., T], *args: Any) -> T:
+    """
+    Run CPU-heavy work (on a big request) in a worker thread, so that the
+    event loop keeps serving the other streams in the meantime.
+
+    A thread rather than a process: the work is on objects that would have to
+    be pickled (on the event loop) to get them to another process and back.
+    The work still holds the GIL, but the interpreter switches threads every
+    few milliseconds (see `sys.getswitchinterval()`), so the event loop is
+    held up for that long at a time instead of for the whole conversion.
+    """
+    PROXY_METRICS.inc("conversions_offloaded", operation=func.__name__)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_executor(), functools.partial(context.run, func, *args)
+    )
@@ -0,0 +1,35 @@
+import asyncio
+
+from claude_code_proxy.admin_endpoints import register_admin_endpoints
+from claude_code_proxy.client_disconnect import register_client_disconnect_middleware
+from claude_code_proxy.sse_keepalive import register_sse_keepalive_middleware
+from common.lazy_custom_llm import LazyCustomLLM
+
+claude_code_router = LazyCustomLLM("claude_code_proxy.claude_code_router.claude_code_router")
+
+
+def _start_upstream_prewarming() -> None:
+    # pylint: disable=import-outside-toplevel
+    from claude_code_proxy.upstream_prewarm import upstream_prewarmer
+
+    upstream_prewarmer.start()
+
+
+def _start_loop_watchdog() -> None:
+    from common.loop_watchdog import loop_watchdog  # pylint: disable=import-outside-toplevel
+
+    loop_watchdog.start()
+
+
+register_admin_endpoints()
+register_client_disconnect_middleware()
+register_sse_keepalive_middleware()
+
+try:
+    # Pre-warming needs the route config (and not the router itself), so it
+    # can start right away, but we don't make the config loading wait for it
+    asyncio.get_running_loop().call_soon(_start_upstream_prewarming)
+    asyncio.get_running_loop().call_soon(_start_loop_watchdog)
+except RuntimeError:
+    # Not running inside the proxy server
+    pass
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Any, Optional
+
+import litellm
+
+from claude_code_proxy.circuit_breaker import retry_after_seconds
+from claude_code_proxy.proxy_config import (
+    BACKGROUND_REQUEST_MAX_TOKENS,
+    PRIORITY_SCHEDULER_ENABLED,
+    SCHEDULER_MAX_BACKGROUND_QUEUE,
+    SCHEDULER_RATE_LIMIT_PAUSE,
+    UPSTREAM_REQUESTS_PER_MINUTE,
+    UPSTREAM_TOKENS_PER_MINUTE,
+)
+from claude_code_proxy.route_model import ModelRoute
+from claude_code_proxy.upstream_clients import UpstreamKey, resolve_upstream_key
+from common.metrics import PROXY_METRICS
+
+FOREGROUND = 0
+BACKGROUND = 1
+
+_PRIORITY_NAMES = {FOREGROUND: "foreground", BACKGROUND: "background"}
+
+
+class RequestShedError(litellm.ServiceUnavailableError):
+    """
+    A background request was rejected because too many requests are already
+    waiting for the upstream. A LiteLLM error, so that the client gets a 503
+    (and is expected to retry later) rather than a 500. Not an upstream error,
+    so it doesn't count against the health of the target.
+    """
+
+    def __init__(self, upstream_key: UpstreamKey) -> None:
+        super().__init__(
+            f"Too many requests are waiting for {upstream_key.base_url} - the background request was shed",
+            llm_provider=upstream_key.provider,
+            model=None,
+        )
+
+
+def classify_request(model_route: ModelRoute, messages: list, params: dict[str, Any]) -> int:
+    """
+    Tell the user's main agent turns (foreground) from the auxiliary requests
+    Claude Code fires alongside them - titles, summaries, command prefix
+    checks, etc. (background). The latter go to the Haiku tier or are short,
+    tool-less requests.
+    """
+    if "haiku" in model_route.requested_model:
+        return BACKGROUND
+    if params.get("tools") or params.get("functions"):
+        return FOREGROUND
+    max_tokens = params.get("max_tokens") or params.get("max_completion_tokens")
+    if max_tokens is not None and max_tokens <= BACKGROUND_REQUEST_MAX_TOKENS and len(messages) <= 2:
+        return BACKGROUND
+    return FOREGROUND
+
+
+def estimate_request_tokens(messages: list, params: dict[str, Any]) -> int:
+    """
+    A rough estimate of how much of the upstream's tokens-per-minute budget a
+    request takes (upstreams, like OpenAI, count `max_tokens` against it too).
+    """
+    prompt_chars = sum(len(str(message.get("content") or "")) for message in messages)
+    max_tokens = params.get("max_tokens") or params.get("max_completion_tokens") or 0
+    return prompt_chars // 4 + max_tokens
+
+
+class _TokenBucket:
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self._refill_per_second = per_minute / 60
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self._refill_per_second)
+        self._updated_at = now
+
+    def seconds_until_available(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # A request bigger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self._refill_per_second
+
+    def consume(self, amount: float) -> None:
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    def __init__(self, priority: int, token_cost: int) -> None:
+        self.priority = priority
+        self.token_cost = token_cost
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class UpstreamScheduler:
+    """
+    Admits the requests to a single upstream according to its budgets
+    (requests and tokens per minute, plus a pause whenever the upstream says
+    we are rate limited). Requests that can't be sent right away wait in a
+    priority queue, where foreground requests go ahead of background ones.
+    """
+
+    def __init__(self, key: UpstreamKey) -> None:
+        self.key = key
+        self._request_bucket = _TokenBucket(UPSTREAM_REQUESTS_PER_MINUTE) if UPSTREAM_REQUESTS_PER_MINUTE > 0 else None
+        self._token_bucket = _TokenBucket(UPSTREAM_TOKENS_PER_MINUTE) if UPSTREAM_TOKENS_PER_MINUTE > 0 else None
+        self._paused_until = 0.0
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._dispatch_handle: Optional[asyncio.TimerHandle] = None
+
+    def _queued(self, priority: int) -> int:
+        return sum(1 for _, _, waiter in self._queue if waiter.priority == priority and not waiter.future.done())
+
+    def _seconds_until_admitted(self, token_cost: int, now: float) -> float:
+        seconds = max(0.0, self._paused_until - now)
+        if self._request_bucket is not None:
+            seconds = max(seconds, self._request_bucket.seconds_until_available(1, now))
+        if self._token_bucket is not None:
+            seconds = max(seconds, self._token_bucket.seconds_until_available(token_cost, now))
+        return seconds
+
+    def _admit(self, token_cost: int) -> None:
+        if self._request_bucket is not None:
+            self._request_bucket.consume(1)
+        if self._token_bucket is not None:
+            self._token_bucket.consume(token_cost)
+
+    def _dispatch(self) -> None:
+        self._dispatch_handle = None
+        while self._queue:
+            _, _, waiter = self._queue[0]
+            if waiter.future.done():
+                # Cancelled while waiting
+                heapq.heappop(self._queue)
+                continue
+
+            wait_seconds = self._seconds_until_admitted(waiter.token_cost, time.monotonic())
+            if wait_seconds > 0:
+                self._dispatch_handle = asyncio.get_running_loop().call_later(wait_seconds, self._dispatch)
+                return
+
+            heapq.heappop(self._queue)
+            self._admit(waiter.token_cost)
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority: int, token_cost: int) -> None:
+        if not self._queue and self._seconds_until_admitted(token_cost, time.monotonic()) <= 0:
+            # Fast path: nobody is waiting and the budgets allow the request
+            self._admit(token_cost)
+            return
+
+        if priority == BACKGROUND and self._queued(BACKGROUND) >= SCHEDULER_MAX_BACKGROUND_QUEUE:
+            PROXY_METRICS.inc("scheduler_shed_requests", upstream=self.key.base_url)
+            raise RequestShedError(self.key)
+
+        waiter = _Waiter(priority, token_cost)
+        heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+        PROXY_METRICS.inc("scheduler_queued_requests", priority=_PRIORITY_NAMES[priority])
+        if self._dispatch_handle is None:
+            self._dispatch()
+
+        try:
+            await waiter.future
+        finally:
+            PROXY_METRICS.inc(
+                "scheduler_wait_seconds", time.monotonic() - waiter.enqueued_at, priority=_PRIORITY_NAMES[priority]
+            )
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stop admitting requests for a while (e.g. the upstream responded with
+        429).
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "upstream": self.key.base_url,
+            "queued_foreground": self._queued(FOREGROUND),
+            "queued_background": self._queued(BACKGROUND),
+            "paused_for": max(0.0, self._paused_until - time.monotonic()),
+        }
+
+
+class PriorityScheduler:
+    def __init__(self) -> None:
+        self._schedulers: dict[UpstreamKey, UpstreamScheduler] = {}
+
+    def _get_scheduler(self, model_route: ModelRoute) -> UpstreamScheduler:
+        key = resolve_upstream_key(model_route)
+        scheduler = self._schedulers.get(key)
+        if scheduler is None:
+            scheduler = self._schedulers[key] = UpstreamScheduler(key)
+        return scheduler
+
+    async def acquire(self, model_route: ModelRoute, priority: int, messages: list, params: dict[str, Any]) -> None:
+        """
+        Wait until the request may be sent to its upstream (raises
+        `RequestShedError` if a background request has to be shed).
+        """
+        if not PRIORITY_SCHEDULER_ENABLED:
+            return
+        token_cost = estimate_request_tokens(messages, params) if UPSTREAM_TOKENS_PER_MINUTE > 0 else 0
+        await self._get_scheduler(model_route).acquire(priority, token_cost)
+
+    def on_upstream_error(self, model_route: ModelRoute, error: BaseException) -> None:
+        if PRIORITY_SCHEDULER_ENABLED and getattr(error, "status_code", None) == 429:
+            self._get_scheduler(model_route).pause(retry_after_seconds(error) or SCHEDULER_RATE_LIMIT_PAUSE)
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [scheduler.stats() for scheduler in list(self._schedulers.values())]
+
+
+priority_scheduler = PriorityScheduler()
+
+PROXY_METRICS.register_collector("scheduler", priority_scheduler.stats)
@@ -1,16 +1,60 @@
+import math
 import os
+from pathlib import Path
 
 from common import config as common_config  # Makes sure .env is loaded  # pylint: disable=unused-import
 from common.utils import env_var_to_bool
 
 
+def _parse_remap_targets(value: str) -> tuple[str, ...]:
+    # An ordered, comma-separated list of targets (the first healthy one is
+    # used, the rest are failover targets)
+    return tuple(target.strip() for target in value.split(",") if target.strip())
+
+
+def _parse_per_target_seconds(value: str) -> dict[str, float]:
+    # A comma-separated list of `target=seconds` pairs (the target is a model
+    # name, with or without the provider prefix)
+    per_target_seconds = {}
+    for item in value.split(","):
+        target, _, seconds = item.partition("=")
+        if target.strip() and seconds.strip():
+            per_target_seconds[target.strip()] = float(seconds)
+    return per_target_seconds
+
+
 # NOTE: If any of the three env vars below are set to an empty string, the
 # defaults will NOT be used. The defaults are used only when these env vars are
 # not set at all. This is intentional - setting them to empty strings should
 # result in no remapping.
-REMAP_CLAUDE_HAIKU_TO = os.getenv("REMAP_CLAUDE_HAIKU_TO", "gpt-5.1-codex-mini-reason-none")
-REMAP_CLAUDE_SONNET_TO = os.getenv("REMAP_CLAUDE_SONNET_TO", "gpt-5-codex-reason-medium")
-REMAP_CLAUDE_OPUS_TO = os.getenv("REMAP_CLAUDE_OPUS_TO", "gpt-5.1-reason-high")
+REMAP_CLAUDE_HAIKU_TO = _parse_remap_targets(os.getenv("REMAP_CLAUDE_HAIKU_TO", "gpt-5.1-codex-mini-reason-none"))
+REMAP_CLAUDE_SONNET_TO = _parse_remap_targets(os.getenv("REMAP_CLAUDE_SONNET_TO", "gpt-5-codex-reason-medium"))
+REMAP_CLAUDE_OPUS_TO = _parse_remap_targets(os.getenv("REMAP_CLAUDE_OPUS_TO", "gpt-5.1-reason-high"))
+
+# How to choose between the targets of a remap: "ordered" (the first healthy
+# target, the rest are only for failover) or "adaptive" (the currently fastest
+# healthy target, see `claude_code_proxy/adaptive_routing.py`)
+REMAP_ROUTING_STRATEGY = os.getenv("REMAP_ROUTING_STRATEGY", "ordered").strip().lower()
+ADAPTIVE_ROUTING_EXPLORATION = float(os.getenv("ADAPTIVE_ROUTING_EXPLORATION", "0.1"))
+ADAPTIVE_ROUTING_EWMA_ALPHA = float(os.getenv("ADAPTIVE_ROUTING_EWMA_ALPHA", "0.2"))
+ADAPTIVE_ROUTING_REFERENCE_TOKENS = int(os.getenv("ADAPTIVE_ROUTING_REFERENCE_TOKENS", "500"))
+
+# Per-target circuit breakers (see `claude_code_proxy/circuit_breaker.py`)
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", "0.5"))
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS", "3"))
+CIRCUIT_BREAKER_WINDOW = float(os.getenv("CIRCUIT_BREAKER_WINDOW", "60"))
+CIRCUIT_BREAKER_COOLDOWN = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN", "30"))
+CIRCUIT_BREAKER_PROBE_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_PROBE_TIMEOUT", "60"))
+
+# Lower the reasoning effort of the remap target (the `-reason-<effort>` alias)
+# for the requests that don't need that much reasoning, down to
+# REASONING_EFFORT_AUTO_FLOOR at most (see
+# `claude_code_proxy/reasoning_effort.py`)
+REASONING_EFFORT_AUTO_TUNING = env_var_to_bool(os.getenv("REASONING_EFFORT_AUTO_TUNING"), "false")
+REASONING_EFFORT_AUTO_FLOOR = os.getenv("REASONING_EFFORT_AUTO_FLOOR", "low").strip().lower()
+# User messages up to this long that just say "continue", "ok", etc. count as
+# follow-ups
+REASONING_EFFORT_FOLLOW_UP_MAX_CHARS = int(os.getenv("REASONING_EFFORT_FOLLOW_UP_MAX_CHARS", "40"))
 
 ENFORCE_ONE_TOOL_CALL_PER_RESPONSE = env_var_to_bool(os.getenv("ENFORCE_ONE_TOOL_CALL_PER_RESPONSE"), "true")
 
@@ -30,6 +74,160 @@ RESPAPI_ONLY_MODELS = (
     "o3-pro",
     "o4-mini-deep-research",
 )
+# Learn what the targets don't support from the errors they respond with (a
+# model that is only available via the Responses API, a parameter it rejects),
+# retry the request accordingly and remember it for the subsequent requests -
+# across restarts too (see `claude_code_proxy/capability_registry.py`)
+CAPABILITY_LEARNING_ENABLED = env_var_to_bool(os.getenv("CAPABILITY_LEARNING_ENABLED"), "true")
+CAPABILITY_REGISTRY_PATH = Path(
+    os.getenv("CAPABILITY_REGISTRY_PATH") or Path(__file__).parent.parent / ".capabilities" / "capabilities.json"
+)
+
+
+def _resolve_num_workers(value: str) -> int:
+    if value.strip().lower() == "auto":
+        try:
+            # The CPUs this process is allowed to run on (same as `nproc`)
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+    return max(1, int(value))
+
+
+# A bounded buffer between the upstream stream and the client (see
+# `common/bounded_stream.py`). 0 disables the buffer.
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "64"))
+# What to do when the buffer is full: "block", "coalesce" or "abort"
+STREAM_BUFFER_FULL_POLICY = os.getenv("STREAM_BUFFER_FULL_POLICY", "block").strip().lower()
+
+# Merge consecutive text deltas of a stream that arrive within this many
+# milliseconds (0 disables merging), up to this many characters per chunk (see
+# `common/delta_coalescing.py`)
+STREAM_COALESCE_WINDOW_MS = float(os.getenv("STREAM_COALESCE_WINDOW_MS", "0"))
+STREAM_COALESCE_MAX_CHARS = int(os.getenv("STREAM_COALESCE_MAX_CHARS", "256"))
+
+# How long (in seconds) to wait for the first chunk of an upstream stream
+# (counting from when the request is sent) and for every subsequent one before
+# the upstream is considered stalled (0 means no limit). The first chunk
+# deadline can be overridden per target.
+UPSTREAM_FIRST_CHUNK_TIMEOUT = float(os.getenv("UPSTREAM_FIRST_CHUNK_TIMEOUT", "0"))
+UPSTREAM_FIRST_CHUNK_TIMEOUTS = _parse_per_target_seconds(os.getenv("UPSTREAM_FIRST_CHUNK_TIMEOUTS", ""))
+UPSTREAM_INTER_CHUNK_TIMEOUT = float(os.getenv("UPSTREAM_INTER_CHUNK_TIMEOUT", "0"))
+# How many times to retry a stream that stalled before its first chunk (i.e.
+# before anything was sent to the client), after a jittered exponential
+# backoff starting at UPSTREAM_STALL_RETRY_BACKOFF seconds, and whether to
+# retry on another remap target (if there is one)
+UPSTREAM_STALL_RETRIES = int(os.getenv("UPSTREAM_STALL_RETRIES", "1"))
+UPSTREAM_STALL_RETRY_BACKOFF = float(os.getenv("UPSTREAM_STALL_RETRY_BACKOFF", "0.5"))
+UPSTREAM_STALL_RETRY_ALTERNATE_TARGET = env_var_to_bool(os.getenv("UPSTREAM_STALL_RETRY_ALTERNATE_TARGET"), "true")
+# Serve non-streaming requests by streaming the response from the upstream and
+# assembling it in the proxy (so the deadlines above apply to them too)
+SERVE_NON_STREAMING_VIA_STREAM = env_var_to_bool(os.getenv("SERVE_NON_STREAMING_VIA_STREAM"), "false")
+# Send a `ping` event (an SSE comment, if it isn't an Anthropic Messages API
+# response) down a streaming response that has been silent for this
+# many seconds (0 disables it), so that a long reasoning phase doesn't get the
+# connection dropped as idle (see `claude_code_proxy/sse_keepalive.py`)
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+# Convert the requests of at least this many bytes (copying the conversation,
+# converting it to the Responses API format, hashing it for single-flight, the
+# request trace) in a pool of this many worker threads instead of on the event
+# loop, where a big conversation holds up all the other streams (0 disables
+# it; see `claude_code_proxy/conversion_offload.py`)
+CONVERSION_OFFLOAD_MIN_BYTES = int(os.getenv("CONVERSION_OFFLOAD_MIN_BYTES", "262144"))
+CONVERSION_OFFLOAD_WORKERS = int(os.getenv("CONVERSION_OFFLOAD_WORKERS", "2"))
+
+# Serve identical concurrent streaming requests from a single upstream stream
+# (see `claude_code_proxy/single_flight.py`)
+SINGLE_FLIGHT_ENABLED = env_var_to_bool(os.getenv("SINGLE_FLIGHT_ENABLED"), "false")
+# How long (in seconds) to keep a shared stream going after its last client
+# disconnected, so that a client that retries the request can reattach to it
+SINGLE_FLIGHT_REATTACH_WINDOW = float(os.getenv("SINGLE_FLIGHT_REATTACH_WINDOW", "3"))
+# How many chunks of a shared stream are kept for replaying to the clients that
+# attach (or reattach) to it late - a longer response takes no new clients and
+# keeps only the chunks some client has yet to read
+SINGLE_FLIGHT_REPLAY_CHUNKS = int(os.getenv("SINGLE_FLIGHT_REPLAY_CHUNKS", "256"))
+
+# The number of server worker processes (`run-server.sh` resolves "auto" and
+# exports the actual number, so every worker sees the same value)
+PROXY_NUM_WORKERS = _resolve_num_workers(os.getenv("PROXY_NUM_WORKERS", "1"))
+
+# Long-lived, pooled HTTP clients for the upstream providers (see
+# `claude_code_proxy/upstream_clients.py`)
+USE_POOLED_UPSTREAM_CLIENTS = env_var_to_bool(os.getenv("USE_POOLED_UPSTREAM_CLIENTS"), "true")
+UPSTREAM_HTTP2 = env_var_to_bool(os.getenv("UPSTREAM_HTTP2"), "false")
+# The connection limits are configured for the whole server and split evenly
+# between the worker processes (every worker has its own pools)
+UPSTREAM_MAX_CONNECTIONS = math.ceil(int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200")) / PROXY_NUM_WORKERS)
+UPSTREAM_MAX_KEEPALIVE_CONNECTIONS = math.ceil(
+    int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", "50")) / PROXY_NUM_WORKERS
+)
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "120"))
+UPSTREAM_DNS_CACHE_TTL = float(os.getenv("UPSTREAM_DNS_CACHE_TTL", "300"))
+# How many connections to open (and keep warm) to each of the upstreams the
+# Claude models are remapped to, starting right when the proxy starts
+UPSTREAM_PREWARM_CONNECTIONS = int(os.getenv("UPSTREAM_PREWARM_CONNECTIONS", "2"))
+UPSTREAM_PREWARM_REFRESH_INTERVAL = float(os.getenv("UPSTREAM_PREWARM_REFRESH_INTERVAL", "45"))
+
+# Admission of requests to the upstreams (see
+# `claude_code_proxy/priority_scheduler.py`). The per-upstream budgets are
+# configured for the whole server (0 means unlimited) and split between the
+# worker processes, like the connection limits.
+PRIORITY_SCHEDULER_ENABLED = env_var_to_bool(os.getenv("PRIORITY_SCHEDULER_ENABLED"), "true")
+UPSTREAM_REQUESTS_PER_MINUTE = float(os.getenv("UPSTREAM_REQUESTS_PER_MINUTE", "0")) / PROXY_NUM_WORKERS
+UPSTREAM_TOKENS_PER_MINUTE = float(os.getenv("UPSTREAM_TOKENS_PER_MINUTE", "0")) / PROXY_NUM_WORKERS
+# How many background requests may wait for an upstream before new ones are
+# shed
+SCHEDULER_MAX_BACKGROUND_QUEUE = int(os.getenv("SCHEDULER_MAX_BACKGROUND_QUEUE", "16"))
+# How long to hold the requests to an upstream back after it responded with
+# 429 (unless it said otherwise via Retry-After)
+SCHEDULER_RATE_LIMIT_PAUSE = float(os.getenv("SCHEDULER_RATE_LIMIT_PAUSE", "2"))
+# Tool-less requests with a `max_tokens` this small (or smaller) are treated
+# as background requests (titles, summaries, etc.)
+BACKGROUND_REQUEST_MAX_TOKENS = int(os.getenv("BACKGROUND_REQUEST_MAX_TOKENS", "1024"))
 
 ANTHROPIC = "anthropic"
 OPENAI = "openai"
+
+# Where the upstream providers are reached by default (the env vars are the
+# same ones LiteLLM itself respects)
+PROVIDER_BASE_URL_ENV_VARS = {
+    OPENAI: ("OPENAI_BASE_URL", "OPENAI_API_BASE"),
+    ANTHROPIC: ("ANTHROPIC_API_BASE", "ANTHROPIC_BASE_URL"),
+}
+PROVIDER_DEFAULT_BASE_URLS = {
+    OPENAI: "https://api.openai.com/v1",
+    ANTHROPIC: "https://api.anthropic.com",
+}
+
+# Pools of upstream API keys to spread the requests over (see
+# `claude_code_proxy/api_key_pool.py`): the comma-separated keys in
+# `<PROVIDER>_API_KEYS` or, if that is not set, the single usual key
+PROVIDER_API_KEY_ENV_VARS = {
+    OPENAI: "OPENAI_API_KEY",
+    ANTHROPIC: "ANTHROPIC_API_KEY",
+}
+# How long to avoid a key after it hit a rate limit (unless the upstream said
+# otherwise via Retry-After)
+API_KEY_COOLDOWN = float(os.getenv("API_KEY_COOLDOWN", "30"))
+
+# A local SQLite ledger of the token usage per session, route and day (see
+# `claude_code_proxy/usage_ledger.py`). The usage is aggregated in memory and
+# written to the database every USAGE_LEDGER_FLUSH_INTERVAL seconds.
+USAGE_LEDGER_ENABLED = env_var_to_bool(os.getenv("USAGE_LEDGER_ENABLED"), "false")
+USAGE_LEDGER_PATH = Path(os.getenv("USAGE_LEDGER_PATH") or Path(__file__).parent.parent / ".usage" / "usage.sqlite3")
+USAGE_LEDGER_FLUSH_INTERVAL = float(os.getenv("USAGE_LEDGER_FLUSH_INTERVAL", "5"))
+
+# Upload the images in the conversations (e.g. the screenshots pasted into
+# Claude Code) to the provider's Files API once and reference them by file ID
+# in the subsequent requests, instead of sending the same base64 payload with
+# every turn (see `claude_code_proxy/blob_store.py`). Only the Responses API
+# supports image file IDs, so only the requests to OpenAI Responses API targets
+# are affected. Images smaller than BLOB_STORE_MIN_BYTES (of base64) are sent
+# inline as usual. The uploaded files expire after BLOB_STORE_FILE_TTL seconds
+# (0 - never, OpenAI accepts between an hour and 30 days).
+BLOB_STORE_ENABLED = env_var_to_bool(os.getenv("BLOB_STORE_ENABLED"), "false")
+BLOB_STORE_MIN_BYTES = int(os.getenv("BLOB_STORE_MIN_BYTES", "32768"))
+BLOB_STORE_FILE_TTL = int(os.getenv("BLOB_STORE_FILE_TTL", "86400"))
+# How many file IDs to remember (per worker process)
+BLOB_STORE_MAX_ENTRIES = int(os.getenv("BLOB_STORE_MAX_ENTRIES", "1024"))
@@ -0,0 +1,136 @@
+import re
+from typing import Any, Optional
+
+from claude_code_proxy.priority_scheduler import BACKGROUND
+from claude_code_proxy.proxy_config import (
+    REASONING_EFFORT_AUTO_FLOOR,
+    REASONING_EFFORT_FOLLOW_UP_MAX_CHARS,
+)
+from common.metrics import PROXY_METRICS
+
+# From the least to the most reasoning (not every model supports every level -
+# e.g. "minimal" is GPT-5's lowest level and "none" is GPT-5.1's)
+EFFORT_LEVELS = ("none", "minimal", "low", "medium", "high")
+
+# Short messages that tell the model to carry on with what it was doing
+_FOLLOW_UP_PATTERN = re.compile(
+    r"(continue|go on|go ahead|proceed|keep going|carry on|yes|yep|ok(ay)?|sure|do it|sounds good|lgtm)\W*",
+    re.IGNORECASE,
+)
+
+
+class EffortDecision:
+    def __init__(self, configured: str, effort: str, reason: str) -> None:
+        self.configured = configured
+        self.effort = effort
+        self.reason = reason
+
+    @property
+    def adjusted(self) -> bool:
+        return self.effort != self.configured
+
+
+def _message_text(message: dict[str, Any]) -> Optional[str]:
+    """
+    The text of a user message (None if it consists of tool results only).
+    """
+    content = message.get("content")
+    if isinstance(content, str):
+        return content
+    if not isinstance(content, list):
+        return None
+    texts = [
+        part.get("text") or ""
+        for part in content
+        # (Claude Code attaches `<system-reminder>` blocks to the user messages)
+        if isinstance(part, dict) and part.get("type") == "text" and not part.get("text", "").startswith("<system-")
+    ]
+    if not texts and any(isinstance(part, dict) and part.get("type") == "tool_result" for part in content):
+        return None
+    return "\n".join(texts)
+
+
+def _classify_turn(messages: list) -> str:
+    """
+    What kind of turn the request is, judging by how the conversation ends:
+    "tool_result" (the model gets the results of the tools it called, with no
+    new instructions), "follow_up" (a short nudge to carry on) or "instruction"
+    (anything else - a new task, a correction, the first turn, etc.).
+    """
+    conversation = [message for message in messages if message.get("role") != "system"]
+    if not any(message.get("role") == "assistant" for message in conversation):
+        # The first turn of the conversation (or no conversation at all) - the
+        # first turn is where the planning happens
+        return "instruction"
+
+    last_message = conversation[-1]
+    if last_message.get("role") in ("tool", "function"):
+        return "tool_result"
+    if last_message.get("role") != "user":
+        return "instruction"
+
+    text = _message_text(last_message)
+    if text is None:
+        return "tool_result"
+    text = text.strip()
+    if len(text) <= REASONING_EFFORT_FOLLOW_UP_MAX_CHARS and _FOLLOW_UP_PATTERN.fullmatch(text):
+        return "follow_up"
+    return "instruction"
+
+
+def _lower(effort: str, steps: int) -> str:
+    """
+    Lower the effort by `steps` levels, but not below the floor (and never
+    raise it - an effort below the floor is left as is).
+    """
+    if effort not in EFFORT_LEVELS or REASONING_EFFORT_AUTO_FLOOR not in EFFORT_LEVELS:
+        return effort
+    level = EFFORT_LEVELS.index(effort)
+    floor = EFFORT_LEVELS.index(REASONING_EFFORT_AUTO_FLOOR)
+    return EFFORT_LEVELS[min(level, max(level - steps, floor))]
+
+
+def tune_reasoning_effort(configured: str, messages: list, priority: int) -> EffortDecision:
+    """
+    Pick the reasoning effort for a request, between `REASONING_EFFORT_AUTO_FLOOR`
+    and the effort configured for the route (the `-reason-<effort>` alias),
+    based on cheap features of the request: the turns in which the model just
+    carries on with its plan don't need as much reasoning as the ones where it
+    has to work out what to do.
+    """
+    if priority == BACKGROUND:
+        # Titles, summaries and the like
+        return EffortDecision(configured, _lower(configured, len(EFFORT_LEVELS)), "background")
+
+    turn = _classify_turn(messages)
+    if turn == "instruction":
+        return EffortDecision(configured, configured, turn)
+    if turn == "tool_result" and len(messages) < 4:
+        # The first tool results of a task usually shape the plan
+        return EffortDecision(configured, configured, "early_tool_result")
+    return EffortDecision(configured, _lower(configured, 1), turn)
+
+
+def record_effort_decision(target: str, decision: EffortDecision) -> None:
+    """
+    Log the decision (the TTFT of the requests is recorded per decision too, see
+    `record_effort_ttft()`, so the latency saved can be evaluated).
+    """
+    PROXY_METRICS.inc(
+        "reasoning_effort_decisions",
+        target=target,
+        configured=decision.configured,
+        effort=decision.effort,
+        reason=decision.reason,
+    )
+    if decision.adjusted:
+        print(
+            f"\033[1m\033[33mreasoning_effort: {decision.configured} -> {decision.effort}\033[0m "
+            f"({decision.reason}, {target})"
+        )
+
+
+def record_effort_ttft(target: str, decision: EffortDecision, ttft: float) -> None:
+    labels = {"target": target, "effort": decision.effort, "reason": decision.reason}
+    PROXY_METRICS.inc("reasoning_effort_ttft_seconds", ttft, **labels)
+    PROXY_METRICS.inc("reasoning_effort_ttft_samples", **labels)
@@ -1,5 +1,5 @@
 import re
-from typing import Any
+from typing import Any, Optional, Sequence
 
 from claude_code_proxy.proxy_config import (
     ALWAYS_USE_RESPONSES_API,
@@ -8,57 +8,112 @@ from claude_code_proxy.proxy_config import (
     REMAP_CLAUDE_HAIKU_TO,
     REMAP_CLAUDE_OPUS_TO,
     REMAP_CLAUDE_SONNET_TO,
+    REMAP_ROUTING_STRATEGY,
     RESPAPI_ONLY_MODELS,
+    UPSTREAM_FIRST_CHUNK_TIMEOUT,
+    UPSTREAM_FIRST_CHUNK_TIMEOUTS,
 )
+from claude_code_proxy.adaptive_routing import adaptive_router
+from claude_code_proxy.capability_registry import capability_registry
+from claude_code_proxy.circuit_breaker import CircuitBreaker, circuit_breakers
+from common.metrics import PROXY_METRICS
 
 
 class ModelRoute:
     requested_model: str  # May or may not have a provider prefix
+    remap_targets: tuple[str, ...]  # In the order of preference
     remapped_to: str  # May or may not have a provider prefix
     target_model: str  # ALWAYS has a provider prefix ("provider/model_name")
+    api_base: Optional[str]  # None means the provider's default (or the one from the env)
     extra_params: dict[str, Any]
     is_target_anthropic: bool
     use_responses_api: bool
 
-    def __init__(self, requested_model: str) -> None:
+    def __init__(
+        self, requested_model: str, select_healthy_target: bool = True, avoid_targets: Sequence[str] = ()
+    ) -> None:
+        """
+        Args:
+            requested_model: The model requested by the client
+            select_healthy_target: Skip the remap targets whose circuit
+                breakers are open (pass False to resolve the route without
+                affecting the circuit breakers, e.g. for pre-warming)
+            avoid_targets: The target keys to skip like the unhealthy ones
+                (e.g. a target that has just stalled)
+        """
         self.requested_model = requested_model.strip()
+        self.failed_over_from: list[str] = []
 
         self._remap_model()
-        self._finalize_model_route_object()
+        if select_healthy_target and len(self.remap_targets) > 1:
+            self._select_healthy_target(avoid_targets)
+        else:
+            self.remapped_to = self.remap_targets[0]
+            self._finalize_model_route_object()
 
         self._log_model_route()
 
-    def _remap_model(self) -> str:
-        self.remapped_to = self.requested_model
+    def _remap_model(self) -> None:
+        self.remap_targets = (self.requested_model,)
 
         if self.requested_model.startswith("claude-"):
             # If the model name contains "haiku", "opus", or "sonnet", remap it
             # to the appropriate model (provided the remap is configured)
             if "haiku" in self.requested_model:
                 if REMAP_CLAUDE_HAIKU_TO:
-                    self.remapped_to = REMAP_CLAUDE_HAIKU_TO
+                    self.remap_targets = REMAP_CLAUDE_HAIKU_TO
             elif "opus" in self.requested_model:
                 if REMAP_CLAUDE_OPUS_TO:
-                    self.remapped_to = REMAP_CLAUDE_OPUS_TO
+                    self.remap_targets = REMAP_CLAUDE_OPUS_TO
             elif REMAP_CLAUDE_SONNET_TO:
                 # Here we assume the requested model is a Sonnet model (but
                 # also fallback to this remap in case it is some new, unknown
                 # model by Anthropic)
                 # TODO Add a warning if the requested model is unknown ?
-                self.remapped_to = REMAP_CLAUDE_SONNET_TO
+                self.remap_targets = REMAP_CLAUDE_SONNET_TO
+
+    def _select_healthy_target(self, avoid_targets: Sequence[str]) -> None:
+        """
+        Resolve the route to the first remap target whose circuit breaker lets
+        the request through (or to the first target if none of them does).
+        """
+        remap_targets = self.remap_targets
+        if REMAP_ROUTING_STRATEGY == "adaptive":
+            target_keys = []
+            for remapped_to in remap_targets:
+                self.remapped_to = remapped_to
+                self._finalize_model_route_object()
+                target_keys.append(self.target_key)
+            remap_targets = [remap_targets[idx] for idx in adaptive_router.rank(target_keys)]
+
+        for remapped_to in remap_targets:
+            self.remapped_to = remapped_to
+            self._finalize_model_route_object()
+            if self.target_key not in avoid_targets and self.circuit_breaker.allow_request():
+                break
+            self.failed_over_from.append(self.target_key)
+        else:
+            self.failed_over_from = []
+            self.remapped_to = self.remap_targets[0]
+            self._finalize_model_route_object()
 
-        self.remapped_to = self.remapped_to.strip()
+        if self.failed_over_from:
+            PROXY_METRICS.inc("route_failovers", requested_model=self.requested_model, target=self.target_key)
 
     def _finalize_model_route_object(self) -> None:
         """
         Resolve and prepend provider to the model name if not already present,
         set other attributes to finish initializing this ModelRoute object.
         """
-        if "/" in self.remapped_to:
-            explicit_provider, model_name_only = self.remapped_to.split("/", 1)
+        model_name, _, api_base = self.remapped_to.partition("@")
+        # A specific endpoint can be given after "@" (e.g. a regional base URL)
+        self.api_base = api_base.strip() or None
+
+        if "/" in model_name:
+            explicit_provider, model_name_only = model_name.split("/", 1)
         else:
             # Provider is not mentioned in the model name explicitly
-            explicit_provider, model_name_only = None, self.remapped_to
+            explicit_provider, model_name_only = None, model_name
 
         # Check if it is one of our GPT-5 model aliases with a reasoning effort
         # specified in the model name
@@ -88,14 +143,44 @@ class ModelRoute:
         if self.is_target_anthropic:
             self.use_responses_api = False
         else:
-            self.use_responses_api = ALWAYS_USE_RESPONSES_API or any(
-                model in model_name_only for model in RESPAPI_ONLY_MODELS
+            self.use_responses_api = (
+                ALWAYS_USE_RESPONSES_API
+                or any(model in model_name_only for model in RESPAPI_ONLY_MODELS)
+                or capability_registry.requires_responses_api(self.target_key)
             )
 
+    @property
+    def target_key(self) -> str:
+        """
+        Identifies the target (the model and the endpoint) for the circuit
+        breakers and the latency statistics.
+        """
+        if self.api_base:
+            return f"{self.target_model}@{self.api_base}"
+        return self.target_model
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return circuit_breakers.get(self.target_key)
+
+    @property
+    def first_chunk_timeout(self) -> float:
+        """
+        How long the upstream has to start streaming the response (0 means no
+        limit).
+        """
+        model_name_only = self.target_model.split("/", 1)[1]
+        for target in (self.remapped_to, self.target_key, self.target_model, model_name_only):
+            if target in UPSTREAM_FIRST_CHUNK_TIMEOUTS:
+                return UPSTREAM_FIRST_CHUNK_TIMEOUTS[target]
+        return UPSTREAM_FIRST_CHUNK_TIMEOUT
+
     def _log_model_route(self) -> None:
-        log_message = f"\033[1m\033[32m{self.requested_model}\033[0m -> " f"\033[1m\033[36m{self.target_model}\033[0m"
+        log_message = f"\033[1m\033[32m{self.requested_model}\033[0m -> " f"\033[1m\033[36m{self.target_key}\033[0m"
         if self.extra_params:
             log_message += f" [\033[1m\033[33m{self._repr_extra_params()}\033[0m]"
+        if self.failed_over_from:
+            log_message += f" \033[1;31m(failover: {', '.join(self.failed_over_from)} unhealthy)\033[0m"
         # TODO Make it possible to disable this print ? (Turn it into a log
         #  record ?)
         print(log_message)
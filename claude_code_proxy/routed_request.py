@@ -0,0 +1,424 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Optional, Sequence, Union
+
+import httpx
+import litellm
+from litellm import (
+    AsyncHTTPHandler,
+    BaseResponsesAPIStreamingIterator,
+    CustomStreamWrapper,
+    GenericStreamingChunk,
+    Usage,
+)
+
+from claude_code_proxy.adaptive_routing import adaptive_router
+from claude_code_proxy.api_key_pool import api_key_pool
+from claude_code_proxy.blob_store import InlineImage, blob_store, find_inline_images
+from claude_code_proxy.capability_registry import capability_registry
+from claude_code_proxy.conversion_offload import approximate_size, run_offloaded, should_offload
+from claude_code_proxy.priority_scheduler import classify_request, estimate_request_tokens, priority_scheduler
+from claude_code_proxy.proxy_config import ENFORCE_ONE_TOOL_CALL_PER_RESPONSE, REASONING_EFFORT_AUTO_TUNING
+from claude_code_proxy.reasoning_effort import (
+    EffortDecision,
+    record_effort_decision,
+    record_effort_ttft,
+    tune_reasoning_effort,
+)
+from claude_code_proxy.route_model import ModelRoute
+from claude_code_proxy.single_flight import request_fingerprint
+from claude_code_proxy.upstream_clients import close_upstream_stream, resolve_upstream_key, upstream_client_pool
+from claude_code_proxy.usage_ledger import get_session_id, usage_ledger
+from common.config import WRITE_TRACES_TO_FILES
+from common.flight_recorder import StreamFlightRecorder
+from common.otel_tracing import end_span, start_span, traced_stage
+from common.tracing_in_markdown import write_request_trace
+from common.utils import (
+    convert_chat_messages_to_respapi,
+    convert_chat_params_to_respapi,
+    copy_json_like,
+    generate_timestamp_utc,
+    to_litellm_usage,
+)
+
+
+class RoutedRequest:
+    def __init__(
+        self,
+        *,
+        calling_method: str,
+        model: str,
+        messages_original: list,
+        params_original: dict,
+        stream: bool,
+        avoid_targets: Sequence[str] = (),
+        trace_parent: Any = None,
+        convert: bool = True,
+    ) -> None:
+        """
+        With `convert=False`, the request is not converted until `convert()`
+        is called (see `acreate()`).
+        """
+        self.timestamp = generate_timestamp_utc()
+        self.calling_method = calling_method
+        self.span = start_span(
+            "proxy.request", trace_parent, calling_method=calling_method, requested_model=model, stream=stream
+        )
+        self.stream_span = None
+        with traced_stage("proxy.route", self.span):
+            self.model_route = ModelRoute(model, avoid_targets=avoid_targets)
+        self.stream = stream
+
+        self.messages_original = messages_original
+        self.params_original = params_original
+        # Whether the conversion (and the like) is run in a worker thread
+        self.offloaded = False
+        # (Set by the conversion)
+        self.messages_complapi: Optional[list] = None
+        self.params_complapi: Optional[dict] = None
+        self.messages_respapi: Optional[list] = None
+        self.params_respapi: Optional[dict] = None
+        self.inline_images: list[InlineImage] = []
+        self.priority: Optional[int] = None
+        self.effort_decision: Optional[EffortDecision] = None
+
+        self.api_key: Optional[str] = None
+        self.first_chunk_deadline: Optional[float] = None
+        self.retried_as: Optional[RoutedRequest] = None
+        self.upstream_stream: Optional[Union[BaseResponsesAPIStreamingIterator, CustomStreamWrapper]] = None
+
+        self.started_at = time.monotonic()
+        self.upstream_responded = False
+        self.first_content_at: Optional[float] = None
+        self.output_deltas = 0
+        self.usage: Optional[Usage] = None
+        self.flight_recorder: Optional[StreamFlightRecorder] = None
+        self._trace_ended = False
+
+        if convert:
+            self.convert()
+
+    @classmethod
+    async def acreate(cls, **kwargs: Any) -> "RoutedRequest":
+        """
+        Like the constructor, but a big request (CONVERSION_OFFLOAD_MIN_BYTES)
+        is converted in a worker thread, so that copying and converting it
+        doesn't hold up the other streams. Small ones are converted inline.
+        """
+        routed_request = cls(**kwargs, convert=False)
+        routed_request.offloaded = should_offload(
+            approximate_size(routed_request.messages_original) + approximate_size(routed_request.params_original)
+        )
+        if routed_request.offloaded:
+            await run_offloaded(routed_request.convert)
+        else:
+            routed_request.convert()
+        return routed_request
+
+    def convert(self) -> None:
+        with traced_stage("proxy.convert", self.span):
+            self._convert_request()
+        self.span.set_attributes(
+            {
+                "target": self.model_route.target_key,
+                "target_model": self.model_route.target_model,
+                "use_responses_api": self.model_route.use_responses_api,
+                "priority": self.priority,
+                "reasoning_effort": self.params_complapi.get("reasoning_effort") or "",
+            }
+        )
+
+        if WRITE_TRACES_TO_FILES:
+            write_request_trace(
+                timestamp=self.timestamp,
+                calling_method=self.calling_method,
+                messages_original=self.messages_original,
+                params_original=self.params_original,
+                messages_complapi=self.messages_complapi,
+                params_complapi=self.params_complapi,
+                messages_respapi=self.messages_respapi,
+                params_respapi=self.params_respapi,
+            )
+
+    def _convert_request(self) -> None:
+        # (The images and the rest of the strings are shared with the originals)
+        self.messages_complapi = copy_json_like(self.messages_original)
+        self.params_complapi = copy_json_like(self.params_original)
+
+        self.params_complapi.update(self.model_route.extra_params)
+        self.params_complapi["stream"] = self.stream
+
+        self.priority = classify_request(self.model_route, self.messages_original, self.params_original)
+        self.effort_decision = None
+        if REASONING_EFFORT_AUTO_TUNING and self.params_complapi.get("reasoning_effort"):
+            self.effort_decision = tune_reasoning_effort(
+                self.params_complapi["reasoning_effort"], self.messages_original, self.priority
+            )
+            record_effort_decision(self.model_route.target_key, self.effort_decision)
+            self.params_complapi["reasoning_effort"] = self.effort_decision.effort
+
+        if self.model_route.use_responses_api:
+            # TODO What's a more reasonable way to decide when to unset
+            #  temperature ?
+            self.params_complapi.pop("temperature", None)
+        for param in capability_registry.unsupported_params(self.model_route.target_key):
+            # (Learned from the target's earlier errors)
+            self.params_complapi.pop(param, None)
+
+        # For Langfuse
+        trace_name = f"{self.timestamp}-OUTBOUND-{self.calling_method}"
+        self.params_complapi.setdefault("metadata", {})["trace_name"] = trace_name
+
+        if not self.model_route.is_target_anthropic:
+            self._adapt_complapi_for_non_anthropic_models()
+
+        if self.model_route.use_responses_api:
+            self.messages_respapi = convert_chat_messages_to_respapi(self.messages_complapi)
+            self.params_respapi = convert_chat_params_to_respapi(self.params_complapi)
+            # (Hashed here rather than on the event loop)
+            self.inline_images = find_inline_images(resolve_upstream_key(self.model_route), self.messages_respapi)
+        else:
+            self.messages_respapi = None
+            self.params_respapi = None
+            self.inline_images = []
+
+    async def wait_for_upstream(self) -> None:
+        with traced_stage("proxy.queue", self.span):
+            await priority_scheduler.acquire(
+                self.model_route, self.priority, self.messages_original, self.params_original
+            )
+        # The time spent in the scheduler queue is not the upstream's latency
+        self.started_at = time.monotonic()
+        if self.model_route.first_chunk_timeout > 0:
+            self.first_chunk_deadline = asyncio.get_running_loop().time() + self.model_route.first_chunk_timeout
+        self.choose_api_key()
+        if self.inline_images:
+            # (The file IDs are only valid with the key the files were
+            # uploaded with)
+            blob_store.reference_stored_blobs(resolve_upstream_key(self.model_route), self.api_key, self.inline_images)
+
+    def call_upstream(
+        self,
+        *,
+        logger_fn,
+        headers,
+        timeout: Optional[Union[float, httpx.Timeout]],
+        client: Optional[AsyncHTTPHandler],
+    ) -> Awaitable[Any]:
+        """
+        The LiteLLM call that sends the converted request upstream (to the
+        Responses API or to the ChatCompletions API, whichever the target
+        requires). Resolves to the response or, for a streaming request, to
+        the upstream stream.
+        """
+        upstream_client = upstream_client_pool.get_async_client(self.model_route, client, self.api_key)
+        if self.model_route.use_responses_api:
+            return litellm.aresponses(
+                # TODO Make sure all params are supported
+                model=self.model_route.target_model,
+                api_base=self.model_route.api_base,
+                api_key=self.api_key,
+                input=self.messages_respapi,
+                logger_fn=logger_fn,
+                headers=headers or {},
+                timeout=timeout,
+                client=upstream_client,
+                **self.params_respapi,
+            )
+        return litellm.acompletion(
+            model=self.model_route.target_model,
+            api_base=self.model_route.api_base,
+            api_key=self.api_key,
+            messages=self.messages_complapi,
+            logger_fn=logger_fn,
+            headers=headers or {},
+            timeout=timeout,
+            client=upstream_client,
+            # Drop any params that are not supported by the provider
+            drop_params=True,
+            **self.params_complapi,
+        )
+
+    async def retry(self, avoid_current_target: bool) -> "RoutedRequest":
+        """
+        The same request, to be sent again (to another remap target, if there
+        is one, when `avoid_current_target` is True).
+        """
+        self.retried_as = await RoutedRequest.acreate(
+            calling_method=self.calling_method,
+            model=self.model_route.requested_model,
+            messages_original=self.messages_original,
+            params_original=self.params_original,
+            stream=self.stream,
+            avoid_targets=(self.model_route.target_key,) if avoid_current_target else (),
+            trace_parent=self.span,
+        )
+        return self.retried_as
+
+    def latest_attempt(self) -> "RoutedRequest":
+        """
+        The last retry of the request (the request itself if it wasn't
+        retried).
+        """
+        routed_request = self
+        while routed_request.retried_as is not None:
+            routed_request = routed_request.retried_as
+        return routed_request
+
+    def close_upstream(self) -> None:
+        """
+        Abort the upstream stream of the request (of its latest retry, that
+        is), if it was opened.
+        """
+        upstream_stream = self.latest_attempt().upstream_stream
+        if upstream_stream is not None:
+            close_upstream_stream(upstream_stream)
+
+    async def aget_fingerprint(self) -> str:
+        # (The Responses API request, if any, is derived from this one)
+        if self.offloaded:
+            # (Serializing a big request takes as long as converting it)
+            return await run_offloaded(
+                request_fingerprint, self.model_route.target_key, self.messages_complapi, self.params_complapi
+            )
+        return request_fingerprint(self.model_route.target_key, self.messages_complapi, self.params_complapi)
+
+    def choose_api_key(self) -> None:
+        self.api_key = api_key_pool.choose(
+            self.model_route.target_model.split("/", 1)[0],
+            estimate_request_tokens(self.messages_original, self.params_original),
+        )
+
+    # NOTE: Only streams are measured for adaptive routing (TTFT and the output
+    # speed can't be told apart for non-streaming responses)
+
+    def on_stream_chunk(self, generic_chunk: GenericStreamingChunk) -> None:
+        if not self.upstream_responded:
+            self.upstream_responded = True
+            self.model_route.circuit_breaker.record_success()
+            self.stream_span = start_span("proxy.stream", self.span)
+
+        tool_use = generic_chunk.get("tool_use")
+        if tool_use and tool_use.get("id"):
+            # (The arguments of a tool call may follow in further chunks)
+            self.stream_span.add_event(
+                "tool_call", {"id": tool_use["id"], "name": (tool_use.get("function") or {}).get("name") or ""}
+            )
+
+        if generic_chunk.get("text") or tool_use:
+            if self.first_content_at is None:
+                # (Not the first chunk, which, in case of Responses API, is
+                # sent right away, before the model produced anything)
+                self.first_content_at = time.monotonic()
+                self.stream_span.add_event("first_chunk", {"ttft_seconds": self.first_content_at - self.started_at})
+                adaptive_router.record_ttft(self.model_route.target_key, self.first_content_at - self.started_at)
+                if self.effort_decision is not None:
+                    record_effort_ttft(
+                        self.model_route.target_key, self.effort_decision, self.first_content_at - self.started_at
+                    )
+            self.output_deltas += 1
+
+        if generic_chunk.get("usage"):
+            self.usage = to_litellm_usage(generic_chunk["usage"])
+
+    def on_stream_completed(self) -> None:
+        self.record_usage(self.usage)
+        self.end_trace()
+        if self.first_content_at is None:
+            return
+        # Every delta is counted as roughly one token
+        adaptive_router.record_output_speed(
+            self.model_route.target_key, self.output_deltas, time.monotonic() - self.first_content_at
+        )
+
+    def record_usage(self, usage: Optional[Usage]) -> None:
+        if usage is None:
+            return
+        self.usage = usage
+        usage_ledger.record(
+            session=get_session_id(self.params_original),
+            requested_model=self.model_route.requested_model,
+            target=self.model_route.target_key,
+            target_model=self.model_route.target_model,
+            usage=usage,
+            response_seconds=time.monotonic() - self.started_at,
+        )
+
+    def end_trace(self, error: Optional[Union[BaseException, str]] = None) -> None:
+        if self._trace_ended:
+            return
+        self._trace_ended = True
+        if self.stream_span is not None:
+            end_span(self.stream_span, error, output_deltas=self.output_deltas)
+        usage_attributes = {}
+        if self.usage is not None:
+            usage_attributes = {
+                "gen_ai.usage.input_tokens": self.usage.prompt_tokens,
+                "gen_ai.usage.output_tokens": self.usage.completion_tokens,
+            }
+        end_span(self.span, error, **usage_attributes)
+
+    def _adapt_complapi_for_non_anthropic_models(self) -> None:
+        """
+        Perform necessary prompt injections to adjust certain requests to work with
+        non-Anthropic models.
+        """
+        # Claude Code 2.x sends `context_management` on /v1/messages, but
+        # OpenAI's ChatCompletions and Responses APIs do not support it
+        # TODO How to reproduce the problem that the line below is fixing ?
+        #  (This fix was contributed)
+        self.params_complapi.pop("context_management", None)
+
+        if (
+            self.params_complapi.get("max_tokens") == 1
+            and len(self.messages_complapi) == 1
+            and self.messages_complapi[0].get("role") == "user"
+            and self.messages_complapi[0].get("content") in ["quota", "test"]
+        ):
+            # This is a "connectivity test" request by Claude Code => we need
+            # to make sure non-Anthropic models don't fail because of exceeding
+            # max_tokens
+            self.params_complapi["max_tokens"] = 100
+            self.messages_complapi[0]["role"] = "system"
+            self.messages_complapi[0][
+                "content"
+            ] = "The intention of this request is to test connectivity. Please respond with a single word: OK"
+            return
+
+        system_prompt_items = []
+
+        # Only add the instruction if at least two tools and/or functions are present in the request (in total)
+        num_tools = len(self.params_complapi.get("tools") or []) + len(self.params_complapi.get("functions") or [])
+        if ENFORCE_ONE_TOOL_CALL_PER_RESPONSE and num_tools > 1:
+            # Add the single tool call instruction as the last message
+            # TODO Get rid of this hack after the token conversion code in
+            #  `common/utils.py` is reimplemented. (Seems that it's not the
+            #  Claude Code CLI that doesn't support multiple tool calls in a
+            #  single response, it's our token conversion code that doesn't.)
+            system_prompt_items.append(
+                "* When using tools, call AT MOST one tool per response. Never attempt multiple tool calls in a "
+                "single response. The client does not support multiple tool calls in a single response. If multiple "
+                "tools are needed, choose the next best single tool, return exactly one tool call, and wait for the "
+                "next turn."
+            )
+
+        if self.model_route.use_responses_api:
+            # TODO A temporary measure until the token conversion code is
+            #  reimplemented. (Right now, whenever the model tries to
+            #  communicate that it needs to correct its course of action, it
+            #  just stops doing the task, which I suspect is a token conversion
+            #  issue.)
+            system_prompt_items.append(
+                "* Until you're COMPLETELY done with your task, DO NOT EXPLAIN TO THE USER ANYTHING AT ALL, even if "
+                "you need to correct your course of action (just use REASONING for that, which the user cannot see). "
+                "A summary of your work at the very end is enough."
+            )
+
+        if system_prompt_items:
+            # append the system prompt as the last message in the context
+            self.messages_complapi.append(
+                {
+                    "role": "system",
+                    "content": "IMPORTANT:\n" + "\n".join(system_prompt_items),
+                }
+            )
@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Optional
+
+from litellm import GenericStreamingChunk
+
+from claude_code_proxy.proxy_config import (
+    SINGLE_FLIGHT_REATTACH_WINDOW,
+    SINGLE_FLIGHT_REPLAY_CHUNKS,
+    STREAM_BUFFER_SIZE,
+)
+from common.metrics import PROXY_METRICS
+
+# Params that differ between otherwise identical requests (e.g. the trace name
+# contains a timestamp) and don't affect the response
+_IGNORED_PARAMS = ("metadata", "stream")
+# How far the upstream is read ahead of the slowest subscriber (with no stream
+# buffer, one chunk at a time, as the subscribers read them)
+_READ_AHEAD = max(STREAM_BUFFER_SIZE, 1)
+
+
+def request_fingerprint(target: str, messages: Any, params: dict[str, Any]) -> str:
+    """
+    A canonical hash of a (converted) upstream request.
+    """
+    canonical = json.dumps(
+        {
+            "target": target,
+            "messages": messages,
+            "params": {name: value for name, value in params.items() if name not in _IGNORED_PARAMS},
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class StreamSubscription:
+    """
+    A single client's view of a `SharedStream` (it receives all the chunks,
+    starting from the very first one, no matter when it subscribed).
+    """
+
+    def __init__(self, shared_stream: "SharedStream") -> None:
+        self.position = 0
+        self.cancelled = False
+        self._shared_stream = shared_stream
+
+    def cancel(self) -> None:
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self._shared_stream.unsubscribe(self)
+
+    async def __aiter__(self) -> AsyncGenerator[GenericStreamingChunk, None]:
+        shared_stream = self._shared_stream
+        try:
+            while not self.cancelled:
+                if self.position < shared_stream.end:
+                    chunk = shared_stream.chunk_at(self.position)
+                    self.position += 1
+                    # (The producer may be waiting for the subscribers to
+                    # catch up)
+                    shared_stream.on_read()
+                    # Every client gets its own copy (the chunks are modified
+                    # further down the line)
+                    yield dict(chunk)
+                elif shared_stream.done:
+                    if shared_stream.error is not None:
+                        raise shared_stream.error
+                    return
+                else:
+                    await shared_stream.wait_for_change()
+        finally:
+            self.cancel()
+
+
+class SharedStream:
+    """
+    An upstream stream that is being (or is about to be) consumed on behalf
+    of any number of identical requests. The first `SINGLE_FLIGHT_REPLAY_CHUNKS`
+    converted chunks are kept, so a subscriber that comes late still receives
+    the whole response. Once the response is longer than that, the stream
+    takes no new subscribers and only keeps the chunks that some subscriber
+    has yet to read. The upstream is read ahead of the slowest subscriber by
+    up to `STREAM_BUFFER_SIZE` chunks and is aborted once nobody has been
+    subscribed for `SINGLE_FLIGHT_REATTACH_WINDOW` seconds (a client that
+    timed out is likely to retry the request and reattach).
+    """
+
+    def __init__(self, key: str, registry: "InFlightStreams") -> None:
+        self.key = key
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Whether the whole response can still be replayed to a new subscriber
+        self.joinable = True
+
+        self._registry = registry
+        # (The chunks from the position `_first_position` on)
+        self._chunks: deque[GenericStreamingChunk] = deque()
+        self._first_position = 0
+        self._subscriptions: set[StreamSubscription] = set()
+        self._changed = asyncio.Event()
+        self._producer: Optional[asyncio.Task] = None
+        self._abort_upstream: Optional[Callable[[], None]] = None
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    @property
+    def kept_chunks(self) -> int:
+        return len(self._chunks)
+
+    @property
+    def end(self) -> int:
+        """
+        The position after the last chunk read from the upstream so far.
+        """
+        return self._first_position + len(self._chunks)
+
+    def chunk_at(self, position: int) -> GenericStreamingChunk:
+        return self._chunks[position - self._first_position]
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_for_change(self) -> None:
+        await self._changed.wait()
+
+    def on_read(self) -> None:
+        self._trim()
+        self.notify()
+
+    def subscribe(self) -> StreamSubscription:
+        subscription = StreamSubscription(self)
+        self._subscriptions.add(subscription)
+        if self._abandon_handle is not None:
+            PROXY_METRICS.inc("single_flight_reattached_requests")
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        return subscription
+
+    def unsubscribe(self, subscription: StreamSubscription) -> None:
+        self._subscriptions.discard(subscription)
+        if self._subscriptions or self.done:
+            self._trim()
+            self.notify()
+        elif SINGLE_FLIGHT_REATTACH_WINDOW > 0 and self.joinable:
+            self._abandon_handle = asyncio.get_running_loop().call_later(SINGLE_FLIGHT_REATTACH_WINDOW, self._abandon)
+        else:
+            # (A client that retries the request couldn't be given the whole
+            # response anymore)
+            self._abandon()
+
+    def _abandon(self) -> None:
+        self._abandon_handle = None
+        if self._subscriptions or self.done:
+            return
+        # Nobody is going to read the rest of the response
+        self._finish()
+        self._chunks.clear()
+        if self._producer is not None:
+            self._producer.cancel()
+        if self._abort_upstream is not None:
+            self._abort_upstream()
+
+    def feed(self, source: AsyncIterator[GenericStreamingChunk], abort_upstream: Callable[[], None]) -> None:
+        """
+        Start consuming `source` in a task of the stream's own (opening the
+        upstream stream included - no subscriber's request waits on it).
+        `abort_upstream` is called if the stream has to be abandoned before
+        it is over.
+        """
+        self._abort_upstream = abort_upstream
+        self._producer = asyncio.create_task(self._produce(source))
+
+    def _finish(self) -> None:
+        self.done = True
+        self._registry.remove(self)
+        self.notify()
+
+    def _trim(self) -> None:
+        if self.joinable:
+            if self.end <= SINGLE_FLIGHT_REPLAY_CHUNKS:
+                return
+            # Too long to replay - the identical requests that come from now
+            # on call the upstream themselves
+            self.joinable = False
+            self._registry.close_to_new_subscribers(self)
+        if not self._subscriptions:
+            return
+        # Drop what every subscriber has read
+        slowest_position = min(subscription.position for subscription in self._subscriptions)
+        while self._first_position < slowest_position:
+            self._chunks.popleft()
+            self._first_position += 1
+
+    def _has_room(self) -> bool:
+        if not self._subscriptions:
+            # (Waiting for a client to reattach - it'd replay the response
+            # from the start)
+            return self.end < SINGLE_FLIGHT_REPLAY_CHUNKS
+        slowest_position = min(subscription.position for subscription in self._subscriptions)
+        return self.end - slowest_position < _READ_AHEAD
+
+    async def _produce(self, source: AsyncIterator[GenericStreamingChunk]) -> None:
+        try:
+            async for chunk in source:
+                while not self._has_room():
+                    await self.wait_for_change()
+                self._chunks.append(chunk)
+                self._trim()
+                self.notify()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Delivered to the subscribers after the chunks before it
+            self.error = e
+        finally:
+            if not self.done:
+                self._finish()
+
+
+class InFlightStreams:
+    """
+    Single-flight coalescing of identical streaming requests: while an
+    upstream stream for a request is in flight, identical requests (e.g.
+    parallel sub-agents sharing a prompt, or a client retrying a request that
+    is still being served) attach to it instead of calling the upstream again.
+    """
+
+    def __init__(self) -> None:
+        # (The streams identical requests can attach to)
+        self._streams: dict[str, SharedStream] = {}
+        # (All the streams in flight, including the ones that are too long to
+        # attach to)
+        self._in_flight: set[SharedStream] = set()
+
+    def subscribe(
+        self,
+        key: str,
+        source: Callable[[], AsyncIterator[GenericStreamingChunk]],
+        abort_upstream: Callable[[], None],
+    ) -> StreamSubscription:
+        """
+        Subscribe to the stream of an identical request that is in flight or,
+        if there is none, start a new one that consumes `source()` (see
+        `SharedStream.feed()`).
+
+        The request that starts a stream is subscribed before the upstream is
+        even opened, and the upstream is opened and read by the stream rather
+        than by that request. So the stream keeps serving the requests that
+        attached to it when the one that started it goes away (e.g. while a
+        reasoning model takes its time before the first chunk), and a request
+        that attaches and leaves in the meantime doesn't get the stream
+        abandoned under the first one.
+        """
+        shared_stream = self._streams.get(key)
+        if shared_stream is not None:
+            PROXY_METRICS.inc("single_flight_attached_requests")
+            return shared_stream.subscribe()
+
+        shared_stream = self._streams[key] = SharedStream(key, self)
+        self._in_flight.add(shared_stream)
+        subscription = shared_stream.subscribe()
+        shared_stream.feed(source(), abort_upstream)
+        return subscription
+
+    def close_to_new_subscribers(self, shared_stream: SharedStream) -> None:
+        if self._streams.get(shared_stream.key) is shared_stream:
+            del self._streams[shared_stream.key]
+
+    def remove(self, shared_stream: SharedStream) -> None:
+        self.close_to_new_subscribers(shared_stream)
+        self._in_flight.discard(shared_stream)
+
+    def stats(self) -> dict[str, Any]:
+        streams = list(self._in_flight)
+        return {
+            "in_flight_streams": len(streams),
+            "joinable_streams": len(self._streams),
+            "subscribers": sum(shared_stream.subscriber_count for shared_stream in streams),
+            "kept_chunks": sum(shared_stream.kept_chunks for shared_stream in streams),
+        }
+
+
+in_flight_streams = InFlightStreams()
+
+PROXY_METRICS.register_collector("single_flight", in_flight_streams.stats)
@@ -0,0 +1,121 @@
+import asyncio
+import sys
+import time
+from typing import Any, Callable, Optional
+
+from claude_code_proxy.proxy_config import SSE_KEEPALIVE_INTERVAL
+from common.metrics import PROXY_METRICS
+
+# The keepalive event of the Anthropic Messages API (Claude Code ignores it)
+_PING_EVENT = b'event: ping\ndata: {"type": "ping"}\n\n'
+# An SSE comment, for the other (e.g. OpenAI ChatCompletions) streams - every
+# SSE client skips it, whereas an OpenAI client would choke on a `ping` event
+_KEEPALIVE_COMMENT = b": keepalive\n\n"
+
+
+def _is_anthropic_messages_path(path: str) -> bool:
+    # `/v1/messages`, `/anthropic/v1/messages` etc.
+    return path.rstrip("/").endswith("/v1/messages")
+
+
+class SseKeepaliveMiddleware:
+    """
+    Pure ASGI middleware that sends a `ping` event down every Anthropic
+    Messages API SSE response (and an SSE comment down every other SSE
+    response) that has been silent for SSE_KEEPALIVE_INTERVAL seconds. While
+    a model reasons, nothing is streamed for minutes, and the proxies / load
+    balancers between Claude Code and us drop the idle connection - after
+    which Claude Code sends the whole (expensive) request again.
+
+    (LiteLLM turns what the router yields into the SSE events, and there is no
+    chunk the router could yield that would become a `ping`, hence the events
+    are injected here - only in between the events of the response, never
+    into the middle of one.)
+    """
+
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or SSE_KEEPALIVE_INTERVAL <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        keepalive = _PING_EVENT if _is_anthropic_messages_path(scope.get("path", "")) else _KEEPALIVE_COMMENT
+        lock = asyncio.Lock()
+        last_sent_at = time.monotonic()
+        # Whether what was sent so far ends with a complete event
+        at_event_boundary = True
+        finished = False
+        pinger: Optional[asyncio.Task] = None
+
+        async def send_pings() -> None:
+            nonlocal last_sent_at
+
+            while True:
+                # (The floor keeps it from spinning while waiting for the
+                # rest of a partially sent event)
+                await asyncio.sleep(max(last_sent_at + SSE_KEEPALIVE_INTERVAL - time.monotonic(), 0.1))
+                async with lock:
+                    if finished:
+                        return
+                    if not at_event_boundary or time.monotonic() - last_sent_at < SSE_KEEPALIVE_INTERVAL:
+                        continue
+                    try:
+                        await send({"type": "http.response.body", "body": keepalive, "more_body": True})
+                    except Exception:  # pylint: disable=broad-exception-caught
+                        # The client is gone (the response itself is going to
+                        # fail on it the same way)
+                        return
+                    last_sent_at = time.monotonic()
+                PROXY_METRICS.inc("sse_keepalive_pings")
+
+        async def send_wrapper(message: dict) -> None:
+            nonlocal pinger, last_sent_at, at_event_boundary, finished
+
+            if message["type"] == "http.response.start":
+                await send(message)
+                content_type = dict(message.get("headers", ())).get(b"content-type", b"")
+                if content_type.startswith(b"text/event-stream"):
+                    last_sent_at = time.monotonic()
+                    pinger = asyncio.create_task(send_pings())
+                return
+
+            async with lock:
+                if message["type"] == "http.response.body":
+                    body = message.get("body", b"")
+                    if body:
+                        at_event_boundary = body.endswith(b"\n\n")
+                    finished = not message.get("more_body", False)
+                await send(message)
+                last_sent_at = time.monotonic()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = True
+            if pinger is not None:
+                pinger.cancel()
+
+
+_SSE_KEEPALIVE_MIDDLEWARE_REGISTERED = False
+
+
+def register_sse_keepalive_middleware() -> None:
+    """
+    Install `SseKeepaliveMiddleware` on the LiteLLM proxy server app. Does
+    nothing when we are not running inside the LiteLLM proxy server.
+    """
+    global _SSE_KEEPALIVE_MIDDLEWARE_REGISTERED  # pylint: disable=global-statement
+
+    if _SSE_KEEPALIVE_MIDDLEWARE_REGISTERED or "litellm.proxy.proxy_server" not in sys.modules:
+        return
+
+    from litellm.proxy.proxy_server import app  # pylint: disable=import-outside-toplevel
+
+    if app.middleware_stack is None:
+        app.add_middleware(SseKeepaliveMiddleware)
+    else:
+        # (See `register_client_disconnect_middleware()`)
+        app.middleware_stack = SseKeepaliveMiddleware(app.middleware_stack)
+    _SSE_KEEPALIVE_MIDDLEWARE_REGISTERED = True
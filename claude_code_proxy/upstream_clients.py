@@ -0,0 +1,361 @@
+import asyncio
+import inspect
+import os
+import socket
+import time
+import typing
+from typing import Any, NamedTuple, Optional, Union
+
+import httpcore
+import httpx
+from litellm import AsyncHTTPHandler
+
+from claude_code_proxy.api_key_pool import api_key_pool
+from claude_code_proxy.proxy_config import (
+    ANTHROPIC,
+    OPENAI,
+    PROVIDER_BASE_URL_ENV_VARS,
+    PROVIDER_DEFAULT_BASE_URLS,
+    UPSTREAM_DNS_CACHE_TTL,
+    UPSTREAM_HTTP2,
+    UPSTREAM_KEEPALIVE_EXPIRY,
+    UPSTREAM_MAX_CONNECTIONS,
+    UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+    USE_POOLED_UPSTREAM_CLIENTS,
+)
+from claude_code_proxy.route_model import ModelRoute
+from common.metrics import PROXY_METRICS
+
+try:
+    import h2  # pylint: disable=unused-import
+
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+# The providers we know which kind of client LiteLLM expects for
+POOLED_PROVIDERS = (OPENAI, ANTHROPIC)
+
+
+class UpstreamKey(NamedTuple):
+    provider: str
+    base_url: str
+
+
+def resolve_upstream_key(model_route: ModelRoute) -> UpstreamKey:
+    provider = model_route.target_model.split("/", 1)[0]
+
+    # A base URL that is specific to the remap target takes precedence
+    base_url = model_route.api_base
+    if not base_url:
+        for env_var in PROVIDER_BASE_URL_ENV_VARS.get(provider, ()):
+            base_url = os.getenv(env_var)
+            if base_url:
+                break
+    if not base_url:
+        # For the providers we don't know the default base URL of we still
+        # maintain a separate pool (keyed by the provider name only)
+        base_url = PROVIDER_DEFAULT_BASE_URLS.get(provider, "")
+
+    return UpstreamKey(provider=provider, base_url=base_url.rstrip("/"))
+
+
+class _CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    A network backend that caches hostname resolution results for a while, so
+    new upstream connections (pool growth, reconnects after keepalive expiry)
+    don't pay for a DNS lookup every time. TLS SNI / certificate verification
+    still use the original hostname (httpcore passes it to `start_tls`
+    separately).
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self._backend = httpcore.AnyIOBackend()
+        self._ttl = ttl
+        self._cache: dict[tuple[str, int], tuple[float, list[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _resolve(self, host: str, port: int) -> list[str]:
+        cached = self._cache.get((host, port))
+        if cached is not None and cached[0] > time.monotonic():
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        addr_infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(addr_info[4][0] for addr_info in addr_infos))
+        self._cache[(host, port)] = (time.monotonic() + self._ttl, addresses)
+        return addresses
+
+    # (The signature of httpcore's `AsyncNetworkBackend.connect_tcp()`)
+    async def connect_tcp(  # pylint: disable=too-many-positional-arguments
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options: Optional[typing.Iterable[httpcore.SOCKET_OPTION]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        if self._ttl <= 0 or _is_ip_address(host):
+            return await self._backend.connect_tcp(
+                host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+            )
+
+        addresses = await self._resolve(host, port)
+        last_error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+
+        # None of the cached addresses worked - maybe they are stale
+        self._cache.pop((host, port), None)
+        if last_error is not None:
+            raise last_error
+        raise httpcore.ConnectError(f"Could not resolve {host}")
+
+    async def connect_unix_socket(
+        self,
+        path: str,
+        timeout: Optional[float] = None,
+        socket_options: Optional[typing.Iterable[httpcore.SOCKET_OPTION]] = None,
+    ) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+def _is_ip_address(host: str) -> bool:
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (OSError, ValueError):
+            pass
+    return False
+
+
+def _get_request_api_key(request: httpx.Request) -> Optional[str]:
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return request.headers.get("x-api-key") or request.headers.get("api-key")
+
+
+class _PooledUpstream:
+    def __init__(self, key: UpstreamKey) -> None:
+        self.key = key
+        self.http2 = UPSTREAM_HTTP2 and _HTTP2_AVAILABLE
+        self.dns_backend = _CachingDNSBackend(UPSTREAM_DNS_CACHE_TTL)
+        self.requests_sent = 0
+
+        limits = httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+        transport = httpx.AsyncHTTPTransport(http2=self.http2, limits=limits)
+        # httpx does not let us pass a custom network backend, so we replace
+        # the underlying httpcore pool with an equivalent one that uses our DNS
+        # caching backend
+        transport._pool = httpcore.AsyncConnectionPool(  # pylint: disable=protected-access
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=self.http2,
+            network_backend=self.dns_backend,
+        )
+        self.connection_pool: httpcore.AsyncConnectionPool = transport._pool  # pylint: disable=protected-access
+
+        self.httpx_client = httpx.AsyncClient(
+            transport=transport,
+            # The actual timeouts are passed by LiteLLM for every request
+            timeout=httpx.Timeout(600.0, connect=10.0),
+            follow_redirects=True,
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+
+        self._litellm_handler: Optional[AsyncHTTPHandler] = None
+        self._openai_clients: dict[Optional[str], Any] = {}
+
+    async def _on_request(self, request: httpx.Request) -> None:  # pylint: disable=unused-argument
+        self.requests_sent += 1
+
+    async def _on_response(self, response: httpx.Response) -> None:
+        # Keep track of the rate limits of the key the request was sent with
+        api_key = _get_request_api_key(response.request)
+        if not api_key:
+            return
+        api_key_pool.record_response_headers(api_key, response.headers)
+        if response.status_code == 429:
+            try:
+                retry_after = float(response.headers["retry-after"])
+            except (KeyError, ValueError):
+                retry_after = None
+            api_key_pool.record_rate_limited(api_key, retry_after)
+
+    def get_litellm_handler(self) -> AsyncHTTPHandler:
+        if self._litellm_handler is None:
+            handler = AsyncHTTPHandler()
+            handler.client = self.httpx_client
+            self._litellm_handler = handler
+        return self._litellm_handler
+
+    def get_openai_client(self, api_key: Optional[str]) -> Any:
+        client = self._openai_clients.get(api_key)
+        if client is None:
+            from openai import AsyncOpenAI  # pylint: disable=import-outside-toplevel
+
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=self.key.base_url,
+                organization=os.getenv("OPENAI_ORGANIZATION"),
+                http_client=self.httpx_client,
+            )
+            self._openai_clients[api_key] = client
+        return client
+
+    def stats(self) -> dict[str, Any]:
+        # (Closed connections linger in the pool until its next operation)
+        connections = [c for c in self.connection_pool.connections if not c.is_closed()]
+        return {
+            "provider": self.key.provider,
+            "base_url": self.key.base_url,
+            "http2_enabled": self.http2,
+            "requests_sent": self.requests_sent,
+            "connections": len(connections),
+            "connections_idle": sum(1 for c in connections if c.is_idle()),
+            "connections_http2": sum(1 for c in connections if "HTTP/2" in c.info()),
+            "dns_cache_hits": self.dns_backend.hits,
+            "dns_cache_misses": self.dns_backend.misses,
+        }
+
+    async def aclose(self) -> None:
+        await self.httpx_client.aclose()
+
+
+class UpstreamClientPool:
+    """
+    Long-lived `httpx.AsyncClient` instances (one per provider / base URL)
+    which are injected into the upstream LiteLLM calls, so connections (and
+    TLS sessions) to the providers are reused across requests and concurrent
+    streams can be multiplexed over HTTP/2.
+    """
+
+    def __init__(self) -> None:
+        self._upstreams: dict[UpstreamKey, _PooledUpstream] = {}
+
+    def get_upstream(self, key: UpstreamKey) -> _PooledUpstream:
+        upstream = self._upstreams.get(key)
+        if upstream is None:
+            upstream = _PooledUpstream(key)
+            self._upstreams[key] = upstream
+        return upstream
+
+    def get_async_client(
+        self, model_route: ModelRoute, fallback_client: Optional[Any] = None, api_key: Optional[str] = None
+    ) -> Optional[Union[AsyncHTTPHandler, Any]]:
+        """
+        Return the client object LiteLLM expects for this particular route
+        (an `AsyncOpenAI` for the OpenAI ChatCompletions API, an
+        `AsyncHTTPHandler` for everything else that LiteLLM implements on top
+        of its own HTTP handler). `fallback_client` (whatever LiteLLM handed to
+        us) is returned when pooling is disabled or not supported for the
+        provider. `api_key` is the key the request is going to be sent with
+        (the `AsyncOpenAI` clients are bound to a key).
+        """
+        if not USE_POOLED_UPSTREAM_CLIENTS:
+            return fallback_client
+
+        key = resolve_upstream_key(model_route)
+        if key.provider not in POOLED_PROVIDERS:
+            # Let LiteLLM manage the connections to other providers itself
+            return fallback_client
+
+        upstream = self.get_upstream(key)
+        if key.provider == OPENAI and not model_route.use_responses_api:
+            api_key = api_key or os.getenv("OPENAI_API_KEY")
+            if not api_key:
+                # Let LiteLLM report the missing key the usual way
+                return fallback_client
+            return upstream.get_openai_client(api_key)
+
+        return upstream.get_litellm_handler()
+
+    def stats(self) -> list[dict[str, Any]]:
+        return [upstream.stats() for upstream in list(self._upstreams.values())]
+
+    async def aclose(self) -> None:
+        upstreams = list(self._upstreams.values())
+        self._upstreams.clear()
+        for upstream in upstreams:
+            await upstream.aclose()
+
+
+# Attribute paths (relative to the stream object that LiteLLM returns) of the
+# objects that can be closed to abort an upstream stream
+_UPSTREAM_STREAM_CLOSABLES = (
+    # Responses API (`BaseResponsesAPIStreamingIterator`): the httpx response
+    ("response",),
+    # ChatCompletions (`CustomStreamWrapper`) around OpenAI's `AsyncStream`
+    ("completion_stream",),
+    # ChatCompletions (`CustomStreamWrapper`) around LiteLLM's own provider
+    # iterators (e.g. Anthropic), which read `httpx.Response.aiter_lines()`
+    ("completion_stream", "streaming_response"),
+)
+
+# Keep references to the closing tasks, so they are not garbage collected
+# before they are done
+_CLOSING_TASKS: set[asyncio.Task] = set()
+
+
+async def _aclose_upstream_stream(resp_stream: Any) -> None:
+    for attr_path in _UPSTREAM_STREAM_CLOSABLES:
+        closable = resp_stream
+        for attr in attr_path:
+            closable = getattr(closable, attr, None)
+        close = getattr(closable, "aclose", None) or getattr(closable, "close", None)
+        if close is None:
+            continue
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:  # pylint: disable=broad-exception-caught
+            PROXY_METRICS.inc("upstream_stream_close_failures")
+
+
+def close_upstream_stream(resp_stream: Any) -> None:
+    """
+    Abort an upstream stream that is not going to be consumed to the end (e.g.
+    because the client disconnected), so the upstream stops generating tokens
+    and the connection slot is released. The stream is closed in a separate
+    task, because the task that was consuming it is usually being cancelled at
+    this point.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_aclose_upstream_stream(resp_stream))
+    _CLOSING_TASKS.add(task)
+    task.add_done_callback(_CLOSING_TASKS.discard)
+
+
+upstream_client_pool = UpstreamClientPool()
+
+PROXY_METRICS.register_collector("upstream_pools", upstream_client_pool.stats)
+
+if USE_POOLED_UPSTREAM_CLIENTS and UPSTREAM_HTTP2 and not _HTTP2_AVAILABLE:
+    print(
+        "\033[1;31mUPSTREAM_HTTP2 is enabled, but the `h2` package is not installed. Please install it with "
+        "`uv pip install h2`. Falling back to HTTP/1.1...\033[0m"
+    )
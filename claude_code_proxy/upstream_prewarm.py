@@ -0,0 +1,117 @@
+import asyncio
+from typing import Any, Optional
+
+from claude_code_proxy.proxy_config import (
+    UPSTREAM_PREWARM_CONNECTIONS,
+    UPSTREAM_PREWARM_REFRESH_INTERVAL,
+    USE_POOLED_UPSTREAM_CLIENTS,
+)
+from claude_code_proxy.route_model import ModelRoute
+from claude_code_proxy.upstream_clients import (
+    POOLED_PROVIDERS,
+    UpstreamKey,
+    resolve_upstream_key,
+    upstream_client_pool,
+)
+from common.metrics import PROXY_METRICS
+
+# Requesting these "models" resolves the routes that Claude Code will actually
+# use (whatever the REMAP_CLAUDE_* settings point to)
+_CLAUDE_MODEL_FAMILIES = ("claude-haiku", "claude-sonnet", "claude-opus")
+
+_PREWARM_REQUEST_TIMEOUT = 10.0
+
+
+def resolve_configured_upstreams() -> list[UpstreamKey]:
+    upstream_keys: list[UpstreamKey] = []
+    for requested_model in _CLAUDE_MODEL_FAMILIES:
+        # Warm up the failover targets too, so failing over is fast as well
+        for remap_target in ModelRoute(requested_model, select_healthy_target=False).remap_targets:
+            upstream_key = resolve_upstream_key(ModelRoute(remap_target, select_healthy_target=False))
+            if upstream_key.provider in POOLED_PROVIDERS and upstream_key not in upstream_keys:
+                upstream_keys.append(upstream_key)
+    return upstream_keys
+
+
+class UpstreamPrewarmer:
+    """
+    Opens connections to the configured upstreams as soon as the proxy starts
+    (so the first Claude Code turns after a deploy don't pay for DNS + TCP +
+    TLS setup) and keeps refreshing them, so they are not dropped as idle.
+    """
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.upstream_keys: list[UpstreamKey] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+
+        if not USE_POOLED_UPSTREAM_CLIENTS or UPSTREAM_PREWARM_CONNECTIONS <= 0:
+            self.ready = True
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # We are not running inside the proxy server (the module was
+            # imported by something else), so there is nothing to warm up for
+            self.ready = True
+            return
+
+        self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            self.upstream_keys = resolve_configured_upstreams()
+            await self.warm_up()
+        finally:
+            # An unreachable upstream should not keep the proxy from ever
+            # becoming ready
+            self.ready = True
+
+        if self.upstream_keys:
+            print(
+                f"\033[1;34mWarmed up {UPSTREAM_PREWARM_CONNECTIONS} connection(s) to each of: "
+                f"{', '.join(key.base_url for key in self.upstream_keys)}\033[0m"
+            )
+
+        while True:
+            await asyncio.sleep(UPSTREAM_PREWARM_REFRESH_INTERVAL)
+            await self.warm_up()
+
+    async def warm_up(self) -> None:
+        await asyncio.gather(*(self._warm_up_upstream(key) for key in self.upstream_keys))
+
+    @staticmethod
+    async def _warm_up_upstream(upstream_key: UpstreamKey) -> None:
+        upstream = upstream_client_pool.get_upstream(upstream_key)
+        # Concurrent requests make the pool use the idle connections it already
+        # has (which resets their keepalive expiry) and open new ones for the
+        # rest. The responses themselves don't matter (most likely 404 or 401).
+        results = await asyncio.gather(
+            *(
+                upstream.httpx_client.head(upstream_key.base_url, timeout=_PREWARM_REQUEST_TIMEOUT)
+                for _ in range(UPSTREAM_PREWARM_CONNECTIONS)
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                PROXY_METRICS.inc("upstream_prewarm_failures", provider=upstream_key.provider)
+            else:
+                PROXY_METRICS.inc("upstream_prewarm_requests", provider=upstream_key.provider)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "connections_per_upstream": UPSTREAM_PREWARM_CONNECTIONS,
+            "upstreams": [key.base_url for key in self.upstream_keys],
+        }
+
+
+upstream_prewarmer = UpstreamPrewarmer()
+
+PROXY_METRICS.register_collector("upstream_prewarm", upstream_prewarmer.stats)
@@ -0,0 +1,209 @@
+import atexit
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from typing import Any, Optional, Sequence
+
+import litellm
+from litellm import Usage
+
+from claude_code_proxy.proxy_config import USAGE_LEDGER_ENABLED, USAGE_LEDGER_FLUSH_INTERVAL, USAGE_LEDGER_PATH
+from common.metrics import PROXY_METRICS
+
+# Claude Code's `metadata.user_id` (which LiteLLM passes on as `user`) looks
+# like "user_<hash>_account_<uuid>_session_<uuid>"
+_SESSION_ID_PATTERN = re.compile(r"session_([0-9a-fA-F-]+)")
+
+_KEY_COLUMNS = ("day", "session", "requested_model", "target")
+# The columns that are summed up, with their types (the time from when the
+# request was sent until the response was complete, and the cost in USD as
+# estimated by LiteLLM)
+_VALUE_COLUMN_TYPES = {
+    "requests": "INTEGER",
+    "prompt_tokens": "INTEGER",
+    "cached_tokens": "INTEGER",
+    "completion_tokens": "INTEGER",
+    "reasoning_tokens": "INTEGER",
+    "response_seconds": "REAL",
+    "cost": "REAL",
+}
+_VALUE_COLUMNS = tuple(_VALUE_COLUMN_TYPES)
+
+_CREATE_TABLE = f"""
+CREATE TABLE IF NOT EXISTS usage (
+    {", ".join(f"{column} TEXT NOT NULL" for column in _KEY_COLUMNS)},
+    {", ".join(f"{column} {column_type} NOT NULL" for column, column_type in _VALUE_COLUMN_TYPES.items())},
+    PRIMARY KEY ({", ".join(_KEY_COLUMNS)})
+)
+"""
+_UPSERT = f"""
+INSERT INTO usage ({", ".join(_KEY_COLUMNS + _VALUE_COLUMNS)})
+VALUES ({", ".join("?" for _ in _KEY_COLUMNS + _VALUE_COLUMNS)})
+ON CONFLICT ({", ".join(_KEY_COLUMNS)}) DO UPDATE SET
+    {", ".join(f"{column} = {column} + excluded.{column}" for column in _VALUE_COLUMNS)}
+"""
+_SUMMARIZE_SESSIONS = f"""
+SELECT session, requested_model, target, MIN(day), MAX(day),
+    {", ".join(f"SUM({column})" for column in _VALUE_COLUMNS)}
+FROM usage
+WHERE day >= ?
+GROUP BY session, requested_model, target
+ORDER BY MAX(day) DESC, session
+"""
+
+
+def get_session_id(params: dict[str, Any]) -> str:
+    user = params.get("user") or (params.get("metadata") or {}).get("user_id")
+    if not isinstance(user, str) or not user:
+        return "unknown"
+    match = _SESSION_ID_PATTERN.search(user)
+    return match.group(1) if match else user
+
+
+def _estimate_cost(target_model: str, usage: Usage) -> float:
+    try:
+        prompt_cost, completion_cost = litellm.cost_per_token(
+            model=target_model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens,
+            usage_object=usage,
+        )
+    except Exception:  # pylint: disable=broad-exception-caught
+        # The model is not in LiteLLM's cost map
+        return 0.0
+    return prompt_cost + completion_cost
+
+
+def _session_summary(row: Sequence[Any]) -> dict[str, Any]:
+    session, requested_model, target, first_day, last_day, *values = row
+    totals = dict(zip(_VALUE_COLUMNS, values))
+    completion_tokens, response_seconds = totals["completion_tokens"], totals["response_seconds"]
+    cached_tokens, prompt_tokens = totals["cached_tokens"], totals["prompt_tokens"]
+    return {
+        "session": session,
+        "requested_model": requested_model,
+        "target": target,
+        "first_day": first_day,
+        "last_day": last_day,
+        **totals,
+        "output_tokens_per_second": completion_tokens / response_seconds if response_seconds else None,
+        "cache_hit_ratio": cached_tokens / prompt_tokens if prompt_tokens else None,
+    }
+
+
+class UsageLedger:
+    """
+    Records the token usage of the upstream responses in a local SQLite
+    database, aggregated per day, session and route (the requested model and
+    the target it was routed to). The usage is aggregated in memory and
+    written in batches by a background thread, so recording it costs the
+    request path next to nothing (and the worker processes, which share the
+    database, don't contend for it on every response).
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.write_errors = 0
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, ...], list[float]] = {}
+        self._writer: Optional[threading.Thread] = None
+
+    def record(
+        self,
+        *,
+        session: str,
+        requested_model: str,
+        target: str,
+        target_model: str,
+        usage: Usage,
+        response_seconds: float,
+    ) -> None:
+        if not USAGE_LEDGER_ENABLED:
+            return
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None)
+        completion_tokens_details = getattr(usage, "completion_tokens_details", None)
+        values = (
+            1,
+            usage.prompt_tokens or 0,
+            getattr(prompt_tokens_details, "cached_tokens", None) or 0,
+            usage.completion_tokens or 0,
+            getattr(completion_tokens_details, "reasoning_tokens", None) or 0,
+            response_seconds,
+            _estimate_cost(target_model, usage),
+        )
+        key = (datetime.now(UTC).date().isoformat(), session, requested_model, target)
+        with self._lock:
+            self._add_pending(key, values)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_periodically, name="usage-ledger", daemon=True)
+                self._writer.start()
+
+    def _add_pending(self, key: tuple[str, ...], values: Sequence[float]) -> None:
+        pending = self._pending.get(key)
+        if pending is None:
+            self._pending[key] = list(values)
+        else:
+            for idx, value in enumerate(values):
+                pending[idx] += value
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # (The worker processes write to the same database)
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(_CREATE_TABLE)
+        return connection
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            with closing(self._connect()) as connection:
+                # (In a single transaction)
+                with connection:
+                    connection.executemany(_UPSERT, [key + tuple(values) for key, values in pending.items()])
+        except sqlite3.Error as e:
+            self.write_errors += 1
+            print(f"\033[1;31mFailed to write to the usage ledger ({self.path}): {e}\033[0m")
+            with self._lock:
+                # Try again with the next batch
+                for key, values in pending.items():
+                    self._add_pending(key, values)
+
+    def _write_periodically(self) -> None:
+        stop = threading.Event()
+        atexit.register(stop.set)
+        atexit.register(self.flush)
+        while not stop.wait(USAGE_LEDGER_FLUSH_INTERVAL):
+            self.flush()
+
+    def summarize_sessions(self, days: int) -> list[dict[str, Any]]:
+        """
+        The usage of the sessions of the last `days` days, per route, with the
+        derived statistics (blocking - run it in a thread).
+        """
+        self.flush()
+        if not self.path.exists():
+            return []
+        since = (datetime.now(UTC).date() - timedelta(days=days - 1)).isoformat()
+        with closing(self._connect()) as connection:
+            rows = connection.execute(_SUMMARIZE_SESSIONS, (since,)).fetchall()
+
+        return [_session_summary(row) for row in rows]
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": USAGE_LEDGER_ENABLED,
+            "pending_rows": len(self._pending),
+            "write_errors": self.write_errors,
+        }
+
+
+usage_ledger = UsageLedger(USAGE_LEDGER_PATH)
+
+PROXY_METRICS.register_collector("usage_ledger", usage_ledger.stats)
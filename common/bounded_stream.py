@@ -0,0 +1,159 @@
+import asyncio
+import weakref
+from collections import deque
+from typing import Any, AsyncGenerator, AsyncIterator, Optional
+
+from litellm import GenericStreamingChunk
+
+from common.metrics import PROXY_METRICS
+
+BUFFER_FULL_POLICIES = ("block", "coalesce", "abort")
+
+_COALESCIBLE_RESPONSES_TYPES = (None, "response.output_text.delta")
+
+_ACTIVE_STREAMS: "weakref.WeakSet[BoundedStream]" = weakref.WeakSet()
+
+
+class StreamBufferOverflowError(RuntimeError):
+    pass
+
+
+def is_text_delta_chunk(chunk: GenericStreamingChunk) -> bool:
+    """
+    Whether the chunk carries nothing but a piece of the response text (and
+    can therefore be merged with a neighbouring chunk of the same kind).
+    """
+    if not chunk.get("text") or chunk.get("tool_use") or chunk.get("is_finished") or chunk.get("usage"):
+        return False
+    provider_specific_fields = chunk.get("provider_specific_fields") or {}
+    return provider_specific_fields.get("responses_type") in _COALESCIBLE_RESPONSES_TYPES
+
+
+def merge_text_delta_chunks(target: GenericStreamingChunk, chunk: GenericStreamingChunk) -> bool:
+    """
+    Append the text of `chunk` to `target` (in place) if both are text deltas.
+    Returns whether the chunks were merged.
+    """
+    if not is_text_delta_chunk(target) or not is_text_delta_chunk(chunk):
+        return False
+    if target.get("index") != chunk.get("index"):
+        return False
+    target["text"] += chunk["text"]
+    return True
+
+
+class BoundedStream:
+    """
+    A bounded buffer between the upstream stream (the producer) and the client
+    (the consumer). The upstream is read ahead by up to `max_size` chunks; what
+    happens when the client falls behind and the buffer is full depends on
+    `full_policy`:
+
+    - "block" - stop reading the upstream until the client catches up (the
+      backpressure propagates to the upstream connection)
+    - "coalesce" - merge text deltas into the last buffered chunk (other
+      chunks still block)
+    - "abort" - fail the stream
+    """
+
+    def __init__(
+        self,
+        source: AsyncIterator[GenericStreamingChunk],
+        max_size: int,
+        full_policy: str = "block",
+    ) -> None:
+        if full_policy not in BUFFER_FULL_POLICIES:
+            raise ValueError(f"Unknown buffer full policy: {full_policy!r} (expected one of {BUFFER_FULL_POLICIES})")
+
+        self.max_size = max(1, max_size)
+        self.full_policy = full_policy
+        self.peak_occupancy = 0
+
+        self._source = source
+        self._buffer: deque[GenericStreamingChunk] = deque()
+        self._condition = asyncio.Condition()
+        self._source_exhausted = False
+        self._error: Optional[BaseException] = None
+        self._producer: Optional[asyncio.Task] = None
+
+    @property
+    def occupancy(self) -> int:
+        return len(self._buffer)
+
+    async def _put(self, chunk: GenericStreamingChunk) -> None:
+        async with self._condition:
+            if len(self._buffer) >= self.max_size:
+                PROXY_METRICS.inc("stream_buffer_full", policy=self.full_policy)
+
+                if self.full_policy == "abort":
+                    raise StreamBufferOverflowError(
+                        f"The client fell behind the upstream by more than {self.max_size} chunks"
+                    )
+                if self.full_policy == "coalesce" and merge_text_delta_chunks(self._buffer[-1], chunk):
+                    PROXY_METRICS.inc("stream_buffer_coalesced_chunks")
+                    return
+
+                await self._condition.wait_for(lambda: len(self._buffer) < self.max_size)
+
+            self._buffer.append(chunk)
+            self.peak_occupancy = max(self.peak_occupancy, len(self._buffer))
+            self._condition.notify_all()
+
+    async def _produce(self) -> None:
+        try:
+            async for chunk in self._source:
+                await self._put(chunk)
+        except StreamBufferOverflowError as e:
+            PROXY_METRICS.inc("stream_buffer_aborts")
+            # The client is not going to catch up - drop what it hasn't
+            # received yet and fail the stream right away
+            self._buffer.clear()
+            self._error = e
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            # Delivered to the client after the chunks that are already buffered
+            self._error = e
+        finally:
+            self._source_exhausted = True
+            async with self._condition:
+                self._condition.notify_all()
+
+    def cancel(self) -> None:
+        """
+        Stop reading the upstream (e.g. because the client went away) and drop
+        whatever is buffered.
+        """
+        if self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+        self._buffer.clear()
+
+    async def __aiter__(self) -> AsyncGenerator[GenericStreamingChunk, None]:
+        _ACTIVE_STREAMS.add(self)
+        self._producer = asyncio.create_task(self._produce())
+        try:
+            while True:
+                async with self._condition:
+                    await self._condition.wait_for(lambda: self._buffer or self._source_exhausted)
+                    if self._buffer:
+                        chunk = self._buffer.popleft()
+                        self._condition.notify_all()
+                    elif self._error is not None:
+                        raise self._error
+                    else:
+                        return
+                yield chunk
+        finally:
+            self.cancel()
+            _ACTIVE_STREAMS.discard(self)
+
+
+def collect_stream_buffer_stats() -> dict[str, Any]:
+    streams = list(_ACTIVE_STREAMS)
+    return {
+        "active_streams": len(streams),
+        "buffered_chunks": sum(stream.occupancy for stream in streams),
+        "max_occupancy": max((stream.occupancy for stream in streams), default=0),
+        "max_peak_occupancy": max((stream.peak_occupancy for stream in streams), default=0),
+    }
+
+
+PROXY_METRICS.register_collector("stream_buffers", collect_stream_buffer_stats)
@@ -1,3 +1,4 @@
+import importlib.util
 import os
 from pathlib import Path
 
@@ -14,11 +15,29 @@ from common.utils import env_var_to_bool
 
 WRITE_TRACES_TO_FILES = env_var_to_bool(os.getenv("WRITE_TRACES_TO_FILES"), "false")
 TRACES_DIR = Path(__file__).parent.parent / ".traces"
+# Store the request messages (and tools) in the traces only once, as content-
+# addressed blobs, and write only the new messages of every turn to the request
+# traces (see `common/trace_blobs.py`)
+DEDUPLICATE_TRACES = env_var_to_bool(os.getenv("DEDUPLICATE_TRACES"), "true")
+
+# OpenTelemetry spans for the proxy's own stages (see `common/otel_tracing.py`),
+# exported in batches by a background thread - over OTLP (configured with the
+# standard OTEL_EXPORTER_OTLP_* env vars) and/or as JSON lines appended to
+# OTEL_TRACES_FILE
+OTEL_TRACING_ENABLED = env_var_to_bool(os.getenv("OTEL_TRACING_ENABLED"), "false")
+OTEL_TRACES_FILE = os.getenv("OTEL_TRACES_FILE")
+
+# Measure the event loop lag every LOOP_WATCHDOG_INTERVAL seconds and, when
+# the loop is blocked for LOOP_WATCHDOG_THRESHOLD seconds or longer, log the
+# code that blocks it (see `common/loop_watchdog.py`)
+LOOP_WATCHDOG_ENABLED = env_var_to_bool(os.getenv("LOOP_WATCHDOG_ENABLED"), "true")
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD", "0.1"))
 
 if os.getenv("LANGFUSE_SECRET_KEY") or os.getenv("LANGFUSE_PUBLIC_KEY") or os.getenv("LANGFUSE_HOST"):
-    try:
-        import langfuse  # pylint: disable=unused-import
-    except ImportError:
+    # Only check that Langfuse is installed (LiteLLM imports it by itself when
+    # the callbacks are actually used), so it doesn't slow down the startup
+    if importlib.util.find_spec("langfuse") is None:
         print(
             "\033[1;31mLangfuse is not installed. Please install it with either `uv sync --extra langfuse` or "
             "`uv sync --all-extras`.\033[0m"
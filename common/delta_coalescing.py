@@ -0,0 +1,115 @@
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Optional
+
+from litellm import GenericStreamingChunk
+
+from common.bounded_stream import is_text_delta_chunk, merge_text_delta_chunks
+from common.metrics import PROXY_METRICS
+
+
+class _TextDeltaCoalescer:
+    """
+    The state of `coalesce_text_deltas()`: the text chunk that is being held
+    back (and until when) and the read from the source that is in progress.
+    """
+
+    def __init__(self, source: AsyncIterator[GenericStreamingChunk], window_seconds: float, max_chars: int) -> None:
+        self._iterator = aiter(source)
+        self._loop = asyncio.get_running_loop()
+        self._window_seconds = window_seconds
+        self._max_chars = max_chars
+        self._held: Optional[GenericStreamingChunk] = None
+        self._held_until = 0.0
+        self._next_chunk: Optional[asyncio.Future] = None
+
+    async def anext_or_window_over(self) -> Optional[GenericStreamingChunk]:
+        """
+        The next chunk from the source or None, if the window of the held text
+        is over before it arrives (the read carries on in the background).
+        Raises StopAsyncIteration at the end of the source.
+        """
+        if self._held is None and self._next_chunk is None:
+            # Nothing to flush on a deadline - just wait for the next chunk
+            return await anext(self._iterator)
+
+        if self._next_chunk is None:
+            self._next_chunk = asyncio.ensure_future(anext(self._iterator))
+        if self._held is None:
+            await asyncio.wait((self._next_chunk,))
+        else:
+            timeout = self._held_until - self._loop.time()
+            if timeout > 0:
+                await asyncio.wait((self._next_chunk,), timeout=timeout)
+            if not self._next_chunk.done():
+                return None
+
+        next_chunk, self._next_chunk = self._next_chunk, None
+        return next_chunk.result()
+
+    def add(self, chunk: GenericStreamingChunk) -> tuple[GenericStreamingChunk, ...]:
+        """
+        Take in the next chunk from the source. Returns the chunks to pass on.
+        """
+        flushed: tuple[GenericStreamingChunk, ...] = ()
+        if self._held is not None:
+            if merge_text_delta_chunks(self._held, chunk):
+                PROXY_METRICS.inc("text_deltas_coalesced")
+                return self.release() if len(self._held["text"]) >= self._max_chars else ()
+            flushed = self.release()
+
+        if is_text_delta_chunk(chunk) and len(chunk["text"]) < self._max_chars:
+            self._held = chunk
+            self._held_until = self._loop.time() + self._window_seconds
+            return flushed
+        return flushed + (chunk,)
+
+    def release(self) -> tuple[GenericStreamingChunk, ...]:
+        """
+        Stop holding back the text (returns it, if there is any).
+        """
+        held, self._held = self._held, None
+        return (held,) if held is not None else ()
+
+    def close(self) -> None:
+        if self._next_chunk is not None and not self._next_chunk.done():
+            self._next_chunk.cancel()
+
+
+async def coalesce_text_deltas(
+    source: AsyncIterator[GenericStreamingChunk],
+    window_seconds: float,
+    max_chars: int,
+) -> AsyncGenerator[GenericStreamingChunk, None]:
+    """
+    Merge consecutive text-only chunks that arrive within `window_seconds` of
+    the first one (and add up to less than `max_chars`), so fewer, bigger
+    chunks go through the rest of the pipeline (and over the wire as SSE
+    events). Any other chunk (tool use, finish, usage) flushes the pending
+    text right away and is passed through as is.
+    """
+    coalescer = _TextDeltaCoalescer(source, window_seconds, max_chars)
+    try:
+        while True:
+            try:
+                chunk = await coalescer.anext_or_window_over()
+            except StopAsyncIteration:
+                break
+            except Exception:
+                # Deliver the pending text before the stream fails
+                for held in coalescer.release():
+                    yield held
+                raise
+
+            if chunk is None:
+                # The window is over
+                passed_on = coalescer.release()
+            else:
+                passed_on = coalescer.add(chunk)
+            for passed_on_chunk in passed_on:
+                yield passed_on_chunk
+
+        for held in coalescer.release():
+            yield held
+
+    finally:
+        coalescer.close()
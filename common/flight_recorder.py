@@ -0,0 +1,115 @@
+import itertools
+import json
+import os
+import time
+from collections import deque
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from common.metrics import PROXY_METRICS
+
+# (Not in `common/config.py`, which imports `common/utils.py`, which imports
+# this module)
+# How many of the latest events to keep per stream and across all streams
+FLIGHT_RECORDER_STREAM_EVENTS = int(os.getenv("FLIGHT_RECORDER_STREAM_EVENTS", "64"))
+FLIGHT_RECORDER_GLOBAL_EVENTS = int(os.getenv("FLIGHT_RECORDER_GLOBAL_EVENTS", "1024"))
+FLIGHT_RECORDER_DIR = Path(os.getenv("FLIGHT_RECORDER_DIR") or Path(__file__).parent.parent / ".flight_recorder")
+
+# Don't flood the disk when e.g. the upstream fails every request (the dumps
+# that are not written are still available via the admin endpoint)
+_MIN_SECONDS_BETWEEN_DUMP_FILES = 1.0
+
+_stream_ids = itertools.count(1)
+# (stream_id, timestamp, event_type, item_id, size) - appending to a deque is
+# all it costs to record an event
+_recent_events: deque[tuple] = deque(maxlen=FLIGHT_RECORDER_GLOBAL_EVENTS)
+_recent_dumps: deque[dict[str, Any]] = deque(maxlen=16)
+_LAST_DUMP_FILE_AT = 0.0
+
+
+class StreamFlightRecorder:
+    """
+    Keeps compact records of the latest events of a stream (and adds them to
+    the records across all streams), so that when a stream goes wrong, there
+    is something to tell what happened without full tracing being on.
+    """
+
+    __slots__ = ("stream_id", "started_at", "events", "dumped")
+
+    def __init__(self) -> None:
+        self.stream_id = next(_stream_ids)
+        self.started_at = time.time()
+        self.events: deque[tuple] = deque(maxlen=FLIGHT_RECORDER_STREAM_EVENTS)
+        self.dumped = False
+
+    def record(self, event_type: str, item_id: Optional[str] = None, size: int = 0) -> None:
+        event = (self.stream_id, time.time(), event_type, item_id, size)
+        self.events.append(event)
+        _recent_events.append(event)
+
+
+def _to_dict(event: tuple) -> dict[str, Any]:
+    stream_id, timestamp, event_type, item_id, size = event
+    return {
+        "stream_id": stream_id,
+        "time": datetime.fromtimestamp(timestamp, UTC).isoformat(),
+        "type": event_type,
+        "item_id": item_id,
+        "size": size,
+    }
+
+
+def dump_flight_recording(
+    reason: str, recorder: Optional[StreamFlightRecorder] = None, detail: Optional[str] = None
+) -> Optional[dict[str, Any]]:
+    """
+    Keep the recording of the stream (if any) and of the recent events across
+    all streams for the admin endpoint and write it to FLIGHT_RECORDER_DIR. A
+    stream is only dumped once (the first reason wins).
+    """
+    global _LAST_DUMP_FILE_AT  # pylint: disable=global-statement
+
+    if recorder is not None:
+        if recorder.dumped:
+            return None
+        recorder.dumped = True
+
+    now = time.time()
+    recording = {
+        "reason": reason,
+        "detail": detail,
+        "time": datetime.fromtimestamp(now, UTC).isoformat(),
+        "stream": (
+            {
+                "stream_id": recorder.stream_id,
+                "started_at": datetime.fromtimestamp(recorder.started_at, UTC).isoformat(),
+                "events": [_to_dict(event) for event in recorder.events],
+            }
+            if recorder is not None
+            else None
+        ),
+        "recent_events": [_to_dict(event) for event in list(_recent_events)],
+    }
+    _recent_dumps.append(recording)
+    PROXY_METRICS.inc("flight_recorder_dumps", reason=reason)
+
+    if now - _LAST_DUMP_FILE_AT < _MIN_SECONDS_BETWEEN_DUMP_FILES:
+        return recording
+    _LAST_DUMP_FILE_AT = now
+    file = FLIGHT_RECORDER_DIR / f"{datetime.fromtimestamp(now, UTC).strftime('%Y%m%d_%H%M%S_%f')}_{reason}.json"
+    try:
+        FLIGHT_RECORDER_DIR.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(recording, indent=2), encoding="utf-8")
+    except OSError as e:
+        print(f"\033[1;31mFailed to write the flight recording to {file}: {e}\033[0m")
+    else:
+        print(f"\033[1;33mFlight recording ({reason}) written to {file}\033[0m")
+    return recording
+
+
+def get_flight_recordings() -> dict[str, Any]:
+    return {
+        "recent_events": [_to_dict(event) for event in list(_recent_events)],
+        "dumps": list(_recent_dumps),
+    }
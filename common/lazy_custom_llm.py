@@ -0,0 +1,62 @@
+import importlib
+import threading
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from litellm import CustomLLM
+
+
+class LazyCustomLLM(CustomLLM):
+    """
+    A stand-in for a custom LiteLLM provider that imports the actual provider
+    (the module that defines it and everything that module depends on) only
+    when the first request for this provider arrives. Register it in the
+    `custom_provider_map` of `config.yaml` instead of the actual provider to
+    keep the proxy startup fast.
+    """
+
+    def __init__(self, handler_path: str) -> None:
+        """
+        Args:
+            handler_path: Dotted path to the actual provider instance, e.g.
+                `claude_code_proxy.claude_code_router.claude_code_router`
+        """
+        super().__init__()
+        self.handler_path = handler_path
+        self._handler: Optional[CustomLLM] = None
+        self._lock = threading.Lock()
+
+    @property
+    def handler(self) -> CustomLLM:
+        if self._handler is None:
+            with self._lock:
+                if self._handler is None:
+                    module_name, instance_name = self.handler_path.rsplit(".", 1)
+                    module = importlib.import_module(module_name)
+                    self._handler = getattr(module, instance_name)
+        return self._handler
+
+    def completion(self, *args, **kwargs) -> Any:
+        return self.handler.completion(*args, **kwargs)
+
+    async def acompletion(self, *args, **kwargs) -> Any:
+        return await self.handler.acompletion(*args, **kwargs)
+
+    def streaming(self, *args, **kwargs) -> Iterator[Any]:
+        return self.handler.streaming(*args, **kwargs)
+
+    def astreaming(self, *args, **kwargs) -> AsyncIterator[Any]:  # pylint: disable=invalid-overridden-method
+        # Return the actual provider's async generator as is (instead of
+        # re-yielding its chunks) to avoid an extra layer per chunk
+        return self.handler.astreaming(*args, **kwargs)
+
+    def image_generation(self, *args, **kwargs) -> Any:
+        return self.handler.image_generation(*args, **kwargs)
+
+    async def aimage_generation(self, *args, **kwargs) -> Any:
+        return await self.handler.aimage_generation(*args, **kwargs)
+
+    def embedding(self, *args, **kwargs) -> Any:
+        return self.handler.embedding(*args, **kwargs)
+
+    async def aembedding(self, *args, **kwargs) -> Any:
+        return await self.handler.aembedding(*args, **kwargs)
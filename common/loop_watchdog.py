@@ -0,0 +1,145 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from common.config import LOOP_WATCHDOG_ENABLED, LOOP_WATCHDOG_INTERVAL, LOOP_WATCHDOG_THRESHOLD
+from common.metrics import PROXY_METRICS
+
+_REPO_ROOT = Path(__file__).parent.parent
+# The code a stall is attributed to (rather than e.g. `copy.py` or `json/`)
+_OWN_DIRS = tuple(f"{_REPO_ROOT / package}/" for package in ("claude_code_proxy", "common", "yoda_example"))
+_STACK_DEPTH = 8
+
+
+def _describe_stack(frame: Any) -> tuple[str, list[str]]:
+    """
+    The proxy function the frame is (or is called from) and the innermost
+    frames of the stack.
+    """
+    stack = traceback.extract_stack(frame)
+    own_frames = [entry for entry in stack if entry.filename.startswith(_OWN_DIRS)]
+    culprit = own_frames[-1] if own_frames else stack[-1]
+    module = Path(culprit.filename).relative_to(_REPO_ROOT) if own_frames else Path(culprit.filename).name
+    function = f"{culprit.name} ({module}:{culprit.lineno})"
+    return function, [f"{entry.filename}:{entry.lineno} in {entry.name}" for entry in stack[-_STACK_DEPTH:]]
+
+
+class LoopWatchdog:
+    """
+    Measures how late the event loop gets to run a task that wakes up every
+    LOOP_WATCHDOG_INTERVAL seconds (the lag every stream sees), and, while the
+    loop is blocked for longer than LOOP_WATCHDOG_THRESHOLD, samples the stack
+    of the loop's thread from a thread of its own to tell which code blocks it.
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+        self._loop_thread_id: Optional[int] = None
+        # When the loop last ran the measuring task (written by the loop,
+        # read by the sampling thread)
+        self._heartbeat = time.monotonic()
+        self._samples: Counter[str] = Counter()
+        self._sample_stacks: dict[str, list[str]] = {}
+        self._samples_lock = threading.Lock()
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.measurements = 0
+        self.stalls = 0
+        self.recent_stalls: deque[dict[str, Any]] = deque(maxlen=16)
+
+    def start(self) -> None:
+        if self._task is not None or not LOOP_WATCHDOG_ENABLED:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running inside the proxy server
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = loop.create_task(self._measure())
+        threading.Thread(target=self._sample_while_blocked, name="loop-watchdog", daemon=True).start()
+
+    async def _measure(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            due_at = loop.time() + LOOP_WATCHDOG_INTERVAL
+            await asyncio.sleep(LOOP_WATCHDOG_INTERVAL)
+            lag = max(loop.time() - due_at, 0.0)
+            self._heartbeat = time.monotonic()
+
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.measurements += 1
+            if lag >= LOOP_WATCHDOG_THRESHOLD:
+                self._report_stall(lag)
+
+    def _sample_while_blocked(self) -> None:
+        poll_interval = min(LOOP_WATCHDOG_INTERVAL, LOOP_WATCHDOG_THRESHOLD) / 2
+        while True:
+            time.sleep(poll_interval)
+            if time.monotonic() - self._heartbeat - LOOP_WATCHDOG_INTERVAL < LOOP_WATCHDOG_THRESHOLD:
+                continue
+            # (Only sampled while the loop is blocked, so it costs nothing
+            # otherwise)
+            frame = sys._current_frames().get(self._loop_thread_id)  # pylint: disable=protected-access
+            if frame is None:
+                continue
+            function, stack = _describe_stack(frame)
+            with self._samples_lock:
+                self._samples[function] += 1
+                self._sample_stacks.setdefault(function, stack)
+
+    def _report_stall(self, lag: float) -> None:
+        with self._samples_lock:
+            samples, self._samples = self._samples, Counter()
+            stacks, self._sample_stacks = self._sample_stacks, {}
+
+        self.stalls += 1
+        if samples:
+            # The code the loop was found in most often
+            function = samples.most_common(1)[0][0]
+            stack = stacks[function]
+        else:
+            # (Too short to be sampled)
+            function = "unknown"
+            stack = []
+        PROXY_METRICS.inc("event_loop_stalls", function=function.split(" ", 1)[0])
+        self.recent_stalls.append(
+            {
+                "time": datetime.now(UTC).isoformat(),
+                "lag_seconds": lag,
+                "function": function,
+                "samples": dict(samples),
+                "stack": stack,
+            }
+        )
+        print(
+            f"\033[1;33mThe event loop was blocked for {lag * 1000:.0f}ms, by {function}\033[0m"
+            + "".join(f"\n    {entry}" for entry in stack)
+        )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "enabled": LOOP_WATCHDOG_ENABLED and self._task is not None,
+            "lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "mean_lag_seconds": self.total_lag / self.measurements if self.measurements else 0.0,
+            "stalls": self.stalls,
+            "recent_stalls": list(self.recent_stalls),
+        }
+
+
+loop_watchdog = LoopWatchdog()
+
+PROXY_METRICS.register_collector("event_loop", loop_watchdog.stats)
@@ -0,0 +1,62 @@
+import os
+import threading
+from typing import Any, Callable
+
+
+def _metric_key(name: str, labels: dict[str, Any]) -> str:
+    if not labels:
+        return name
+    labels_repr = ",".join(f"{k}={v}" for k, v in sorted(labels.items()))
+    return f"{name}{{{labels_repr}}}"
+
+
+class MetricsRegistry:
+    """
+    A minimal in-process registry of counters and gauges. Components that
+    already keep their own state (connection pools, buffers, etc.) can register
+    a collector instead of pushing every change into the registry.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._collectors: dict[str, Callable[[], Any]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels: Any) -> None:
+        key = _metric_key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def register_collector(self, name: str, collector: Callable[[], Any]) -> None:
+        with self._lock:
+            self._collectors[name] = collector
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            collectors = dict(self._collectors)
+
+        collected: dict[str, Any] = {}
+        for name, collector in collectors.items():
+            try:
+                collected[name] = collector()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                collected[name] = {"error": repr(e)}
+
+        return {
+            # Every worker process keeps its own metrics
+            "worker_pid": os.getpid(),
+            "counters": counters,
+            "gauges": gauges,
+            **collected,
+        }
+
+
+PROXY_METRICS = MetricsRegistry()
@@ -0,0 +1,142 @@
+import importlib.util
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Generator, Optional, Union
+
+from common.config import OTEL_TRACES_FILE, OTEL_TRACING_ENABLED
+
+
+class _NoopSpan:
+    """
+    Stands in for the spans when tracing is disabled (so the OpenTelemetry SDK
+    is not even imported then).
+    """
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, Any]) -> None:
+        pass
+
+    def add_event(self, name: str, attributes: Optional[dict[str, Any]] = None) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def is_recording(self) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def _create_json_lines_exporter(path: str) -> Any:
+    # pylint: disable=import-outside-toplevel
+    from opentelemetry.sdk.trace.export import SpanExporter, SpanExportResult
+
+    class JsonLinesSpanExporter(SpanExporter):
+        """
+        Appends the spans to a local file, one JSON object per line (a stand-in
+        for a collector, e.g. for testing).
+        """
+
+        def __init__(self) -> None:
+            self._lock = threading.Lock()
+
+        def export(self, spans) -> SpanExportResult:
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            try:
+                with self._lock, open(path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+            except OSError:
+                return SpanExportResult.FAILURE
+            return SpanExportResult.SUCCESS
+
+    return JsonLinesSpanExporter()
+
+
+def _create_tracer() -> Optional[Any]:
+    if importlib.util.find_spec("opentelemetry.sdk") is None:
+        print(
+            "\033[1;31mOTEL_TRACING_ENABLED is set, but OpenTelemetry is not installed. Please install it with "
+            "either `uv sync --extra otel` or `uv sync --all-extras`.\033[0m"
+        )
+        return None
+
+    # pylint: disable=import-outside-toplevel
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    exporters = []
+    if os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT") or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT"):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        exporters.append(OTLPSpanExporter())
+    if OTEL_TRACES_FILE:
+        exporters.append(_create_json_lines_exporter(OTEL_TRACES_FILE))
+    if not exporters:
+        print(
+            "\033[1;31mOTEL_TRACING_ENABLED is set, but neither OTEL_EXPORTER_OTLP_ENDPOINT nor OTEL_TRACES_FILE is. "
+            "Not tracing...\033[0m"
+        )
+        return None
+
+    # (OTEL_SERVICE_NAME takes precedence)
+    provider = TracerProvider(resource=Resource.create({"service.name": "claude-code-proxy"}))
+    for exporter in exporters:
+        # The spans are queued (the queue is bounded - when it's full, spans
+        # are dropped rather than the requests slowed down) and exported in
+        # batches by a background thread (see the OTEL_BSP_* env vars)
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+    print("\033[1;34mEnabling OpenTelemetry tracing...\033[0m")
+    return provider.get_tracer("claude_code_proxy")
+
+
+_tracer = _create_tracer() if OTEL_TRACING_ENABLED else None
+
+
+def _to_attributes(attributes: dict[str, Any]) -> dict[str, Any]:
+    # (OpenTelemetry does not accept None as an attribute value)
+    return {key: value for key, value in attributes.items() if value is not None}
+
+
+def start_span(name: str, parent: Any = None, **attributes: Any) -> Any:
+    """
+    Start a span (a child of `parent`, if given, otherwise the root of a new
+    trace). The span is not made current - the stages of a request don't run
+    in one context (a stream can be consumed by a task of its own).
+    """
+    if _tracer is None:
+        return NOOP_SPAN
+    from opentelemetry import trace  # pylint: disable=import-outside-toplevel
+
+    context = trace.set_span_in_context(parent) if parent not in (None, NOOP_SPAN) else None
+    return _tracer.start_span(name, context=context, attributes=_to_attributes(attributes))
+
+
+def end_span(span: Any, error: Optional[Union[BaseException, str]] = None, **attributes: Any) -> None:
+    if not span.is_recording():
+        return
+    if attributes:
+        span.set_attributes(_to_attributes(attributes))
+    if error is not None:
+        from opentelemetry.trace import Status, StatusCode  # pylint: disable=import-outside-toplevel
+
+        if isinstance(error, BaseException):
+            span.record_exception(error)
+        span.set_status(Status(StatusCode.ERROR, str(error) or type(error).__name__))
+    span.end()
+
+
+@contextmanager
+def traced_stage(name: str, parent: Any, **attributes: Any) -> Generator[Any, None, None]:
+    span = start_span(name, parent, **attributes)
+    try:
+        yield span
+    except BaseException as e:
+        end_span(span, e)
+        raise
+    end_span(span)
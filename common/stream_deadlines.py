@@ -0,0 +1,132 @@
+import asyncio
+import random
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class UpstreamStallError(TimeoutError):
+    """
+    The upstream did not produce the first event of a stream (or the next
+    one) in time.
+    """
+
+
+def seconds_left(deadline: Optional[float]) -> Optional[float]:
+    """
+    How much time is left until `deadline` (in terms of the event loop's
+    clock), or None if there is no deadline.
+    """
+    if deadline is None:
+        return None
+    return max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+def jittered_backoff(attempt: int, base_seconds: float) -> float:
+    """
+    A random delay before retry number `attempt` (starting from 1), up to
+    exponentially more than `base_seconds` ("full jitter", so the retries of
+    concurrent requests that stalled at the same time don't all go out at
+    once).
+    """
+    return random.uniform(0, base_seconds * 2 ** (attempt - 1))
+
+
+async def prepend_items(items: Iterable[T], source: AsyncIterator[T]) -> AsyncGenerator[T, None]:
+    """
+    Yield `items` (that were already read from `source`), then the rest of
+    `source`.
+    """
+    for item in items:
+        yield item
+    async for item in source:
+        yield item
+
+
+async def iterate_with_deadlines(
+    source: AsyncIterator[T],
+    first_item_deadline: Optional[float],
+    inter_item_timeout: Optional[float],
+) -> AsyncGenerator[T, None]:
+    """
+    Iterate `source`, raising `UpstreamStallError` if the first item doesn't
+    arrive before `first_item_deadline` (event loop time) or if any of the
+    subsequent items takes longer than `inter_item_timeout` seconds.
+    """
+    iterator = aiter(source)
+    timeout = seconds_left(first_item_deadline)
+    waiting_for = "the first event in time"
+    while True:
+        deadline = asyncio.timeout(timeout)
+        try:
+            async with deadline:
+                item = await anext(iterator)
+        except StopAsyncIteration:
+            return
+        except TimeoutError as e:
+            if not deadline.expired():
+                # Raised by the source itself
+                raise
+            raise UpstreamStallError(f"The upstream did not send {waiting_for}") from e
+
+        yield item
+        timeout = inter_item_timeout
+        waiting_for = f"the next event within {inter_item_timeout} seconds"
+
+
+async def read_until(
+    source: AsyncIterator[T],
+    is_wanted: Callable[[T], bool],
+    deadline: Optional[float],
+    on_stall: Callable[[], None],
+) -> list[T]:
+    """
+    Read `source` up to (and including) the first item that `is_wanted` (or
+    to its end). If that doesn't happen before `deadline` (event loop time),
+    `on_stall()` is called and `UpstreamStallError` raised. Returns the items
+    that were read.
+    """
+    items = []
+    timeout = asyncio.timeout(seconds_left(deadline))
+    try:
+        async with timeout:
+            async for item in source:
+                items.append(item)
+                if is_wanted(item):
+                    break
+    except TimeoutError as e:
+        if not timeout.expired():
+            # Raised by the source itself
+            raise
+        on_stall()
+        raise UpstreamStallError("The upstream did not start responding in time") from e
+    return items
+
+
+async def retry_stalls(
+    attempt: Callable[[R], Awaitable[T]],
+    request: R,
+    *,
+    retries: int,
+    backoff: float,
+    prepare_retry: Callable[[R, UpstreamStallError, int], Awaitable[R]],
+) -> tuple[R, T]:
+    """
+    Call `attempt(request)` and, for as long as it stalls (raises
+    `UpstreamStallError`), up to `retries` more times, after a jittered
+    backoff, with the request `prepare_retry(request, error, retry_number)`
+    returns.
+
+    Returns the request of the attempt that succeeded and its result.
+    """
+    retry_number = 0
+    while True:
+        try:
+            return request, await attempt(request)
+        except UpstreamStallError as e:
+            if retry_number >= retries:
+                raise
+            retry_number += 1
+            request = await prepare_retry(request, e, retry_number)
+            await asyncio.sleep(jittered_backoff(retry_number, backoff))
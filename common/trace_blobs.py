@@ -0,0 +1,168 @@
+"""
+Content-addressed storage for the request traces (see `write_request_trace()`
+in `common/tracing_in_markdown.py`). Every message (and every list of tools) is
+stored only once, in `.traces/blobs/`, and the conversation history is stored
+as a chain of nodes, each of which adds a message to the history it refers to.
+A request trace then only contains a reference to its history plus the new
+messages of the turn, instead of the whole conversation.
+
+Usage (print request traces with the references expanded, i.e. in the form
+they would have without the deduplication):
+    uv run python -m common.trace_blobs .traces/<timestamp>_REQUEST.md [...]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Any
+
+from common.config import TRACES_DIR
+
+TRACE_BLOBS_DIR = TRACES_DIR / "blobs"
+
+# The keys that mark the references in the traces
+BLOB_REF = "$blob"
+HISTORY_REF = "$history"
+
+# The blobs (and history nodes) known to exist, so they aren't looked up on
+# the disk over and over again
+_known_blobs: set[str] = set()
+_MAX_KNOWN_BLOBS = 100_000
+
+_JSON_BLOCK_PATTERN = re.compile(r"```json\n(.*?)\n```", re.DOTALL)
+
+
+def _to_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _digest(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _blob_path(digest: str) -> Path:
+    return TRACE_BLOBS_DIR / digest[:2] / f"{digest}.json"
+
+
+def _blob_exists(digest: str) -> bool:
+    return digest in _known_blobs or _blob_path(digest).exists()
+
+
+def _put_blob(digest: str, content: str) -> None:
+    if digest in _known_blobs:
+        return
+    path = _blob_path(digest)
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # (The worker processes may be writing the same blob at the same time)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    if len(_known_blobs) >= _MAX_KNOWN_BLOBS:
+        _known_blobs.clear()
+    _known_blobs.add(digest)
+
+
+def store_blob(value: Any) -> dict[str, str]:
+    """
+    Store a JSON-serializable value and return the reference to it.
+    """
+    content = _to_json(value)
+    digest = _digest(content)
+    _put_blob(digest, content)
+    return {BLOB_REF: digest}
+
+
+def store_history(messages: list) -> dict[str, Any]:
+    """
+    Store the messages of a request and return the reference to them, along
+    with the messages that weren't part of any previously stored history (the
+    turn's delta, for the trace to be readable as is).
+    """
+    message_digests = []
+    # The ID of the history up to (and including) each message
+    history_ids = []
+    history_id = ""
+    for message in messages:
+        content = _to_json(message)
+        digest = _digest(content)
+        _put_blob(digest, content)
+        message_digests.append(digest)
+        history_id = _digest(f"{history_id}:{digest}")
+        history_ids.append(history_id)
+
+    # The longest history that is already stored (usually the previous turn)
+    num_previous = len(history_ids)
+    while num_previous > 0 and not _blob_exists(history_ids[num_previous - 1]):
+        num_previous -= 1
+
+    # (A node per message, so that the next turn can refer to any prefix of
+    # this history - Claude Code e.g. moves the `cache_control` markers from
+    # the previous turn's messages to the new ones)
+    for idx in range(num_previous, len(history_ids)):
+        node = {"parent": history_ids[idx - 1] if idx else None, "message": message_digests[idx]}
+        _put_blob(history_ids[idx], _to_json(node))
+
+    return {
+        HISTORY_REF: history_id or None,
+        "previous_messages": num_previous,
+        "new_messages": messages[num_previous:],
+    }
+
+
+def load_blob(digest: str) -> Any:
+    return json.loads(_blob_path(digest).read_text(encoding="utf-8"))
+
+
+def load_history(history_id: Any) -> list:
+    message_digests = []
+    while history_id:
+        node = load_blob(history_id)
+        message_digests.append(node["message"])
+        history_id = node["parent"]
+    return [load_blob(digest) for digest in reversed(message_digests)]
+
+
+def expand_references(value: Any) -> Any:
+    if isinstance(value, dict):
+        if HISTORY_REF in value:
+            return load_history(value[HISTORY_REF])
+        if BLOB_REF in value and len(value) == 1:
+            return expand_references(load_blob(value[BLOB_REF]))
+        return {key: expand_references(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [expand_references(item) for item in value]
+    return value
+
+
+def expand_trace(text: str) -> str:
+    """
+    The markdown of a trace with the references in its JSON blocks expanded.
+    """
+
+    def expand_json_block(match: re.Match) -> str:
+        try:
+            value = json.loads(match.group(1))
+        except ValueError:
+            return match.group(0)
+        return f"```json\n{json.dumps(expand_references(value), indent=2)}\n```"
+
+    return _JSON_BLOCK_PATTERN.sub(expand_json_block, text)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="+", type=Path, help="The trace files to print")
+    args = parser.parse_args()
+
+    for trace in args.traces:
+        print(expand_trace(trace.read_text(encoding="utf-8")))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import json
-from typing import Optional
+from typing import Optional, Union
 
 from litellm import ModelResponse, ResponsesAPIResponse
 
-from common.config import TRACES_DIR
+from common.config import DEDUPLICATE_TRACES, TRACES_DIR
+from common.trace_blobs import store_blob, store_history
 
 
 def write_request_trace(  # pylint: disable=unused-argument
@@ -23,11 +24,22 @@ def write_request_trace(  # pylint: disable=unused-argument
         # TODO Replace with a warning instead ?
         raise FileExistsError(f"File {file} already exists")
 
+    if DEDUPLICATE_TRACES:
+        # Only the new messages of the turn (and a reference to the rest of
+        # the conversation) are written to the trace
+        messages_complapi = _deduplicate_messages(messages_complapi)
+        messages_respapi = _deduplicate_messages(messages_respapi)
+        params_complapi = _deduplicate_params(params_complapi)
+        params_respapi = _deduplicate_params(params_respapi)
+
     with file.open("w", encoding="utf-8") as f:
         f.write(f"# {calling_method.upper()}\n\n")
 
         f.write("## Request Messages\n\n")
 
+        if DEDUPLICATE_TRACES:
+            f.write(f"(For the full conversation run `uv run python -m common.trace_blobs {file}`)\n\n")
+
         # # TODO Any way to make the difference between the original and the
         # #  other messages more intuitive ?
         # if messages_original is not None and (messages_complapi is None or messages_original != messages_complapi):
@@ -59,6 +71,18 @@ def write_request_trace(  # pylint: disable=unused-argument
             f.write(f"```json\n{json.dumps(params_respapi, indent=2)}\n```\n")
 
 
+def _deduplicate_messages(messages: Optional[list]) -> Optional[Union[list, dict]]:
+    if messages is None:
+        return None
+    return store_history(messages)
+
+
+def _deduplicate_params(params: Optional[dict]) -> Optional[dict]:
+    if not params or not params.get("tools"):
+        return params
+    return {**params, "tools": store_blob(params["tools"])}
+
+
 def write_response_trace(
     *,
     timestamp: str,
@@ -3,15 +3,20 @@
 """
 NOTE: The utilities in this module were mostly vibe-coded without review.
 """
+
 import json
 import os
 from copy import deepcopy
+from contextvars import ContextVar
 from datetime import UTC, datetime
 from typing import Any, Optional, Union
 
-from litellm import GenericStreamingChunk, ModelResponse, ResponsesAPIResponse
+from litellm import GenericStreamingChunk, ModelResponse, ResponsesAPIResponse, Usage
 import json as _json_for_telemetry
 
+from common.flight_recorder import StreamFlightRecorder, dump_flight_recording
+from common.metrics import PROXY_METRICS
+
 
 class ProxyError(RuntimeError):
     def __init__(self, error: Union[BaseException, str], highlight: Optional[bool] = None):
@@ -47,21 +52,81 @@ def env_var_to_bool(value: Optional[str], default: str = "false") -> bool:
     return (value or default).lower() in ("true", "1", "on", "yes", "y")
 
 
-# TODO Refactor to avoid using global state if possible
-# Minimal state to accumulate Responses function_call arguments across chunks
-_RESPONSES_TOOL_STATE: dict[str, dict[str, Any]] = {}
-# Track which Responses tool item (by item_id) we have adopted for this turn.
-# We only ever emit a single tool_use for the adopted item.
-_RESPONSES_TOOL_ADOPTED: Optional[str] = None
+_IMMUTABLE_JSON_TYPES = frozenset((str, int, float, bool, type(None)))
+
+
+def copy_json_like(value: Any) -> Any:
+    """
+    Copy the dicts and lists of a JSON-like value (e.g. the messages of a
+    request) so they can be modified independently of the original, but share
+    the strings and the other immutable values with it. Much cheaper than
+    `deepcopy()` on a long conversation (no memo of every object in it).
+    Anything else is deep-copied.
+    """
+    value_type = type(value)
+    if value_type is dict:
+        return {
+            key: item if type(item) in _IMMUTABLE_JSON_TYPES else copy_json_like(item) for key, item in value.items()
+        }
+    if value_type is list:
+        return [item if type(item) in _IMMUTABLE_JSON_TYPES else copy_json_like(item) for item in value]
+    if value_type in _IMMUTABLE_JSON_TYPES:
+        return value
+    return deepcopy(value)
+
+
 _RESPONSES_TOOL_DEBUG = os.environ.get("RESPONSES_TOOL_DEBUG", "0") not in ("0", "", "false", "False")
 _RESPONSES_TELEMETRY_ENABLED = os.environ.get("RESPONSES_TOOL_TELEMETRY", "0") not in ("0", "", "false", "False")
 
-_RESPONSES_TELEMETRY: dict[str, Any] = {
-    "saw_tool_items": 0,
-    "extra_tool_items_ignored": 0,
-    "adopted_item_id": None,
-    "adopted_output_index": None,
-}
+
+class ResponsesStreamState:
+    """
+    Per-stream state needed to convert Responses API events into
+    GenericStreamingChunks. Kept in a context variable, so concurrent streams
+    (within the same worker) don't interfere with each other.
+    """
+
+    def __init__(self) -> None:
+        # Minimal state to accumulate Responses function_call arguments across
+        # chunks
+        self.tool_state: dict[str, dict[str, Any]] = {}
+        # Track which Responses tool item (by item_id) we have adopted for this
+        # turn. We only ever emit a single tool_use for the adopted item.
+        self.tool_adopted: Optional[str] = None
+        self.telemetry: dict[str, Any] = {
+            "saw_tool_items": 0,
+            "extra_tool_items_ignored": 0,
+            "adopted_item_id": None,
+            "adopted_output_index": None,
+        }
+        # Always on (see `common/flight_recorder.py`)
+        self.flight_recorder = StreamFlightRecorder()
+
+    def clear(self) -> None:
+        self.tool_state.clear()
+        self.tool_adopted = None
+
+
+_RESPONSES_STREAM_STATE: ContextVar[Optional[ResponsesStreamState]] = ContextVar(
+    "_RESPONSES_STREAM_STATE", default=None
+)
+
+
+def start_responses_stream() -> ResponsesStreamState:
+    """
+    Start tracking a new stream (call it before converting the first chunk of
+    every stream).
+    """
+    stream_state = ResponsesStreamState()
+    _RESPONSES_STREAM_STATE.set(stream_state)
+    return stream_state
+
+
+def _get_responses_stream_state() -> ResponsesStreamState:
+    stream_state = _RESPONSES_STREAM_STATE.get()
+    if stream_state is None:
+        stream_state = start_responses_stream()
+    return stream_state
 
 
 def _log_responses_tool(msg: str) -> None:
@@ -82,7 +147,7 @@ def _telemetry(event: str, **fields: Any) -> None:
 
 
 def _maybe_emit_tool(item_id: str, default_index: int = 0) -> Optional[dict[str, Any]]:
-    state = _RESPONSES_TOOL_STATE.get(item_id)
+    state = _get_responses_stream_state().tool_state.get(item_id)
     if not state or state.get("emitted"):
         return None
     if not state.get("args_done"):
@@ -116,12 +181,13 @@ def responses_eof_finalize_chunk() -> Optional[GenericStreamingChunk]:
     JSON, emit a single tool_use. Otherwise emit an assistant-visible error.
     Always clears internal tool state.
     """
+    stream_state = _get_responses_stream_state()
     try:
-        adopted = _RESPONSES_TOOL_ADOPTED
-        if not adopted or adopted not in _RESPONSES_TOOL_STATE:
+        adopted = stream_state.tool_adopted
+        if not adopted or adopted not in stream_state.tool_state:
             # Nothing pending
             return None
-        state = _RESPONSES_TOOL_STATE.get(adopted, {})
+        state = stream_state.tool_state.get(adopted, {})
         if state.get("emitted"):
             return None
         args_str = state.get("args", "")
@@ -136,6 +202,7 @@ def responses_eof_finalize_chunk() -> Optional[GenericStreamingChunk]:
             args_ok = True
 
         if args_ok:
+            stream_state.flight_recorder.record("eof_fallback", adopted, len(args_str or ""))
             tool_use = {
                 "index": state.get("index", 0),
                 "id": state.get("id"),
@@ -157,6 +224,8 @@ def responses_eof_finalize_chunk() -> Optional[GenericStreamingChunk]:
             return chunk
         # Emit an assistant-visible error if args could not be finalized
         err = "Provider ended stream before tool arguments were finalized."
+        stream_state.flight_recorder.record("eof_fallback_error", adopted, len(args_str or ""))
+        dump_flight_recording("eof_fallback_error", stream_state.flight_recorder, detail=err)
         return {
             "text": err,
             "is_finished": False,
@@ -168,11 +237,8 @@ def responses_eof_finalize_chunk() -> Optional[GenericStreamingChunk]:
         }
     finally:
         # Clear state regardless
-        try:
-            _RESPONSES_TOOL_STATE.clear()
-        except Exception:
-            pass
-        _RESPONSES_TOOL_ADOPTED = None
+        stream_state.tool_state.clear()
+        stream_state.tool_adopted = None
 
 
 def generate_timestamp_utc() -> str:
@@ -191,6 +257,34 @@ def generate_timestamp_utc() -> str:
     return f"{str_repr[:-3]}_{str_repr[-3:]}"
 
 
+def to_litellm_usage(usage: Any) -> Optional[Usage]:
+    """
+    Normalize the usage reported by either API (prompt/completion tokens in
+    ChatCompletions, input/output tokens in the Responses API) into LiteLLM's
+    Usage, keeping the cached and the reasoning tokens.
+    """
+    if usage is None or isinstance(usage, Usage):
+        return usage
+
+    def _get(obj: Any, key: str) -> Any:
+        if isinstance(obj, dict):
+            return obj.get(key)
+        return getattr(obj, key, None)
+
+    prompt_tokens = _get(usage, "prompt_tokens") or _get(usage, "input_tokens") or 0
+    completion_tokens = _get(usage, "completion_tokens") or _get(usage, "output_tokens") or 0
+    total_tokens = _get(usage, "total_tokens") or prompt_tokens + completion_tokens
+    prompt_tokens_details = _get(usage, "prompt_tokens_details") or _get(usage, "input_tokens_details")
+    completion_tokens_details = _get(usage, "completion_tokens_details") or _get(usage, "output_tokens_details")
+    return Usage(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        total_tokens=total_tokens,
+        prompt_tokens_details={"cached_tokens": _get(prompt_tokens_details, "cached_tokens") or 0},
+        completion_tokens_details={"reasoning_tokens": _get(completion_tokens_details, "reasoning_tokens") or 0},
+    )
+
+
 def to_generic_streaming_chunk(chunk: Any) -> GenericStreamingChunk:
     """
     Best-effort convert a LiteLLM ModelResponseStream chunk into
@@ -200,8 +294,10 @@ def to_generic_streaming_chunk(chunk: Any) -> GenericStreamingChunk:
       - text: str (required)
       - is_finished: bool (required)
       - finish_reason: str (required)
-      - usage: Optional[ChatCompletionUsageBlock] (we pass None for incremental
-        chunks)
+      - usage: Optional[ChatCompletionUsageBlock] (a dumped LiteLLM Usage,
+        which also carries the cached and the reasoning tokens, on the chunk
+        that reports the usage of the whole response - None on the rest of
+        them; LiteLLM expects a mapping here)
       - index: int (default 0)
       - tool_use: Optional[ChatCompletionToolCallChunk] (default None)
       - provider_specific_fields: Optional[dict]
@@ -213,12 +309,21 @@ def to_generic_streaming_chunk(chunk: Any) -> GenericStreamingChunk:
     index: int = 0
     provider_specific_fields: Optional[dict[str, Any]] = None
     tool_use: Optional[dict[str, Any]] = None
+    usage: Optional[Usage] = None
 
     try:
         # chunk may be a pydantic object with attributes
         choices = getattr(chunk, "choices", None)
         provider_specific_fields = getattr(chunk, "provider_specific_fields", None)
 
+        # ChatCompletions report the usage in the last chunk (requested with
+        # `stream_options.include_usage`), the Responses API - in the terminal
+        # event (`response.completed`, etc.)
+        raw_usage = getattr(chunk, "usage", None)
+        if raw_usage is None:
+            raw_usage = getattr(getattr(chunk, "response", None), "usage", None)
+        usage = to_litellm_usage(raw_usage)
+
         if isinstance(choices, list) and choices:
             choice = choices[0]
             # Try common OpenAI-like shapes
@@ -381,17 +486,41 @@ def to_generic_streaming_chunk(chunk: Any) -> GenericStreamingChunk:
     except Exception as e:
         raise ProxyError(f"Failed to convert to GenericStreamingChunk: {e}") from e
 
+    _record_stream_event(chunk, text, finish_reason)
+
     return {
         "text": text,
         "is_finished": is_finished,
         "finish_reason": finish_reason,
-        "usage": None,  # TODO Do we have to put anything in here ?
+        "usage": usage.model_dump() if usage is not None else None,
         "index": index,
         "tool_use": tool_use,
         "provider_specific_fields": provider_specific_fields,
     }
 
 
+def _record_stream_event(chunk: Any, text: str, finish_reason: str) -> None:
+    flight_recorder = _get_responses_stream_state().flight_recorder
+    chunk_type = getattr(chunk, "type", None)
+    if chunk_type is None:
+        # A ChatCompletions chunk
+        chunk_type = "chat.completion.chunk"
+    else:
+        chunk_type = getattr(chunk_type, "value", chunk_type)
+    # (The Responses API sends the tool arguments as deltas too)
+    delta = getattr(chunk, "delta", None)
+    size = len(delta) if isinstance(delta, str) else len(text)
+    item_id = getattr(chunk, "item_id", None)
+    if item_id is None:
+        # E.g. `response.output_item.added`
+        item = getattr(chunk, "item", None)
+        item_id = item.get("id") if isinstance(item, dict) else getattr(item, "id", None)
+    flight_recorder.record(chunk_type, item_id, size)
+
+    if finish_reason == "error":
+        dump_flight_recording("finish_reason_error", flight_recorder)
+
+
 _INPUT_TYPE_ALIASES = {
     "text": "input_text",
     "input_text": "input_text",
@@ -784,7 +913,7 @@ def _default_content_type_for_role(role: str) -> str:
 
 
 def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
-    global _RESPONSES_TOOL_ADOPTED
+    stream_state = _get_responses_stream_state()
 
     def _get(obj: Any, key: str, default: Any = None) -> Any:
         if isinstance(obj, dict):
@@ -879,7 +1008,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                 # Track this function call by its item id
                 item_id_for_state = _get(item, "id")
                 if isinstance(item_id_for_state, str) and item_id_for_state:
-                    state = _RESPONSES_TOOL_STATE[item_id_for_state]
+                    state = stream_state.tool_state[item_id_for_state]
                 else:
                     state = {
                         "item_id": item_id_for_state,
@@ -892,7 +1021,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                         "index": index,
                         "raw_item": None,
                     }
-                    _RESPONSES_TOOL_STATE[item_id_for_state] = state
+                    stream_state.tool_state[item_id_for_state] = state
 
                 state["name"] = state.get("name") or (name if isinstance(name, str) else None)
                 state["id"] = state.get("id") or (call_id if isinstance(call_id, str) else None)
@@ -900,18 +1029,20 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                 _log_responses_tool(
                     f"output_item.added item_id={item_id_for_state} name={state.get('name')} call_id={state.get('id')}"
                 )
-                _RESPONSES_TELEMETRY["saw_tool_items"] = _RESPONSES_TELEMETRY.get("saw_tool_items", 0) + 1
-                if _RESPONSES_TOOL_ADOPTED is None and isinstance(item_id_for_state, str):
-                    _RESPONSES_TELEMETRY["adopted_item_id"] = item_id_for_state
-                    _RESPONSES_TELEMETRY["adopted_output_index"] = index
+                stream_state.telemetry["saw_tool_items"] = stream_state.telemetry.get("saw_tool_items", 0) + 1
+                PROXY_METRICS.inc("responses_tool_items_seen")
+                if stream_state.tool_adopted is None and isinstance(item_id_for_state, str):
+                    stream_state.telemetry["adopted_item_id"] = item_id_for_state
+                    stream_state.telemetry["adopted_output_index"] = index
                 elif (
-                    _RESPONSES_TOOL_ADOPTED is not None
+                    stream_state.tool_adopted is not None
                     and isinstance(item_id_for_state, str)
-                    and _RESPONSES_TOOL_ADOPTED != item_id_for_state
+                    and stream_state.tool_adopted != item_id_for_state
                 ):
-                    _RESPONSES_TELEMETRY["extra_tool_items_ignored"] = (
-                        _RESPONSES_TELEMETRY.get("extra_tool_items_ignored", 0) + 1
+                    stream_state.telemetry["extra_tool_items_ignored"] = (
+                        stream_state.telemetry.get("extra_tool_items_ignored", 0) + 1
                     )
+                    PROXY_METRICS.inc("responses_extra_tool_items_ignored")
                 tool_use = _maybe_emit_tool(item_id_for_state, default_index=index)
 
     # Accumulate streaming function_call arguments
@@ -919,7 +1050,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
         item_id = _get(chunk, "item_id")
         delta_text = _get(chunk, "delta")
         if isinstance(item_id, str) and isinstance(delta_text, str):
-            state = _RESPONSES_TOOL_STATE.get(item_id)
+            state = stream_state.tool_state.get(item_id)
             if state is None:
                 state = {
                     "item_id": item_id,
@@ -932,10 +1063,10 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                     "index": index,
                     "raw_item": None,
                 }
-                _RESPONSES_TOOL_STATE[item_id] = state
+                stream_state.tool_state[item_id] = state
             # Adopt the first item we see args for
-            if _RESPONSES_TOOL_ADOPTED is None:
-                _RESPONSES_TOOL_ADOPTED = item_id
+            if stream_state.tool_adopted is None:
+                stream_state.tool_adopted = item_id
                 _log_responses_tool(f"adopted tool item_id={item_id} via arguments.delta")
             state["args"] = (state.get("args") or "") + delta_text
             tool_use = _maybe_emit_tool(item_id, default_index=index)
@@ -946,7 +1077,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
         item_id = _get(chunk, "item_id")
         delta_text = _get(chunk, "delta")
         if isinstance(item_id, str) and isinstance(delta_text, str):
-            state = _RESPONSES_TOOL_STATE.get(item_id)
+            state = stream_state.tool_state.get(item_id)
             if state is None:
                 state = {
                     "item_id": item_id,
@@ -959,22 +1090,22 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                     "index": index,
                     "raw_item": None,
                 }
-                _RESPONSES_TOOL_STATE[item_id] = state
-            if _RESPONSES_TOOL_ADOPTED is None:
-                _RESPONSES_TOOL_ADOPTED = item_id
+                stream_state.tool_state[item_id] = state
+            if stream_state.tool_adopted is None:
+                stream_state.tool_adopted = item_id
                 _log_responses_tool(f"adopted tool item_id={item_id} via input_json.delta")
             state["args"] = (state.get("args") or "") + delta_text
 
     # Finalize args on done
     if chunk_type == "response.function_call_arguments.done":
         item_id = _get(chunk, "item_id")
-        if isinstance(item_id, str) and item_id in _RESPONSES_TOOL_STATE:
+        if isinstance(item_id, str) and item_id in stream_state.tool_state:
             # If we haven't adopted yet (no deltas ever), adopt now
-            if _RESPONSES_TOOL_ADOPTED is None:
-                _RESPONSES_TOOL_ADOPTED = item_id
+            if stream_state.tool_adopted is None:
+                stream_state.tool_adopted = item_id
                 _log_responses_tool(f"adopted tool item_id={item_id} via arguments.done")
-            state = _RESPONSES_TOOL_STATE[item_id]
-            if _RESPONSES_TOOL_ADOPTED == item_id and not state.get("emitted"):
+            state = stream_state.tool_state[item_id]
+            if stream_state.tool_adopted == item_id and not state.get("emitted"):
                 _apply_tool_identity(state)
                 final_args = _get(chunk, "arguments")
                 if isinstance(final_args, (dict, list)):
@@ -995,8 +1126,8 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
             item_type = _get(item, "type")
             if item_type in {"function_call", "tool_call"}:
                 item_id = _get(item, "id")
-                if isinstance(item_id, str) and item_id in _RESPONSES_TOOL_STATE:
-                    state = _RESPONSES_TOOL_STATE[item_id]
+                if isinstance(item_id, str) and item_id in stream_state.tool_state:
+                    state = stream_state.tool_state[item_id]
                     if not state.get("emitted"):
                         _apply_tool_identity(state, fallback=item)
                         final_args = _get(item, "arguments")
@@ -1011,12 +1142,12 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                             state["args_done"] = True
                         tool_use = _maybe_emit_tool(item_id, default_index=index)
                     try:
-                        del _RESPONSES_TOOL_STATE[item_id]
+                        del stream_state.tool_state[item_id]
                     except Exception:
                         pass
                     # Clear adoption if it was this item
-                    if _RESPONSES_TOOL_ADOPTED == item_id:
-                        _RESPONSES_TOOL_ADOPTED = None
+                    if stream_state.tool_adopted == item_id:
+                        stream_state.tool_adopted = None
 
     # Suppress generic function/tool_call emissions mid-stream; we only emit
     # once on *.arguments.done / output_item.done / completed fallback.
@@ -1045,7 +1176,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                                     "Failed to convert Responses output tool_call arguments to string"
                                 ) from exc
                         call_id = _get(item, "id") or _get(item, "call_id") or _get(item, "tool_call_id")
-                        if _RESPONSES_TOOL_ADOPTED is None or _RESPONSES_TOOL_ADOPTED == _get(item, "id"):
+                        if stream_state.tool_adopted is None or stream_state.tool_adopted == _get(item, "id"):
                             final_args = arguments if isinstance(arguments, str) and arguments else "{}"
                             fallback_state = {
                                 "item_id": _get(item, "id"),
@@ -1057,7 +1188,7 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
                                 "index": index,
                                 "raw_item": deepcopy(item),
                             }
-                            _RESPONSES_TOOL_STATE[_get(item, "id")] = fallback_state
+                            stream_state.tool_state[_get(item, "id")] = fallback_state
                             tool_use = _maybe_emit_tool(_get(item, "id"), default_index=index)
                         break
 
@@ -1079,11 +1210,8 @@ def _try_parse_responses_chunk(chunk: Any) -> Optional[dict[str, Any]]:
         "response.cancelled",
         "response.error",
     }:
-        try:
-            _RESPONSES_TOOL_STATE.clear()
-        except Exception:
-            pass
-        _RESPONSES_TOOL_ADOPTED = None
+        stream_state.tool_state.clear()
+        stream_state.tool_adopted = None
 
     provider_specific_fields: dict[str, Any] = {"responses_type": chunk_type}
     for key in ("response_id", "output_index", "item_id", "id", "status"):
@@ -1130,19 +1258,9 @@ def convert_respapi_to_model_response(respapi_response: ResponsesAPIResponse) ->
     if metadata is not None:
         model_response["metadata"] = deepcopy(metadata)
 
-    usage = _get(respapi_response, "usage")
-    if isinstance(usage, dict):
-        # Responses API uses input_tokens/output_tokens, Chat Completions uses prompt_tokens/completion_tokens
-        prompt_tokens = usage.get("prompt_tokens") or usage.get("input_tokens")
-        completion_tokens = usage.get("completion_tokens") or usage.get("output_tokens")
-        total_tokens = usage.get("total_tokens")
-        if prompt_tokens is not None and completion_tokens is not None and total_tokens is None:
-            total_tokens = prompt_tokens + completion_tokens
-        model_response["usage"] = {
-            "prompt_tokens": prompt_tokens,
-            "completion_tokens": completion_tokens,
-            "total_tokens": total_tokens,
-        }
+    usage = to_litellm_usage(_get(respapi_response, "usage"))
+    if usage is not None:
+        model_response["usage"] = usage
 
     text_segments: list[str] = []
     tool_calls: list[dict[str, Any]] = []
@@ -1214,6 +1332,58 @@ def convert_respapi_to_model_response(respapi_response: ResponsesAPIResponse) ->
     return ModelResponse(**model_response)
 
 
+def assemble_model_response(generic_chunks: list[GenericStreamingChunk], model: str) -> ModelResponse:
+    """
+    Assemble a (non-streaming) ModelResponse out of the GenericStreamingChunks
+    of a complete stream.
+    """
+    text_segments: list[str] = []
+    tool_calls: list[dict[str, Any]] = []
+    tool_calls_by_index: dict[int, dict[str, Any]] = {}
+    finish_reason: Optional[str] = None
+    usage: Optional[Usage] = None
+
+    for chunk in generic_chunks:
+        if chunk.get("text"):
+            text_segments.append(chunk["text"])
+
+        tool_use = chunk.get("tool_use")
+        if tool_use:
+            function = tool_use.get("function") or {}
+            index = tool_use.get("index") or 0
+            tool_call = tool_calls_by_index.get(index)
+            if tool_call is None or (tool_use.get("id") and tool_use["id"] != tool_call["id"]):
+                # A new tool call (ChatCompletions streams the arguments of a
+                # tool call in pieces - only the first piece has the id)
+                tool_call = {
+                    "id": tool_use.get("id"),
+                    "type": tool_use.get("type") or "function",
+                    "function": {"name": function.get("name"), "arguments": ""},
+                }
+                tool_calls_by_index[index] = tool_call
+                tool_calls.append(tool_call)
+            elif function.get("name") and not tool_call["function"]["name"]:
+                tool_call["function"]["name"] = function["name"]
+            tool_call["function"]["arguments"] += function.get("arguments") or ""
+
+        if chunk.get("finish_reason"):
+            finish_reason = chunk["finish_reason"]
+        if chunk.get("usage"):
+            usage = to_litellm_usage(chunk["usage"])
+
+    message: dict[str, Any] = {"role": "assistant", "content": "".join(text_segments)}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+
+    model_response: dict[str, Any] = {
+        "model": model,
+        "choices": [{"index": 0, "finish_reason": finish_reason or "stop", "message": message}],
+    }
+    if usage is not None:
+        model_response["usage"] = usage
+    return ModelResponse(**model_response)
+
+
 def _flatten_responses_text(content: Any) -> str:
     if isinstance(content, str):
         return content
@@ -0,0 +1,21 @@
+#!/bin/bash
+
+# Start the LiteLLM server with the proxy's config (this is what the Docker
+# images run). Set PROXY_NUM_WORKERS to the number of worker processes to run,
+# or to "auto" to run one worker per available CPU.
+
+set -e
+LITELLM_CONFIG="${LITELLM_CONFIG:-config.yaml}"
+LITELLM_PORT="${LITELLM_PORT:-4000}"
+LITELLM_HOST="${LITELLM_HOST:-0.0.0.0}"
+
+PROXY_NUM_WORKERS="${PROXY_NUM_WORKERS:-1}"
+if [ "${PROXY_NUM_WORKERS}" = "auto" ]; then
+    PROXY_NUM_WORKERS="$(nproc)"
+fi
+# The workers use it to split the upstream connection limits between them
+export PROXY_NUM_WORKERS
+
+echo "⚙️  Workers: ${PROXY_NUM_WORKERS}"
+exec litellm --config "${LITELLM_CONFIG}" --port "${LITELLM_PORT}" --host "${LITELLM_HOST}" \
+    --num_workers "${PROXY_NUM_WORKERS}"
@@ -21,4 +21,4 @@ echo "   claude"
 echo ""
 echo ""
 echo "Starting..."
-uv run litellm --config "${LITELLM_CONFIG}" --port "${LITELLM_PORT}" --host "0.0.0.0"
+LITELLM_CONFIG="${LITELLM_CONFIG}" LITELLM_PORT="${LITELLM_PORT}" uv run ./run-server.sh
@@ -0,0 +1,3 @@
+from common.lazy_custom_llm import LazyCustomLLM
+
+yoda_speak_llm = LazyCustomLLM("yoda_example.yoda_speak.yoda_speak_llm")